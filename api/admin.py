@@ -2,8 +2,10 @@ from django.contrib import admin
 from .models import *
 
 # Register your models here.
+admin.site.register(Category)
 admin.site.register(Product)
 admin.site.register(Review)
 admin.site.register(Order)
 admin.site.register(OrderItem)
-admin.site.register(ShippingAddress)
\ No newline at end of file
+admin.site.register(ShippingAddress)
+admin.site.register(Job)
\ No newline at end of file
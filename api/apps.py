@@ -1,6 +1,32 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.migrations.loader import MigrationLoader
+from django.db.models.signals import post_delete, post_migrate, post_save
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        post_migrate.connect(install_search_triggers, sender=self)
+
+        from django.contrib.auth import get_user_model
+        from .authentication import user_changed
+        post_save.connect(user_changed, sender=get_user_model())
+        post_delete.connect(user_changed, sender=get_user_model())
+
+        if settings.PERFORMANCE_METRICS:
+            from .metrics import install_query_timer
+            connection_created.connect(install_query_timer)
+
+
+def install_search_triggers(sender, using='default', **kwargs):
+    from . import search
+
+    # The trigger definitions match the latest schema only
+    loader = MigrationLoader(connections[using])
+    if set(loader.graph.leaf_nodes(sender.label)) <= set(loader.applied_migrations):
+        search.install_triggers(using)
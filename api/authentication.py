@@ -0,0 +1,97 @@
+"""
+JWT authentication without a user query on every request.
+
+Access tokens live for a month, yet simplejwt's JWTAuthentication loads the
+token's user from the database on each request. CachedJWTAuthentication
+keeps the users it resolved in a small per-process LRU for
+AUTH_USER_CACHE_TIMEOUT seconds. Saving or deleting a user evicts it (see
+ApiConfig), so a demoted or deleted account loses its access on the next
+request served by the same process; other worker processes notice within
+the timeout.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+
+class UserCache:
+    """Bounded, thread-safe map of user id -> (expiry, user)."""
+
+    def __init__(self):
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped by every eviction, so a lookup that raced with a write is not stored
+        self.generation = 0
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._users[user_id]
+                return None
+            self._users.move_to_end(user_id)
+            return entry[1]
+
+    def set(self, user_id, user, generation):
+        timeout = settings.AUTH_USER_CACHE_TIMEOUT
+        if timeout <= 0:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._users[user_id] = (time.monotonic() + timeout, user)
+            self._users.move_to_end(user_id)
+            while len(self._users) > settings.AUTH_USER_CACHE_SIZE:
+                self._users.popitem(last=False)
+
+    def forget(self, user_id):
+        with self._lock:
+            self.generation += 1
+            self._users.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._users.clear()
+
+    def __len__(self):
+        return len(self._users)
+
+
+users = UserCache()
+
+
+def user_changed(sender, instance, **kwargs):
+    """post_save/post_delete receiver for the user model, connected by ApiConfig."""
+    users.forget(str(getattr(instance, api_settings.USER_ID_FIELD)))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        try:
+            user_id = str(validated_token[api_settings.USER_ID_CLAIM])
+        except KeyError as e:
+            raise InvalidToken(_('Token contained no recognizable user identification')) from e
+
+        user = users.get(user_id)
+        if user is None:
+            generation = users.generation
+            # Checks the user exists and is active
+            user = super().get_user(validated_token)
+            users.set(user_id, user, generation)
+        elif api_settings.CHECK_REVOKE_TOKEN and (
+                validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password)):
+            raise AuthenticationFailed(_("The user's password has been changed."), code='password_changed')
+
+        # Views modify request.user, each request gets its own instance
+        return copy.copy(user)
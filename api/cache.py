@@ -0,0 +1,136 @@
+"""
+Versioned cache for the public catalog payloads.
+
+Serialized responses are stored under keys that embed the current catalog
+version. Any catalog write bumps the version, which retires every cached
+payload at once without having to know which keys exist. Works with any
+Django cache backend; use a shared one (file, Redis) when running several
+worker processes so they agree on the version.
+"""
+import asyncio
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+VERSION_KEY = 'catalog:version'
+WAIT_INTERVAL = 0.05
+
+_stats = {'hits': 0, 'misses': 0, 'rebuilds': 0, 'waits': 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def get_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats['hits'] + stats['misses']
+    stats['hitRatio'] = round(stats['hits'] / lookups, 4) if lookups else None
+    stats['version'] = catalog_version()
+    return stats
+
+
+def catalog_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Start from the clock so an evicted version never reuses old keys
+        cache.add(VERSION_KEY, int(time.time() * 1000), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+async def acatalog_version():
+    version = await cache.aget(VERSION_KEY)
+    if version is None:
+        await cache.aadd(VERSION_KEY, int(time.time() * 1000), timeout=None)
+        version = await cache.aget(VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        catalog_version()
+
+
+def make_key(name, *parts):
+    return _key(catalog_version(), name, parts)
+
+
+def _key(version, name, parts):
+    digest = hashlib.md5(repr(parts).encode()).hexdigest()
+    return 'catalog:%s:%s:%s' % (version, name, digest)
+
+
+def get_or_build(name, build, *parts):
+    """
+    Return the cached payload for `name` and `parts`, calling `build()` on a
+    miss. Only one caller rebuilds a cold key; the others wait for it for up
+    to CATALOG_CACHE_LOCK_TIMEOUT seconds before building it themselves.
+    """
+    key = make_key(name, *parts)
+    payload = cache.get(key)
+    if payload is not None:
+        _count('hits')
+        return payload
+    _count('misses')
+
+    lock_timeout = settings.CATALOG_CACHE_LOCK_TIMEOUT
+    lock_key = key + ':lock'
+    acquired = cache.add(lock_key, 1, timeout=lock_timeout)
+    if not acquired:
+        _count('waits')
+        deadline = time.monotonic() + lock_timeout
+        while time.monotonic() < deadline:
+            time.sleep(WAIT_INTERVAL)
+            payload = cache.get(key)
+            if payload is not None:
+                return payload
+
+    try:
+        _count('rebuilds')
+        payload = build()
+        cache.set(key, payload, timeout=settings.CATALOG_CACHE_TIMEOUT)
+        return payload
+    finally:
+        if acquired:
+            cache.delete(lock_key)
+
+
+async def aget_or_build(name, build, *parts):
+    """`get_or_build` for async views; `build` is a coroutine function."""
+    key = _key(await acatalog_version(), name, parts)
+    payload = await cache.aget(key)
+    if payload is not None:
+        _count('hits')
+        return payload
+    _count('misses')
+
+    lock_timeout = settings.CATALOG_CACHE_LOCK_TIMEOUT
+    lock_key = key + ':lock'
+    acquired = await cache.aadd(lock_key, 1, timeout=lock_timeout)
+    if not acquired:
+        _count('waits')
+        deadline = time.monotonic() + lock_timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(WAIT_INTERVAL)
+            payload = await cache.aget(key)
+            if payload is not None:
+                return payload
+
+    try:
+        _count('rebuilds')
+        payload = await build()
+        await cache.aset(key, payload, timeout=settings.CATALOG_CACHE_TIMEOUT)
+        return payload
+    finally:
+        if acquired:
+            await cache.adelete(lock_key)
@@ -0,0 +1,49 @@
+"""
+Product categories and their facet counts.
+
+`Category.productCount` is adjusted with F-expressions whenever a product
+joins or leaves a category, so the facet listing never has to GROUP BY
+the product table. `recount()` repairs the counts in one pass after bulk
+loads.
+"""
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils.text import slugify
+
+from .models import Category, Product
+
+
+def normalize(name):
+    return ' '.join((name or '').split())[:75]
+
+
+def category_slug(name):
+    # Unicode slugs, an ASCII one is empty for an Arabic name
+    return slugify(normalize(name), allow_unicode=True)[:75]
+
+
+def get_or_create_category(name):
+    """The Category for the free-text `name`, matched on its slug; None if blank."""
+    name = normalize(name)
+    slug = category_slug(name)
+    if not slug:
+        return None
+    category, created = Category.objects.get_or_create(slug=slug, defaults={'name': name})
+    return category
+
+
+def product_moved(old_category_id, new_category_id):
+    """Adjust the counts for a product that left one category and/or joined another."""
+    if old_category_id == new_category_id:
+        return
+    if old_category_id:
+        Category.objects.filter(id=old_category_id).update(productCount=F('productCount') - 1)
+    if new_category_id:
+        Category.objects.filter(id=new_category_id).update(productCount=F('productCount') + 1)
+
+
+def recount():
+    counts = (Product.objects.filter(category=OuterRef('pk'))
+                             .order_by().values('category')
+                             .annotate(n=Count('id')).values('n'))
+    return Category.objects.update(productCount=Coalesce(Subquery(counts), Value(0)))
@@ -0,0 +1,72 @@
+"""
+Conditional GET for the product and order endpoints.
+
+Products and orders carry an `updatedAt` that every write path moves
+forward. A single object is validated by its own timestamp; a list by an
+ETag of one aggregate query, the number of rows and the newest timestamp
+among them, which changes whenever a row is added, removed or modified.
+Lists send no Last-Modified: the newest timestamp stays put when a row is
+deleted or the top products are re-ranked, so If-Modified-Since alone
+would keep a stale list. A request whose If-None-Match (or, for a single
+object, If-Modified-Since) still matches is answered 304 before anything
+is loaded or serialized.
+"""
+import hashlib
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+
+def make_etag(*parts):
+    # Weak: the JSON and browsable API renderings of a version share it
+    return 'W/"%s"' % hashlib.md5(repr(parts).encode()).hexdigest()
+
+
+def _validators(updated, parts):
+    if updated is None:
+        return None, None
+    return make_etag(updated.isoformat(), *parts), int(updated.timestamp())
+
+
+def object_validators(queryset, *parts):
+    """`(etag, last_modified)` of the single row of `queryset`, `(None, None)` when there is none."""
+    return _validators(queryset.values_list('updatedAt', flat=True).first(), parts)
+
+
+async def aobject_validators(queryset, *parts):
+    return _validators(await queryset.values_list('updatedAt', flat=True).afirst(), parts)
+
+
+def _list_validators(aggregate, parts):
+    return make_etag(aggregate['count'], aggregate['last'] and aggregate['last'].isoformat(), *parts), None
+
+
+def list_validators(queryset, *parts):
+    """`(etag, None)` of every row of `queryset`, in one aggregate query; lists have no Last-Modified."""
+    return _list_validators(queryset.order_by().aggregate(count=Count('id'), last=Max('updatedAt')), parts)
+
+
+async def alist_validators(queryset, *parts):
+    return _list_validators(await queryset.order_by().aaggregate(count=Count('id'), last=Max('updatedAt')), parts)
+
+
+def not_modified(request, etag, last_modified, private=False):
+    """The 304 response to `request` if the client already has this version, else None."""
+    if etag is None:
+        return None
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        add_validators(response, etag, last_modified, private)
+    return response
+
+
+def add_validators(response, etag, last_modified, private=False):
+    if etag is None:
+        return response
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    # Clients may keep the response but have to check it is still current
+    patch_cache_control(response, no_cache=True, private=private)
+    return response
@@ -0,0 +1,48 @@
+"""
+Helpers for streaming large exports with flat memory use.
+
+Rows are read in primary-key order, one bounded chunk at a time, and
+encoded line by line so a StreamingHttpResponse never holds more than a
+single chunk.
+"""
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+CHUNK_SIZE = 500
+
+
+def iter_chunks(queryset, chunk_size=None):
+    """Yield lists of at most `chunk_size` objects, walking `queryset` by id."""
+    chunk_size = chunk_size or CHUNK_SIZE
+    last_id = None
+    while True:
+        chunk = queryset.order_by('id')
+        if last_id is not None:
+            chunk = chunk.filter(id__gt=last_id)
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+        last_id = chunk[-1].id
+
+
+def ndjson_lines(records):
+    for record in records:
+        yield json.dumps(record, cls=DjangoJSONEncoder) + '\n'
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def csv_lines(header, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
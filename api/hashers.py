@@ -0,0 +1,45 @@
+"""
+Password hashing on a bounded thread pool.
+
+PBKDF2 is the most CPU-expensive thing the API does: one login or one
+password change costs hundreds of milliseconds of a core. The hasher below
+runs every PBKDF2 computation on a pool of PASSWORD_HASHING_WORKERS
+threads. The pool is a bound, not extra concurrency: the request thread
+waits for its hash, but however many logins arrive at once, at most that
+many hashes run in the process and the rest of its request threads keep a
+share of the CPU (hashlib releases the GIL while it hashes). The bound is
+per process; settings divide the cores among the server's worker
+processes. The iteration count of new hashes is PASSWORD_HASH_ITERATIONS,
+Django's default when unset; stored hashes with another count still verify
+and are re-encoded at the next successful login.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASHING_WORKERS,
+                                           thread_name_prefix='passwords')
+    return _executor
+
+
+class PooledPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    # Same algorithm name: existing pbkdf2_sha256 hashes are read by this hasher
+    @property
+    def iterations(self):
+        return settings.PASSWORD_HASH_ITERATIONS or PBKDF2PasswordHasher.iterations
+
+    def encode(self, password, salt, iterations=None):
+        # verify() and harden_runtime() hash through encode() too
+        encode = super().encode
+        return _get_executor().submit(encode, password, salt, iterations).result()
@@ -0,0 +1,110 @@
+"""
+Resized WebP variants of product images.
+
+Listing cards only need a small picture, so every uploaded image gets a
+thumbnail and a medium variant. They are rendered with Pillow by a
+background job (api/jobs.py) once the upload's transaction commits, and
+recorded on `Product.imageVariants` as storage names plus pixel sizes. Until
+they exist the payloads fall back to the original upload.
+"""
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from . import jobs
+from .cache import bump_catalog_version
+from .models import Product
+
+
+# name -> bounding box; images are shrunk to fit, never enlarged
+VARIANTS = {
+    'thumbnail': (200, 200),
+    'medium': (600, 600),
+}
+QUALITY = 80
+FOLDER = 'hardwareImages/variants'
+
+
+def render(image, size):
+    """`image` shrunk to fit `size`, encoded as WebP. Returns (bytes, width, height)."""
+    variant = image.copy()
+    variant.thumbnail(size, Image.LANCZOS)
+    buffer = BytesIO()
+    variant.save(buffer, 'WEBP', quality=QUALITY, method=4)
+    return buffer.getvalue(), variant.width, variant.height
+
+
+def generate_variants(product_id):
+    """Render and store every variant of the product's current image."""
+    product = Product.objects.select_related(None).only('image', 'imageVariants').filter(id=product_id).first()
+    if product is None or not product.image:
+        return None
+
+    source = product.image.name
+    with default_storage.open(source) as f:
+        image = ImageOps.exif_transpose(Image.open(f))
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+    stem = os.path.splitext(os.path.basename(source))[0]
+    variants = {'original': {'width': image.width, 'height': image.height}}
+    for name, size in VARIANTS.items():
+        content, width, height = render(image, size)
+        path = default_storage.save('%s/%s_%s.webp' % (FOLDER, stem, name), ContentFile(content))
+        variants[name] = {'name': path, 'width': width, 'height': height}
+
+    # The image may have been replaced while this one was rendering
+    updated = Product.objects.filter(id=product_id, image=source).update(imageVariants=variants,
+                                                                         updatedAt=timezone.now())
+    if not updated:
+        _delete_files(variants)
+        return None
+
+    _delete_files(product.imageVariants or {}, keep=variants)
+    bump_catalog_version()
+    return variants
+
+
+def clear_variants(product):
+    """Forget the variants of an image that is being replaced, and delete their files."""
+    _delete_files(product.imageVariants or {})
+    product.imageVariants = {}
+
+
+def _delete_files(variants, keep=None):
+    kept = {v['name'] for k, v in (keep or {}).items() if k in VARIANTS}
+    for name in VARIANTS:
+        if variants.get(name) and variants[name]['name'] not in kept:
+            default_storage.delete(variants[name]['name'])
+
+
+def schedule_variants(product_id):
+    """Render the variants on a worker once the current transaction commits."""
+    return jobs.enqueue('image_variants', product_id=product_id)
+
+
+def variant_url(product, name):
+    """URL of the `name` variant, or of the original upload until it is rendered."""
+    variant = (product.imageVariants or {}).get(name)
+    if variant:
+        return default_storage.url(variant['name'])
+    return product.image.url if product.image else None
+
+
+def get_images(product):
+    variants = product.imageVariants or {}
+    images = {'original': product.image.url if product.image else None}
+    srcset = []
+    for name in VARIANTS:
+        images[name] = variant_url(product, name)
+        if variants.get(name):
+            srcset.append('%s %dw' % (images[name], variants[name]['width']))
+    if srcset and variants.get('original'):
+        srcset.append('%s %dw' % (images['original'], variants['original']['width']))
+    images['srcset'] = ', '.join(srcset)
+    return images
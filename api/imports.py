@@ -0,0 +1,264 @@
+"""
+Bulk product upserts from streamed CSV or NDJSON.
+
+Records are read one line at a time and written BATCH_SIZE at a time: the
+products a batch names are fetched with one query, changed in memory and
+saved with one executemany UPDATE per set of columns, the new ones with one
+bulk_create, all in one transaction. A record that does not validate is
+reported with its line number and skipped; the rest of its batch still goes
+in.
+
+A record with an `id` updates that product, one without creates a new one.
+Only the columns a record has are changed, so a price and stock feed only
+needs `id,price,countInStock`. The columns are those of the product export
+(`PRODUCT_FIELDS`).
+"""
+import codecs
+import csv
+import json
+from collections import Counter
+from decimal import Decimal, InvalidOperation
+
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import leaderboard
+from .cache import bump_catalog_version
+from .categories import get_or_create_category
+from .models import Category, Product
+
+
+BATCH_SIZE = 1000
+MAX_ERRORS = 1000
+PRODUCT_FIELDS = ['id', 'name', 'description', 'category', 'price', 'countInStock']
+
+MAX_PRICE = Decimal('99999.99')
+NAME_LENGTH = Product._meta.get_field('name').max_length
+
+
+class InvalidRecord(ValueError):
+    pass
+
+
+def read_csv(lines):
+    """(line number, record) pairs of CSV `lines` (str), the first line being the header."""
+    reader = csv.DictReader(lines)
+    for record in reader:
+        if None in record:
+            yield reader.line_num, InvalidRecord('More values than columns')
+        else:
+            yield reader.line_num, record
+
+
+def read_ndjson(lines):
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield number, InvalidRecord('Invalid JSON')
+            continue
+        yield number, record if isinstance(record, dict) else InvalidRecord('Expected a JSON object')
+
+
+READERS = {'csv': read_csv, 'ndjson': read_ndjson}
+
+
+def decode(chunks):
+    """Text lines of an iterable of byte lines, UTF-8 with or without a BOM."""
+    return codecs.iterdecode(chunks, 'utf-8-sig')
+
+
+def clean(record):
+    """The model values of `record`, keyed by field name, or InvalidRecord."""
+    unknown = set(record) - set(PRODUCT_FIELDS)
+    if unknown:
+        raise InvalidRecord('Unknown columns: %s' % ', '.join(sorted(unknown)))
+
+    values = {}
+    if record.get('id') not in (None, ''):
+        try:
+            values['id'] = int(record['id'])
+        except (TypeError, ValueError):
+            raise InvalidRecord('id must be an integer')
+
+    if 'name' in record:
+        name = str(record['name'] or '').strip()
+        if not name or len(name) > NAME_LENGTH:
+            raise InvalidRecord('name must be 1 to %d characters' % NAME_LENGTH)
+        values['name'] = name
+    if 'description' in record:
+        values['description'] = str(record['description'] or '')
+    if 'category' in record:
+        values['category'] = str(record['category'] or '')
+
+    if 'price' in record:
+        try:
+            price = Decimal(str(record['price']).strip())
+        except InvalidOperation:
+            raise InvalidRecord('price must be a number')
+        if not price.is_finite() or not 0 <= price <= MAX_PRICE or price != price.quantize(Decimal('0.01')):
+            raise InvalidRecord('price must be between 0 and %s with at most 2 decimals' % MAX_PRICE)
+        values['price'] = price
+    if 'countInStock' in record:
+        try:
+            stock = int(str(record['countInStock']).strip())
+        except ValueError:
+            raise InvalidRecord('countInStock must be an integer')
+        if stock < 0:
+            raise InvalidRecord('countInStock must not be negative')
+        values['countInStock'] = stock
+
+    if 'id' not in values and ('name' not in values or 'price' not in values):
+        raise InvalidRecord('New products need a name and a price')
+    return values
+
+
+def update(products, fields):
+    """
+    Save `fields` of `products` with one executemany UPDATE. bulk_update
+    builds a CASE WHEN per field and row, which costs more than the writes
+    themselves at BATCH_SIZE rows.
+    """
+    ops = connection.ops
+    fields = [Product._meta.get_field(name) for name in fields]
+    pk = Product._meta.pk
+    sql = 'UPDATE %s SET %s WHERE %s = %%s' % (
+        ops.quote_name(Product._meta.db_table),
+        ', '.join('%s = %%s' % ops.quote_name(field.column) for field in fields),
+        ops.quote_name(pk.column))
+    rows = [
+        [field.get_db_prep_save(getattr(product, field.attname), connection) for field in fields] + [product.pk]
+        for product in products
+    ]
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+class Import:
+    """Upsert the records of one upload; see the module docstring."""
+
+    def __init__(self, user=None):
+        self.user = user
+        self.created = 0
+        self.updated = 0
+        self.failed = 0
+        self.errors = []
+        self.categories = {}
+
+    def fail(self, line, error, pk=None):
+        self.failed += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append({'line': line, 'id': pk, 'error': str(error)})
+
+    def run(self, records):
+        """Upsert the `(line, record)` pairs of a reader, return the report."""
+        batch = []
+        for line, record in records:
+            try:
+                if isinstance(record, Exception):
+                    raise record
+                batch.append((line, clean(record)))
+            except InvalidRecord as e:
+                self.fail(line, e, isinstance(record, dict) and record.get('id') or None)
+                continue
+            if len(batch) >= BATCH_SIZE:
+                self.write(batch)
+                batch = []
+        if batch:
+            self.write(batch)
+
+        if self.created or self.updated:
+            bump_catalog_version()
+        return self.report()
+
+    def report(self):
+        return {'created': self.created, 'updated': self.updated, 'failed': self.failed, 'errors': self.errors}
+
+    def category(self, name):
+        if name not in self.categories:
+            self.categories[name] = get_or_create_category(name)
+        return self.categories[name]
+
+    def write(self, batch):
+        try:
+            with transaction.atomic():
+                result = self.write_batch(batch)
+        except DatabaseError:
+            # Categories created by the batch were rolled back with it
+            self.categories.clear()
+            # Find the rows the database refuses, one savepoint each
+            for line, values in batch:
+                try:
+                    with transaction.atomic():
+                        result = self.write_batch([(line, values)])
+                except DatabaseError as e:
+                    self.categories.clear()
+                    self.fail(line, e, values.get('id'))
+                else:
+                    self.count(*result)
+        else:
+            self.count(*result)
+
+    def count(self, created, updated, failures):
+        self.created += created
+        self.updated += updated
+        for line, error, pk in failures:
+            self.fail(line, error, pk)
+
+    def write_batch(self, batch):
+        """Write `batch`, return (created, updated, [(line, error, id)])."""
+        now = timezone.now()
+        existing = Product.objects.select_related(None).in_bulk(
+            [values['id'] for _, values in batch if 'id' in values])
+        changed, created = {}, []
+        fields = {}  # product id -> the fields its records set
+        moved = []  # (product id, old category id)
+        counts = Counter()
+        failures = []
+
+        for line, values in batch:
+            values = dict(values)
+            if 'category' in values:
+                values['category'] = self.category(values['category'])
+
+            pk = values.pop('id', None)
+            if pk is None:
+                product = Product(user=self.user, **values)
+                created.append(product)
+                counts[product.category_id] += 1
+                continue
+
+            product = existing.get(pk)
+            if product is None:
+                failures.append((line, 'Product %d does not exist' % pk, pk))
+                continue
+            category_id = values['category'] and values['category'].id if 'category' in values else None
+            if 'category' in values and category_id != product.category_id:
+                moved.append((pk, product.category_id))
+                counts[product.category_id] -= 1
+                counts[category_id] += 1
+            for name, value in values.items():
+                setattr(product, name, value)
+            product.updatedAt = now
+            fields.setdefault(pk, {'updatedAt'}).update(values)
+            changed[pk] = product
+
+        # One UPDATE per set of columns, so no row writes back a column it
+        # did not set, like a countInStock checkout changed since the fetch
+        groups = {}
+        for pk, product in changed.items():
+            groups.setdefault(tuple(sorted(fields[pk])), []).append(product)
+        for names, products in groups.items():
+            update(products, names)
+        if created:
+            Product.objects.bulk_create(created)
+        for category_id, delta in counts.items():
+            if category_id and delta:
+                Category.objects.filter(id=category_id).update(productCount=F('productCount') + delta)
+        old_categories = Category.objects.in_bulk({category_id for _, category_id in moved} - {None})
+        for pk, category_id in moved:
+            leaderboard.product_changed(pk, old_categories.get(category_id))
+        return len(created), len(changed), failures
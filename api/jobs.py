@@ -0,0 +1,204 @@
+"""
+Database-backed background jobs.
+
+Views enqueue slow side effects as `Job` rows inside the transaction of the
+change they follow, so a job exists exactly when its change committed.
+`manage.py runworker` runs them on a pool of threads, and optionally of
+processes: a worker claims a due job with a conditional UPDATE, as checkout
+reserves stock, so any number of workers share the table without a broker
+or row locks.
+
+A job that raises is retried up to JOBS_MAX_ATTEMPTS times, the delay
+doubling from JOBS_RETRY_DELAY, then left `failed` with its traceback. A
+job still running after JOBS_TIMEOUT is taken for lost with its worker and
+retried, so tasks must be safe to run twice. Finished jobs are kept for
+JOBS_KEEP_SECONDS for introspection (/api/jobs/).
+
+With JOBS_EAGER a job runs in-process as soon as its transaction commits,
+for development and tests.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+
+logger = logging.getLogger(__name__)
+
+# name -> function called with the job's `args`; the functions are imported
+# by the worker, so the modules that enqueue them can import this one
+TASKS = {
+    'image_variants': 'api.images.generate_variants',
+    'leaderboard': 'api.leaderboard.rerank',
+}
+
+MAX_RETRY_DELAY = 3600
+# due jobs a worker tries to claim before concluding others took them all
+CLAIM_CANDIDATES = 10
+# seconds between two passes over lost and expired jobs
+HOUSEKEEPING_INTERVAL = 60
+
+
+def enqueue(name, delay=0, **kwargs):
+    """Run the task `name` with `kwargs` (JSON values) once the current transaction commits."""
+    if name not in TASKS:
+        raise KeyError('Unknown job %s' % name)
+    job = Job.objects.create(name=name, args=kwargs, maxAttempts=settings.JOBS_MAX_ATTEMPTS,
+                             runAt=timezone.now() + timedelta(seconds=delay))
+    if settings.JOBS_EAGER:
+        transaction.on_commit(lambda: run_now(job.id))
+    return job
+
+
+def claim(worker):
+    """Mark a due job as running for `worker`, return its id; None if there is none."""
+    now = timezone.now()
+    due = (Job.objects.filter(status=Job.QUEUED, runAt__lte=now)
+                      .order_by('runAt', 'id').values_list('id', flat=True)[:CLAIM_CANDIDATES])
+    for pk in due:
+        if _start(pk, worker, now):
+            return pk
+    return None
+
+
+def _start(pk, worker, now):
+    return Job.objects.filter(id=pk, status=Job.QUEUED).update(
+        status=Job.RUNNING, lockedBy=worker, lockedAt=now, attempts=F('attempts') + 1)
+
+
+def run_now(pk, worker='eager'):
+    """Claim and run the job `pk` in this thread, if it is still queued."""
+    if _start(pk, worker, timezone.now()):
+        execute(pk, worker)
+
+
+def execute(pk, worker):
+    """Run the claimed job `pk`, then record its result or schedule its retry."""
+    job = Job.objects.get(id=pk)
+    try:
+        result = import_string(TASKS[job.name])(**job.args)
+    except Exception:
+        logger.exception('Job %s #%s failed', job.name, pk)
+        _failed(job, worker, traceback.format_exc())
+        return False
+
+    Job.objects.filter(id=pk, status=Job.RUNNING, lockedBy=worker).update(
+        status=Job.DONE, result=result, error='', finishedAt=timezone.now())
+    return True
+
+
+def _failed(job, worker, error):
+    now = timezone.now()
+    jobs = Job.objects.filter(id=job.id, status=Job.RUNNING, lockedBy=worker)
+    if job.attempts < job.maxAttempts:
+        delay = min(settings.JOBS_RETRY_DELAY * 2 ** (job.attempts - 1), MAX_RETRY_DELAY)
+        jobs.update(status=Job.QUEUED, runAt=now + timedelta(seconds=delay), lockedBy=None, lockedAt=None,
+                    error=error)
+    else:
+        jobs.update(status=Job.FAILED, finishedAt=now, error=error)
+
+
+def requeue_lost():
+    """Retry, or fail once out of attempts, the jobs running for longer than JOBS_TIMEOUT."""
+    now = timezone.now()
+    lost = Job.objects.filter(status=Job.RUNNING, lockedAt__lt=now - timedelta(seconds=settings.JOBS_TIMEOUT))
+    error = 'No result after %ss, the worker was lost' % settings.JOBS_TIMEOUT
+    retried = lost.filter(attempts__lt=F('maxAttempts')).update(
+        status=Job.QUEUED, runAt=now, lockedBy=None, lockedAt=None, error=error)
+    failed = lost.update(status=Job.FAILED, finishedAt=now, error=error)
+    return retried + failed
+
+
+def purge():
+    """Delete the jobs that finished more than JOBS_KEEP_SECONDS ago."""
+    before = timezone.now() - timedelta(seconds=settings.JOBS_KEEP_SECONDS)
+    deleted, _ = Job.objects.filter(status=Job.DONE, finishedAt__lt=before).delete()
+    return deleted
+
+
+class Worker:
+    """
+    Run due jobs on `threads` threads until `stop()` is called or, with
+    `burst`, until no job is due.
+    """
+
+    def __init__(self, threads=None, burst=False):
+        self.threads = threads or settings.JOBS_WORKERS
+        self.burst = burst
+        self.name = '%s:%d' % (socket.gethostname(), os.getpid())
+        self.processed = 0
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._housekeeping = 0
+
+    def stop(self):
+        """Let the running jobs finish, then return from `run`."""
+        self._stopping.set()
+
+    def run(self):
+        """Work until stopped, return the number of jobs run."""
+        if self.threads == 1:
+            self.work()
+            return self.processed
+
+        pool = [threading.Thread(target=self._work_in_thread, name='jobs-%d' % i) for i in range(self.threads)]
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+        return self.processed
+
+    def _work_in_thread(self):
+        try:
+            self.work()
+        finally:
+            connection.close()
+
+    def work(self):
+        """One thread of the worker."""
+        while not self._stopping.is_set():
+            # like a request, never start on a broken or expired connection
+            # (unless inside a transaction, where a test runs the worker)
+            if not connection.in_atomic_block:
+                close_old_connections()
+            self.housekeeping()
+
+            try:
+                pk = claim(self.name)
+                if pk is not None:
+                    execute(pk, self.name)
+            except Exception:
+                # the database went away; the job, if any, is retried once lost
+                logger.exception('Worker %s could not run a job', self.name)
+                pk = None
+
+            if pk is None:
+                if self.burst:
+                    return
+                self._stopping.wait(settings.JOBS_POLL_INTERVAL)
+                continue
+
+            with self._lock:
+                self.processed += 1
+
+    def housekeeping(self):
+        with self._lock:
+            if time.monotonic() - self._housekeeping < HOUSEKEEPING_INTERVAL:
+                return
+            self._housekeeping = time.monotonic()
+        try:
+            requeue_lost()
+            purge()
+        except Exception:
+            logger.exception('Job housekeeping failed')
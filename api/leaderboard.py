@@ -0,0 +1,183 @@
+"""
+Precomputed top-products leaderboards.
+
+Every scope (the whole catalog, and each category) keeps the ids of its
+best-rated products in a single `Leaderboard` row, ranked by rating, then
+number of reviews, then recency. Reading a leaderboard is one keyed lookup
+plus a primary-key fetch; the ranking is only touched when a review
+changes a product's rating or a product leaves a scope.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+
+from .cache import bump_catalog_version
+from .models import Category, Leaderboard, Product
+
+
+MIN_RATING = 4
+RANKING = ['-rating', '-numOfReviews', '-createdAt', '-id']
+ALL = 'all'
+
+
+def category_scope(slug):
+    return 'category:%s' % slug
+
+
+def scopes_for(category):
+    if category is not None:
+        return [ALL, category_scope(category.slug)]
+    return [ALL]
+
+
+def _capacity():
+    return settings.TOP_PRODUCTS_CAPACITY
+
+
+def _candidates(scope):
+    products = Product.objects.filter(rating__gte=MIN_RATING)
+    if scope != ALL:
+        products = products.filter(category__slug=scope.split(':', 1)[1])
+    return products
+
+
+def _sort_key(product):
+    return (-product.rating, -(product.numOfReviews or 0), -product.createdAt.timestamp(), -product.id)
+
+
+def rebuild(scope):
+    ids = list(_candidates(scope).order_by(*RANKING).values_list('id', flat=True)[:_capacity()])
+    Leaderboard.objects.update_or_create(scope=scope, defaults={'products': ids})
+    return ids
+
+
+def rebuild_all():
+    scopes = {ALL} | {category_scope(slug) for slug in Category.objects.values_list('slug', flat=True)}
+    Leaderboard.objects.exclude(scope__in=scopes).delete()
+    for scope in scopes:
+        rebuild(scope)
+    return len(scopes)
+
+
+def get_top_ids(n, category=None):
+    """Ids of the `n` best products of the catalog, or of the category slug `category`, best first."""
+    scope = category_scope(category) if category else ALL
+    ids = Leaderboard.objects.filter(scope=scope).values_list('products', flat=True).first()
+    if ids is None:
+        ids = rebuild(scope)
+    return ids[:n]
+
+
+async def aget_top_ids(n, category=None):
+    scope = category_scope(category) if category else ALL
+    ids = await Leaderboard.objects.filter(scope=scope).values_list('products', flat=True).afirst()
+    if ids is None:
+        ids = await sync_to_async(rebuild)(scope)
+    return ids[:n]
+
+
+def fetch(ids, queryset=None):
+    """The products `ids`, in that order, fetched through `queryset` when given."""
+    products = (Product.objects if queryset is None else queryset).in_bulk(ids)
+    return [products[i] for i in ids if i in products]
+
+
+async def afetch(ids, queryset=None):
+    products = await (Product.objects if queryset is None else queryset).ain_bulk(ids)
+    return [products[i] for i in ids if i in products]
+
+
+def get_top(n, category=None, queryset=None):
+    """
+    The `n` best products of the catalog, or of the category slug `category`,
+    best first. They are fetched through `queryset` when given.
+    """
+    return fetch(get_top_ids(n, category), queryset)
+
+
+async def aget_top(n, category=None, queryset=None):
+    return await afetch(await aget_top_ids(n, category), queryset)
+
+
+def product_changed(product_id, old_category=None):
+    """
+    Re-rank `product_id` in its scopes after its rating changed, or after it
+    moved out of the Category `old_category`. True if a board changed.
+    """
+    product = Product.objects.filter(id=product_id).first()
+    if product is None:
+        return False
+
+    changed = False
+    scopes = scopes_for(product.category)
+    if old_category is not None:
+        for scope in scopes_for(old_category):
+            if scope not in scopes:
+                changed |= _remove(scope, product_id)
+
+    for scope in scopes:
+        changed |= _place(scope, product)
+    return changed
+
+
+def rerank(product_id):
+    """
+    The background job (api/jobs.py) of a new review: re-rank the product
+    and, if a board changed, retire the cached top-products payloads, which
+    the review itself retired before the boards moved.
+    """
+    changed = product_changed(product_id)
+    if changed:
+        bump_catalog_version()
+    return changed
+
+
+def product_removed(product_id, category):
+    for scope in scopes_for(category):
+        _remove(scope, product_id)
+
+
+def _place(scope, product):
+    with transaction.atomic():
+        board = Leaderboard.objects.select_for_update().filter(scope=scope).first()
+        if board is None:
+            # Built lazily on the first read
+            return False
+
+        capacity = _capacity()
+        member = product.id in board.products
+        full = len(board.products) >= capacity
+        qualifies = product.rating is not None and product.rating >= MIN_RATING
+
+        ids = [i for i in board.products if i != product.id]
+        ranked = [p for p in Product.objects.filter(id__in=ids) if p.rating is not None]
+        if qualifies:
+            ranked.append(product)
+        ranked.sort(key=_sort_key)
+        ranked = ranked[:capacity]
+
+        # A member that slid to the last slot or off the board may have been
+        # overtaken by products the board never held.
+        if member and full and product not in ranked[:capacity - 1]:
+            return rebuild(scope) != board.products
+
+        ids = [p.id for p in ranked]
+        if ids == board.products:
+            return False
+        board.products = ids
+        board.save()
+        return True
+
+
+def _remove(scope, product_id):
+    with transaction.atomic():
+        board = Leaderboard.objects.select_for_update().filter(scope=scope).first()
+        if board is None or product_id not in board.products:
+            return False
+
+        if len(board.products) >= _capacity():
+            rebuild(scope)
+        else:
+            board.products = [i for i in board.products if i != product_id]
+            board.save()
+        return True
@@ -0,0 +1,53 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api import images
+from api.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Render the thumbnail and medium WebP variants of existing product images.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Re-render products that already have variants.')
+        parser.add_argument('--workers', type=int, default=4)
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image='').exclude(image__isnull=True)
+        if not options['force']:
+            products = products.filter(imageVariants={})
+        ids = list(products.order_by('id').values_list('id', flat=True))
+
+        def generate(product_id):
+            try:
+                return product_id, images.generate_variants(product_id), None
+            except Exception as e:
+                return product_id, None, e
+
+        def generate_in_thread(product_id):
+            try:
+                return generate(product_id)
+            finally:
+                connection.close()
+
+        if options['workers'] > 1:
+            executor = ThreadPoolExecutor(max_workers=options['workers'])
+            results = executor.map(generate_in_thread, ids)
+        else:
+            executor = None
+            results = map(generate, ids)
+
+        done = 0
+        try:
+            for product_id, variants, error in results:
+                if error is not None:
+                    self.stderr.write('Product %d: %s' % (product_id, error))
+                elif variants:
+                    done += 1
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        self.stdout.write(self.style.SUCCESS('Rendered variants for %d of %d products' % (done, len(ids))))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api import sales
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily and per-product sales rollups from the orders.'
+
+    def handle(self, *args, **options):
+        days = sales.rebuild()
+        self.stdout.write(self.style.SUCCESS('Rebuilt sales for %d days' % days))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api import categories
+
+
+class Command(BaseCommand):
+    help = 'Recompute the number of products in every category.'
+
+    def handle(self, *args, **options):
+        count = categories.recount()
+        self.stdout.write(self.style.SUCCESS('Recounted %d categories' % count))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from api import leaderboard, ratings
+
+
+class Command(BaseCommand):
+    help = 'Recompute the rating aggregates of every product from its reviews.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        count = ratings.recompute_all(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Repaired %d products' % count))
+
+        scopes = leaderboard.rebuild_all()
+        self.stdout.write(self.style.SUCCESS('Rebuilt %d leaderboards' % scopes))
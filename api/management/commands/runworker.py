@@ -0,0 +1,55 @@
+import multiprocessing
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from api.jobs import Worker
+
+
+def work(threads, burst):
+    worker = Worker(threads=threads, burst=burst)
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *args: worker.stop())
+    return worker, worker.run()
+
+
+class Command(BaseCommand):
+    help = 'Run the queued background jobs (api/jobs.py) until stopped.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=settings.JOBS_WORKERS,
+                            help='jobs run at once per process')
+        parser.add_argument('--processes', type=int, default=1,
+                            help='forked worker processes, for CPU-bound jobs like image rendering')
+        parser.add_argument('--burst', action='store_true', help='exit once no job is due')
+
+    def handle(self, *args, **options):
+        threads, processes, burst = options['threads'], options['processes'], options['burst']
+        if processes <= 1:
+            self.stdout.write('Worker running %d threads' % threads)
+            worker, processed = work(threads, burst)
+            self.stdout.write(self.style.SUCCESS('Worker %s ran %d jobs' % (worker.name, processed)))
+            return
+
+        # The children must not share the parent's database connections
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        children = [context.Process(target=work, args=(threads, burst), name='runworker-%d' % i)
+                    for i in range(processes)]
+        for child in children:
+            child.start()
+        self.stdout.write('Started %d worker processes of %d threads' % (processes, threads))
+
+        def stop(*args):
+            for child in children:
+                if child.is_alive():
+                    child.terminate()
+
+        signal.signal(signal.SIGTERM, stop)
+        # Ctrl-C reaches the children through the process group already
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        for child in children:
+            child.join()
+        self.stdout.write(self.style.SUCCESS('Worker processes exited'))
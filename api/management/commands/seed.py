@@ -0,0 +1,335 @@
+import bisect
+import itertools
+import math
+import random
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+
+from api import leaderboard, sales, search
+from api.categories import category_slug, recount
+from api.models import (Category, DailySales, Leaderboard, Order, OrderItem, Product, ProductSales, Review,
+                        ShippingAddress)
+
+
+USERNAME_PREFIX = 'seed'
+PASSWORD = 'seedpass123'
+
+# name -> (median price, brands)
+CATEGORIES = {
+    'GPU': (650, ['NVIDIA', 'AMD', 'ASUS', 'MSI', 'Gigabyte', 'Zotac']),
+    'CPU': (320, ['Intel', 'AMD']),
+    'Motherboard': (210, ['ASUS', 'MSI', 'Gigabyte', 'ASRock']),
+    'Memory': (110, ['Corsair', 'G.Skill', 'Kingston', 'Crucial']),
+    'SSD': (120, ['Samsung', 'WD', 'Crucial', 'Kingston', 'Seagate']),
+    'Hard Drive': (90, ['Seagate', 'WD', 'Toshiba']),
+    'Power Supply': (130, ['Corsair', 'Seasonic', 'be quiet!', 'EVGA']),
+    'Case': (110, ['NZXT', 'Fractal Design', 'Lian Li', 'Corsair']),
+    'CPU Cooler': (80, ['Noctua', 'be quiet!', 'Arctic', 'Cooler Master']),
+    'Monitor': (350, ['Dell', 'LG', 'Samsung', 'ASUS', 'BenQ', 'AOC']),
+    'Monitor Arms': (70, ['Ergotron', 'Amazon Basics', 'HUANUO']),
+    'Keyboard': (90, ['Logitech', 'Keychron', 'Razer', 'Corsair']),
+    'Mouse': (55, ['Logitech', 'Razer', 'SteelSeries', 'Zowie']),
+    'Headset': (95, ['HyperX', 'SteelSeries', 'Sennheiser', 'Logitech']),
+    'Laptop': (1300, ['Lenovo', 'Dell', 'HP', 'ASUS', 'Apple', 'Acer']),
+    'Router': (140, ['TP-Link', 'ASUS', 'Netgear', 'Ubiquiti']),
+}
+LINES = ['Pro', 'Ultra', 'Max', 'Plus', 'Elite', 'Gaming', 'Creator', 'Lite', 'X', 'Prime']
+FIRST_NAMES = ['Ahmed', 'Mona', 'Omar', 'Sara', 'Youssef', 'Nour', 'Karim', 'Laila', 'Hassan', 'Mariam',
+               'John', 'Emma', 'Liam', 'Olivia', 'Noah', 'Ava', 'Lucas', 'Mia', 'Ethan', 'Zoe']
+LAST_NAMES = ['Hassan', 'Ali', 'Ibrahim', 'Mahmoud', 'Farouk', 'Saleh', 'Smith', 'Johnson', 'Brown',
+              'Garcia', 'Miller', 'Davis', 'Wilson', 'Moore', 'Taylor', 'Clark']
+CITIES = [('Cairo', 'EG', '11511'), ('Alexandria', 'EG', '21500'), ('Giza', 'EG', '12511'),
+          ('Mansoura', 'EG', '35511'), ('Dubai', 'AE', '00000'), ('Riyadh', 'SA', '11564'),
+          ('London', 'GB', 'SW1A 1AA'), ('Berlin', 'DE', '10115'), ('New York', 'US', '10001')]
+COMMENTS = {
+    1: ['Stopped working after a week.', 'Arrived damaged.', 'Not as described.'],
+    2: ['Disappointing for the price.', 'Runs hot and loud.'],
+    3: ['Does the job.', 'Average, nothing special.', 'OK for the money.'],
+    4: ['Very good, minor issues.', 'Solid performance.', 'Would buy again.'],
+    5: ['Excellent!', 'Best purchase this year.', 'Flawless, highly recommended.'],
+}
+PAYMENT_METHODS = ['PayPal', 'PayPal', 'PayPal', 'Credit Card', 'Cash on Delivery']
+DEFAULT_IMAGE = Product._meta.get_field('image').default
+ITEM_IMAGE = '/media/' + DEFAULT_IMAGE
+CENT = Decimal('0.01')
+MAX_PRICE = Decimal('99999.99')
+
+
+def zipf_weights(count, exponent, rng):
+    """Zipf popularity weights for `count` items, in a random order."""
+    weights = [1.0 / (rank ** exponent) for rank in range(1, count + 1)]
+    rng.shuffle(weights)
+    return weights
+
+
+def cumulative(weights):
+    return list(itertools.accumulate(weights))
+
+
+def pick(rng, items, cum_weights):
+    return items[bisect.bisect(cum_weights, rng.random() * cum_weights[-1])]
+
+
+def allocate(total, weights, cap):
+    """
+    Split `total` into whole shares proportional to `weights`, none above
+    `cap`. What the capped items cannot take goes to the rest.
+    """
+    counts = [0] * len(weights)
+    order = sorted(range(len(weights)), key=weights.__getitem__, reverse=True)
+    remaining, weight = total, sum(weights)
+    # the heaviest items hit the cap first
+    for position, i in enumerate(order):
+        if remaining * weights[i] < cap * weight:
+            break
+        counts[i] = cap
+        remaining -= cap
+        weight -= weights[i]
+    else:
+        return counts
+
+    shares = {i: remaining * weights[i] / weight for i in order[position:]}
+    for i, share in shares.items():
+        counts[i] = int(share)
+    # largest remainders take what rounding down left over
+    leftover = remaining - sum(counts[i] for i in shares)
+    for i in sorted(shares, key=lambda i: shares[i] % 1, reverse=True)[:leftover]:
+        counts[i] += 1
+    return counts
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Command(BaseCommand):
+    help = ('Generate a large, realistic and reproducible dataset: users, categories, products with '
+            'skewed popularity, reviews, and multi-line orders with shipping addresses.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--products', type=int, default=200000)
+        parser.add_argument('--reviews', type=int, default=500000)
+        parser.add_argument('--orders', type=int, default=100000)
+        parser.add_argument('--seed', type=int, default=1, help='same seed, same data')
+        parser.add_argument('--until', default='2025-01-01',
+                            help='date (YYYY-MM-DD) the generated history ends at')
+        parser.add_argument('--days', type=int, default=730, help='length of the generated history')
+        parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent of product popularity')
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--clear', action='store_true',
+                            help='delete the catalog, orders, reviews and seeded users first')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        # bound once, it runs for nearly every row
+        self.db_datetime = connection.ops.adapt_datetimefield_value
+        self.end = datetime.fromisoformat(options['until']).replace(tzinfo=dt_timezone.utc)
+        self.start = self.end - timedelta(days=options['days'])
+
+        if options['clear']:
+            self.clear()
+        elif User.objects.filter(username__startswith=USERNAME_PREFIX).exists():
+            raise CommandError('The database already holds seeded users, run with --clear to replace them.')
+
+        started = time.monotonic()
+        # Index once at the end instead of row by row through the triggers
+        search.drop_triggers()
+        try:
+            users = self.step('users', self.create_users, options['users'])
+            categories = self.step('categories', self.create_categories)
+            products = self.step('products', self.create_products, options['products'], categories,
+                                 users, options['reviews'], options['skew'])
+            self.step('reviews', self.create_reviews, products, users)
+            self.step('orders', self.create_orders, options['orders'], products, users)
+            self.reset_sequences()
+        finally:
+            self.step('search index', search.install_triggers)
+
+        recount()
+        self.step('leaderboards', leaderboard.rebuild_all)
+        self.step('sales', sales.rebuild)
+        self.stdout.write(self.style.SUCCESS('Seeded in %.1fs' % (time.monotonic() - started)))
+
+    def step(self, name, function, *args):
+        started = time.monotonic()
+        result = function(*args)
+        rows = result if isinstance(result, int) else len(result) if isinstance(result, (list, dict)) else '-'
+        self.stdout.write('%-14s %10s rows %7.1fs' % (name, rows, time.monotonic() - started))
+        return result
+
+    def clear(self):
+        with transaction.atomic():
+            for model in (DailySales, ProductSales, OrderItem, ShippingAddress, Order, Review, Leaderboard,
+                          Product, Category):
+                model.objects.all().delete()
+            User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+
+    def timestamp(self, after=None):
+        start = after if after is not None and after > self.start else self.start
+        return start + timedelta(seconds=self.rng.random() * (self.end - start).total_seconds())
+
+    def next_id(self, model):
+        """
+        First free primary key of `model`. Rows are inserted with explicit ids
+        so the children can point at them without reading them back.
+        """
+        return (model.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+
+    def reset_sequences(self):
+        # As loaddata does after inserting explicit ids
+        statements = connection.ops.sequence_reset_sql(no_style(), [Product, Order])
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+
+    def insert(self, model, fields, rows):
+        """
+        Insert `rows` (tuples of `fields` values, ready for the database) in
+        batches inside one transaction. Model.__init__ and bulk_create's
+        per-field preparation cost more than the inserts themselves at this
+        scale, so the tuples go to executemany directly.
+        """
+        ops = connection.ops
+        columns = ', '.join(ops.quote_name(model._meta.get_field(name).column) for name in fields)
+        sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+            ops.quote_name(model._meta.db_table), columns, ', '.join(['%s'] * len(fields)))
+
+        count = 0
+        with transaction.atomic(), connection.cursor() as cursor:
+            for batch in batched(rows, self.batch_size):
+                cursor.executemany(sql, batch)
+                count += len(batch)
+        return count
+
+    def create_users(self, count):
+        # Hashing is the slow part of creating users, so every account shares one
+        password = make_password(PASSWORD)
+        rng = self.rng
+        users = [
+            User(username='%s%06d' % (USERNAME_PREFIX, i), email='%s%06d@example.com' % (USERNAME_PREFIX, i),
+                 first_name=rng.choice(FIRST_NAMES), last_name=rng.choice(LAST_NAMES), password=password,
+                 is_staff=i == 0, is_superuser=i == 0, date_joined=self.timestamp())
+            for i in range(count)
+        ]
+        with transaction.atomic():
+            users = User.objects.bulk_create(users, batch_size=self.batch_size)
+        return [(user.id, user.first_name) for user in users]
+
+    def create_categories(self):
+        categories = Category.objects
+        existing = set(categories.values_list('slug', flat=True))
+        categories.bulk_create([Category(name=name, slug=category_slug(name))
+                                for name in CATEGORIES if category_slug(name) not in existing])
+        return {category.name: category.id for category in categories.filter(name__in=CATEGORIES)}
+
+    def create_products(self, count, categories, users, reviews, skew):
+        """
+        Products with their review plan: how many reviews each gets and their
+        ratings, so rating, numOfReviews and ratingSum are written up front.
+        """
+        rng = self.rng
+        names = list(categories)
+        # some categories sell far more than others
+        category_weights = cumulative(zipf_weights(len(names), 0.8, rng))
+        self.popularity = zipf_weights(count, skew, rng)
+        # one review per user and product at most
+        counts = allocate(reviews, self.popularity, len(users))
+        admin_id = users[0][0] if users else None
+        first_id = self.next_id(Product)
+
+        self.review_plan = []
+        products = []
+        rows = []
+        for i in range(count):
+            name = pick(rng, names, category_weights)
+            median, brands = CATEGORIES[name]
+            n = counts[i]
+            quality = min(5.0, max(1.0, rng.gauss(3.9, 0.7)))
+            ratings = [min(5, max(1, round(rng.gauss(quality, 1.0)))) for _ in range(n)]
+            self.review_plan.append(ratings)
+
+            product = (first_id + i,
+                       '%s %s %s %d' % (rng.choice(brands), name, rng.choice(LINES), rng.randint(100, 9999)),
+                       Decimal(min(99999, round(median * math.exp(rng.gauss(0, 0.5)), 2))).quantize(CENT),
+                       self.timestamp())
+            products.append(product)
+            rows.append((
+                product[0], admin_id, product[1], DEFAULT_IMAGE, '{}', categories[name],
+                '%s %s, model year %d.' % (name, rng.choice(LINES).lower(), rng.randint(2019, 2025)),
+                (Decimal(sum(ratings)) / n).quantize(CENT) if n else Decimal(0), n, sum(ratings),
+                product[2], rng.choice([0, 0, 3, 10, 25, 50, 100, 250]), self.db_datetime(product[3]),
+                self.db_datetime(product[3]),
+            ))
+
+        self.insert(Product, ['id', 'user', 'name', 'image', 'imageVariants', 'category', 'description', 'rating',
+                              'numOfReviews', 'ratingSum', 'price', 'countInStock', 'createdAt', 'updatedAt'], rows)
+        return products
+
+    def create_reviews(self, products, users):
+        rng = self.rng
+
+        def rows():
+            for (product_id, _, _, created), ratings in zip(products, self.review_plan):
+                if not ratings:
+                    continue
+                for (user_id, first_name), rating in zip(rng.sample(users, len(ratings)), ratings):
+                    yield (product_id, user_id, first_name, rating, rng.choice(COMMENTS[rating]),
+                           self.db_datetime(self.timestamp(after=created)))
+
+        return self.insert(Review, ['product', 'user', 'name', 'rating', 'comment', 'createdAt'], rows())
+
+    def create_orders(self, count, products, users):
+        rng = self.rng
+        product_weights = cumulative(self.popularity)
+        # a few customers order a lot
+        user_weights = cumulative(zipf_weights(len(users), 0.7, rng))
+        first_id = self.next_id(Order)
+
+        orders, addresses, items = [], [], []
+        for order_id in range(first_id, first_id + count):
+            lines = {}
+            for _ in range(min(6, 1 + int(rng.expovariate(1.0)))):
+                product = pick(rng, products, product_weights)
+                lines[product[0]] = (product, rng.choice([1, 1, 1, 2, 2, 3]))
+            subtotal = sum(product[2] * qty for product, qty in lines.values())
+            shipping = Decimal('0.00') if subtotal > 100 else Decimal('10.00')
+            tax = (subtotal * Decimal('0.14')).quantize(CENT)
+            created = self.timestamp()
+            paid = rng.random() < 0.85
+            delivered = paid and rng.random() < 0.75
+            user_id, method = pick(rng, users, user_weights)[0], rng.choice(PAYMENT_METHODS)
+            paid_at = created + timedelta(minutes=rng.randint(1, 600)) if paid else None
+            delivered_at = created + timedelta(days=rng.randint(1, 10)) if delivered else None
+            orders.append((
+                order_id, user_id, method, tax, shipping, min(subtotal + tax + shipping, MAX_PRICE),
+                paid, self.db_datetime(paid_at), delivered, self.db_datetime(delivered_at),
+                self.db_datetime(created), self.db_datetime(delivered_at or paid_at or created),
+            ))
+            city, country, postal_code = rng.choice(CITIES)
+            addresses.append((order_id, '%d %s St' % (rng.randint(1, 200), rng.choice(LAST_NAMES)),
+                              city, postal_code, country, shipping))
+            items.extend((order_id, product_id, name, qty, price, ITEM_IMAGE)
+                         for (product_id, name, price, _), qty in lines.values())
+
+        return (
+            self.insert(Order, ['id', 'user', 'paymentMethod', 'taxPrice', 'shippingPrice', 'totalPrice',
+                                'isPaid', 'paidAt', 'isDelivered', 'deliveredAt', 'createdAt', 'updatedAt'], orders)
+            + self.insert(ShippingAddress, ['order', 'address', 'city', 'postalCode', 'country',
+                                            'shippingPrice'], addresses)
+            + self.insert(OrderItem, ['order', 'product', 'name', 'qty', 'price', 'image'], items)
+        )
@@ -0,0 +1,180 @@
+"""
+Per-request performance metrics.
+
+PerformanceMiddleware (api/middleware.py) opens a `Timings` for every
+request; SQL statements, serializers and the renderer add to it while the
+request runs. When the response is ready the timings go out in a
+Server-Timing header and into per-route histograms, which
+`render_prometheus` exports in the Prometheus text format.
+
+Histograms live in the worker process, like the cache counters in
+api/cache.py; scrape every worker, or run one, to see the whole picture.
+"""
+import bisect
+import threading
+import time
+from contextvars import ContextVar
+
+
+# upper bounds of the histogram buckets, +Inf is implied
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+PREFIX = 'hardware_market'
+UNMATCHED = 'unmatched'
+
+_current = ContextVar('request_timings', default=None)
+
+
+class Timings:
+    __slots__ = ('started', 'queries', 'db', 'serialize', 'render', 'serializing')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db = 0.0
+        self.serialize = 0.0
+        self.render = 0.0
+        self.serializing = False
+
+    def server_timing(self, total):
+        return 'db;dur=%.2f;desc="%d queries", serialize;dur=%.2f, render;dur=%.2f, total;dur=%.2f' % (
+            self.db * 1000, self.queries, self.serialize * 1000, self.render * 1000, total * 1000)
+
+
+def start():
+    """Open the timings of a request; pass the returned token to `finish`."""
+    timings = Timings()
+    return timings, _current.set(timings)
+
+
+def finish(token):
+    _current.reset(token)
+
+
+def time_query(execute, sql, params, many, context):
+    """Database execute wrapper, installed on every connection by ApiConfig."""
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.db += time.perf_counter() - started
+        timings.queries += 1
+
+
+def install_query_timer(sender, connection, **kwargs):
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+class TimedSerializerMixin:
+    """
+    Count the time spent in `to_representation` as serializer time. Nested
+    serializers are part of the outermost one, and the queries they trigger
+    are left to the database timing.
+    """
+
+    def to_representation(self, instance):
+        timings = _current.get()
+        if timings is None or timings.serializing:
+            return super().to_representation(instance)
+
+        timings.serializing = True
+        started, db = time.perf_counter(), timings.db
+        try:
+            return super().to_representation(instance)
+        finally:
+            timings.serializing = False
+            timings.serialize += time.perf_counter() - started - (timings.db - db)
+
+
+def time_render(response):
+    """Count the time the response takes to render, from now until it is rendered."""
+    timings = _current.get()
+    if timings is not None:
+        started = time.perf_counter()
+
+        def rendered(response):
+            timings.render += time.perf_counter() - started
+
+        response.add_post_render_callback(rendered)
+    return response
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            yield '%s_bucket{%s,le="%s"} %d' % (name, labels, bound, cumulative)
+        yield '%s_sum{%s} %s' % (name, labels, round(self.sum, 6))
+        yield '%s_count{%s} %d' % (name, labels, cumulative)
+
+
+# name -> (help, buckets, Timings attribute)
+HISTOGRAMS = {
+    'request_duration_seconds': ('Time to produce the response.', DURATION_BUCKETS, None),
+    'db_duration_seconds': ('Time spent running SQL.', DURATION_BUCKETS, 'db'),
+    'db_queries': ('SQL statements per request.', QUERY_BUCKETS, 'queries'),
+    'serialize_duration_seconds': ('Time spent in serializers, SQL excluded.', DURATION_BUCKETS, 'serialize'),
+    'render_duration_seconds': ('Time spent rendering the response body.', DURATION_BUCKETS, 'render'),
+}
+
+# (route, method) -> {histogram name: Histogram}, (route, method, status) -> count
+_histograms = {}
+_responses = {}
+_lock = threading.Lock()
+
+
+def record(route, method, status, timings, total):
+    key = (route or UNMATCHED, method)
+    with _lock:
+        series = _histograms.get(key)
+        if series is None:
+            series = _histograms[key] = {name: Histogram(buckets)
+                                         for name, (_, buckets, _) in HISTOGRAMS.items()}
+        for name, (_, _, attribute) in HISTOGRAMS.items():
+            series[name].observe(total if attribute is None else getattr(timings, attribute))
+        key += (status,)
+        _responses[key] = _responses.get(key, 0) + 1
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _responses.clear()
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_prometheus():
+    with _lock:
+        histograms = sorted(_histograms.items())
+        lines = []
+        for name, (help, _, _) in HISTOGRAMS.items():
+            name = '%s_%s' % (PREFIX, name)
+            lines += ['# HELP %s %s' % (name, help), '# TYPE %s histogram' % name]
+            for (route, method), series in histograms:
+                labels = 'route="%s",method="%s"' % (_escape(route), method)
+                lines.extend(series[name[len(PREFIX) + 1:]].lines(name, labels))
+
+        name = '%s_responses_total' % PREFIX
+        lines += ['# HELP %s Responses sent.' % name, '# TYPE %s counter' % name]
+        for (route, method, status), count in sorted(_responses.items()):
+            lines.append('%s{route="%s",method="%s",status="%d"} %d' % (name, _escape(route), method, status, count))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,106 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from . import metrics, routers
+
+
+class PerformanceMiddleware:
+    """
+    Time every request: SQL statements and their duration, serializer time,
+    render time and the total. The numbers go out in a Server-Timing header
+    and into the per-route histograms served by /api/metrics/.
+
+    Set PERFORMANCE_METRICS=false to drop the middleware from the stack.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PERFORMANCE_METRICS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        timings, token = metrics.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.finish(token)
+        return self.finish(request, response, timings)
+
+    async def __acall__(self, request):
+        timings, token = metrics.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.finish(token)
+        return self.finish(request, response, timings)
+
+    def finish(self, request, response, timings):
+        total = time.perf_counter() - timings.started
+        response['Server-Timing'] = timings.server_timing(total)
+        match = request.resolver_match
+        metrics.record(match.url_name if match else None, request.method, response.status_code, timings, total)
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses render after the view returns
+        return metrics.time_render(response)
+
+
+class ReplicaMiddleware:
+    """
+    Let GET and HEAD requests read from the replicas in DATABASE_REPLICAS,
+    and keep clients that just wrote on the primary (see api/routers.py).
+    Not used when there are no replicas.
+    """
+    sync_capable = True
+    async_capable = True
+
+    SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self, get_response):
+        if not settings.DATABASE_REPLICAS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        if request.method not in self.SAFE_METHODS:
+            response = self.get_response(request)
+            routers.pin(request)
+            return response
+        if routers.is_pinned(request):
+            return self.get_response(request)
+
+        token = routers.read_from_replicas()
+        try:
+            return self.get_response(request)
+        finally:
+            routers.reset(token)
+
+    async def __acall__(self, request):
+        if request.method not in self.SAFE_METHODS:
+            response = await self.get_response(request)
+            await routers.apin(request)
+            return response
+        if await routers.ais_pinned(request):
+            return await self.get_response(request)
+
+        token = routers.read_from_replicas()
+        try:
+            return await self.get_response(request)
+        finally:
+            routers.reset(token)
@@ -0,0 +1,79 @@
+from django.db import migrations
+
+
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE api_product_fts USING fts5("
+    "name, category, description, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')",
+    "INSERT INTO api_product_fts (api_product_fts, rank) VALUES ('rank', 'bm25(10.0, 5.0, 1.0)')",
+    "INSERT INTO api_product_fts (rowid, name, category, description) "
+    "SELECT id, name, category, description FROM api_product",
+    "CREATE TRIGGER api_product_fts_insert AFTER INSERT ON api_product BEGIN "
+    "INSERT INTO api_product_fts (rowid, name, category, description) "
+    "VALUES (new.id, new.name, new.category, new.description); END",
+    "CREATE TRIGGER api_product_fts_delete AFTER DELETE ON api_product BEGIN "
+    "DELETE FROM api_product_fts WHERE rowid = old.id; END",
+    "CREATE TRIGGER api_product_fts_update AFTER UPDATE OF name, category, description ON api_product BEGIN "
+    "UPDATE api_product_fts SET name = new.name, category = new.category, description = new.description "
+    "WHERE rowid = new.id; END",
+]
+
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS api_product_fts_update",
+    "DROP TRIGGER IF EXISTS api_product_fts_delete",
+    "DROP TRIGGER IF EXISTS api_product_fts_insert",
+    "DROP TABLE IF EXISTS api_product_fts",
+]
+
+POSTGRES_FORWARD = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "ALTER TABLE api_product ADD COLUMN search_vector tsvector",
+    """
+    CREATE FUNCTION api_product_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('simple', coalesce(NEW.name, '')), 'A') ||
+            setweight(to_tsvector('simple', coalesce(NEW.category, '')), 'B') ||
+            setweight(to_tsvector('simple', coalesce(NEW.description, '')), 'C');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "CREATE TRIGGER api_product_search_vector_trigger BEFORE INSERT OR UPDATE OF name, category, description ON api_product "
+    "FOR EACH ROW EXECUTE FUNCTION api_product_search_vector_update()",
+    "UPDATE api_product SET name = name",
+    "CREATE INDEX api_product_search_vector_idx ON api_product USING gin (search_vector)",
+    "CREATE INDEX api_product_name_trgm_idx ON api_product USING gin (name gin_trgm_ops)",
+]
+
+POSTGRES_REVERSE = [
+    "DROP INDEX IF EXISTS api_product_name_trgm_idx",
+    "DROP INDEX IF EXISTS api_product_search_vector_idx",
+    "DROP TRIGGER IF EXISTS api_product_search_vector_trigger ON api_product",
+    "DROP FUNCTION IF EXISTS api_product_search_vector_update()",
+    "ALTER TABLE api_product DROP COLUMN IF EXISTS search_vector",
+]
+
+
+def run_for_vendor(sqlite_statements, postgres_statements):
+    def run(apps, schema_editor):
+        statements = {
+            'sqlite': sqlite_statements,
+            'postgresql': postgres_statements,
+        }.get(schema_editor.connection.vendor, [])
+        for statement in statements:
+            schema_editor.execute(statement, params=None)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_alter_product_image'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_for_vendor(SQLITE_FORWARD, POSTGRES_FORWARD),
+            run_for_vendor(SQLITE_REVERSE, POSTGRES_REVERSE),
+        ),
+    ]
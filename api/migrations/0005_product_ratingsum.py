@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:31
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill_rating_sum(apps, schema_editor):
+    Product = apps.get_model('api', 'Product')
+    Review = apps.get_model('api', 'Review')
+    totals = (Review.objects.filter(product__isnull=False)
+                            .values('product')
+                            .annotate(total=Sum('rating'), count=Count('id'))
+                            .order_by())
+    for row in totals:
+        Product.objects.filter(id=row['product']).update(
+            ratingSum=row['total'] or 0, numOfReviews=row['count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_product_created_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='ratingSum',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_rating_sum, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,182 @@
+import django.db.models.deletion
+from collections import Counter, defaultdict
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.utils.text import slugify
+
+
+SQLITE_DROP_TRIGGERS = [
+    "DROP TRIGGER IF EXISTS api_product_fts_update",
+    "DROP TRIGGER IF EXISTS api_product_fts_insert",
+]
+
+SQLITE_RESTORE_TRIGGERS = [
+    "CREATE TRIGGER api_product_fts_insert AFTER INSERT ON api_product BEGIN "
+    "INSERT INTO api_product_fts (rowid, name, category, description) "
+    "VALUES (new.id, new.name, new.category, new.description); END",
+    "CREATE TRIGGER api_product_fts_update AFTER UPDATE OF name, category, description ON api_product BEGIN "
+    "UPDATE api_product_fts SET name = new.name, category = new.category, description = new.description "
+    "WHERE rowid = new.id; END",
+]
+
+# The index keeps the category *name*, looked up from api_category
+SQLITE_CREATE_TRIGGERS = [
+    "CREATE TRIGGER IF NOT EXISTS api_product_fts_insert AFTER INSERT ON api_product BEGIN "
+    "INSERT INTO api_product_fts (rowid, name, category, description) VALUES (new.id, new.name, "
+    "(SELECT name FROM api_category WHERE id = new.category_id), new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS api_product_fts_update "
+    "AFTER UPDATE OF name, category_id, description ON api_product BEGIN "
+    "UPDATE api_product_fts SET name = new.name, "
+    "category = (SELECT name FROM api_category WHERE id = new.category_id), "
+    "description = new.description WHERE rowid = new.id; END",
+    "CREATE TRIGGER IF NOT EXISTS api_category_fts_update AFTER UPDATE OF name ON api_category BEGIN "
+    "UPDATE api_product_fts SET category = new.name "
+    "WHERE rowid IN (SELECT id FROM api_product WHERE category_id = new.id); END",
+    "DELETE FROM api_product_fts",
+    "INSERT INTO api_product_fts (rowid, name, category, description) "
+    "SELECT p.id, p.name, c.name, p.description FROM api_product p "
+    "LEFT JOIN api_category c ON c.id = p.category_id",
+]
+
+SQLITE_DROP_CATEGORY_TRIGGERS = SQLITE_DROP_TRIGGERS + [
+    "DROP TRIGGER IF EXISTS api_category_fts_update",
+]
+
+POSTGRES_DROP_TRIGGERS = [
+    "DROP TRIGGER IF EXISTS api_product_search_vector_trigger ON api_product",
+]
+
+POSTGRES_RESTORE_TRIGGERS = [
+    """
+    CREATE OR REPLACE FUNCTION api_product_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('simple', coalesce(NEW.name, '')), 'A') ||
+            setweight(to_tsvector('simple', coalesce(NEW.category, '')), 'B') ||
+            setweight(to_tsvector('simple', coalesce(NEW.description, '')), 'C');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "CREATE TRIGGER api_product_search_vector_trigger "
+    "BEFORE INSERT OR UPDATE OF name, category, description ON api_product "
+    "FOR EACH ROW EXECUTE FUNCTION api_product_search_vector_update()",
+    "UPDATE api_product SET name = name",
+]
+
+POSTGRES_CREATE_TRIGGERS = [
+    """
+    CREATE OR REPLACE FUNCTION api_product_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('simple', coalesce(NEW.name, '')), 'A') ||
+            setweight(to_tsvector('simple', coalesce(
+                (SELECT name FROM api_category WHERE id = NEW.category_id), '')), 'B') ||
+            setweight(to_tsvector('simple', coalesce(NEW.description, '')), 'C');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "CREATE TRIGGER api_product_search_vector_trigger "
+    "BEFORE INSERT OR UPDATE OF name, category_id, description ON api_product "
+    "FOR EACH ROW EXECUTE FUNCTION api_product_search_vector_update()",
+    """
+    CREATE FUNCTION api_category_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        UPDATE api_product SET name = name WHERE category_id = NEW.id;
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "CREATE TRIGGER api_category_search_vector_trigger AFTER UPDATE OF name ON api_category "
+    "FOR EACH ROW EXECUTE FUNCTION api_category_search_vector_update()",
+    "UPDATE api_product SET name = name",
+]
+
+POSTGRES_DROP_CATEGORY_TRIGGERS = POSTGRES_DROP_TRIGGERS + [
+    "DROP TRIGGER IF EXISTS api_category_search_vector_trigger ON api_category",
+    "DROP FUNCTION IF EXISTS api_category_search_vector_update()",
+]
+
+
+def run_for_vendor(sqlite_statements, postgres_statements):
+    def run(apps, schema_editor):
+        statements = {
+            'sqlite': sqlite_statements,
+            'postgresql': postgres_statements,
+        }.get(schema_editor.connection.vendor, [])
+        for statement in statements:
+            schema_editor.execute(statement, params=None)
+    return run
+
+
+def map_categories(apps, schema_editor):
+    # Free-text categories that only differ in case or spacing become one
+    # Category, named after their most common spelling
+    Product = apps.get_model('api', 'Product')
+    Category = apps.get_model('api', 'Category')
+
+    spellings = defaultdict(Counter)
+    counts = Product.objects.exclude(category__isnull=True).values('category').annotate(n=Count('id')).order_by()
+    for row in counts:
+        name = ' '.join(row['category'].split())
+        slug = slugify(name, allow_unicode=True)[:75]
+        if slug:
+            spellings[slug][row['category']] += row['n']
+
+    for slug, raw_names in spellings.items():
+        name = ' '.join(raw_names.most_common(1)[0][0].split())
+        category = Category.objects.create(name=name, slug=slug, productCount=sum(raw_names.values()))
+        Product.objects.filter(category__in=list(raw_names)).update(categoryRef=category)
+
+
+def unmap_categories(apps, schema_editor):
+    Product = apps.get_model('api', 'Product')
+    for product in Product.objects.exclude(categoryRef__isnull=True).select_related('categoryRef'):
+        Product.objects.filter(id=product.id).update(category=product.categoryRef.name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_leaderboard'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Category',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=75, unique=True)),
+                ('slug', models.SlugField(allow_unicode=True, max_length=75, unique=True)),
+                ('productCount', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'categories',
+            },
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='categoryRef',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='api.category'),
+        ),
+        migrations.RunPython(map_categories, unmap_categories),
+        migrations.RunPython(
+            run_for_vendor(SQLITE_DROP_TRIGGERS, POSTGRES_DROP_TRIGGERS),
+            run_for_vendor(SQLITE_RESTORE_TRIGGERS, POSTGRES_RESTORE_TRIGGERS),
+        ),
+        migrations.RemoveField(
+            model_name='product',
+            name='category',
+        ),
+        migrations.RenameField(
+            model_name='product',
+            old_name='categoryRef',
+            new_name='category',
+        ),
+        migrations.RunPython(
+            run_for_vendor(SQLITE_CREATE_TRIGGERS, POSTGRES_CREATE_TRIGGERS),
+            run_for_vendor(SQLITE_DROP_CATEGORY_TRIGGERS, POSTGRES_DROP_CATEGORY_TRIGGERS),
+        ),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:07
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+from django.db.models.functions import Coalesce, Greatest
+
+
+# SQLite rebuilds api_product to add the column, which drops its triggers and
+# fails while api_category still has one that refers to the old table
+SQLITE_DROP_TRIGGERS = [
+    "DROP TRIGGER IF EXISTS api_category_fts_update",
+]
+
+SQLITE_CREATE_TRIGGERS = [
+    "CREATE TRIGGER IF NOT EXISTS api_product_fts_insert AFTER INSERT ON api_product BEGIN "
+    "INSERT INTO api_product_fts (rowid, name, category, description) VALUES (new.id, new.name, "
+    "(SELECT name FROM api_category WHERE id = new.category_id), new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS api_product_fts_delete AFTER DELETE ON api_product BEGIN "
+    "DELETE FROM api_product_fts WHERE rowid = old.id; END",
+    "CREATE TRIGGER IF NOT EXISTS api_product_fts_update "
+    "AFTER UPDATE OF name, category_id, description ON api_product BEGIN "
+    "UPDATE api_product_fts SET name = new.name, "
+    "category = (SELECT name FROM api_category WHERE id = new.category_id), "
+    "description = new.description WHERE rowid = new.id; END",
+    "CREATE TRIGGER IF NOT EXISTS api_category_fts_update AFTER UPDATE OF name ON api_category BEGIN "
+    "UPDATE api_product_fts SET category = new.name "
+    "WHERE rowid IN (SELECT id FROM api_product WHERE category_id = new.id); END",
+]
+
+
+def run_on_sqlite(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor == 'sqlite':
+            for statement in statements:
+                schema_editor.execute(statement, params=None)
+    return run
+
+
+def backfill(apps, schema_editor):
+    # The rows were last changed at some point after they were created
+    Product = apps.get_model('api', 'Product')
+    Order = apps.get_model('api', 'Order')
+    Product.objects.update(updatedAt=F('createdAt'))
+    Order.objects.update(updatedAt=Greatest(
+        'createdAt', Coalesce('paidAt', 'createdAt'), Coalesce('deliveredAt', 'createdAt')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_product_imagevariants'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(run_on_sqlite(SQLITE_DROP_TRIGGERS), run_on_sqlite(SQLITE_CREATE_TRIGGERS)),
+        migrations.AddField(
+            model_name='order',
+            name='updatedAt',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='updatedAt',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(run_on_sqlite(SQLITE_CREATE_TRIGGERS), run_on_sqlite(SQLITE_DROP_TRIGGERS)),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['updatedAt'], name='order_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['updatedAt'], name='product_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+from django.db import migrations
+
+
+# auth_user belongs to django.contrib.auth, so its indexes are plain SQL.
+# The user listing pages over (date_joined, id) and searches prefixes of
+# lower(username) and lower(email). PostgreSQL serves LIKE 'prefix%' from
+# text_pattern_ops indexes whatever the database collation; SQLite has no
+# operator classes and searches with a range (see searchUsers).
+INDEXES = [
+    ('api_user_joined_idx', 'auth_user (date_joined, id)'),
+    ('api_user_username_lower_idx', 'auth_user (lower(username){opclass})'),
+    ('api_user_email_lower_idx', 'auth_user (lower(email){opclass})'),
+]
+
+
+def create_statements(opclass):
+    return ['CREATE INDEX %s ON %s' % (name, definition.format(opclass=opclass)) for name, definition in INDEXES]
+
+
+DROP = ['DROP INDEX IF EXISTS %s' % name for name, _ in INDEXES]
+
+
+def run_for_vendor(sqlite_statements, postgres_statements):
+    def run(apps, schema_editor):
+        statements = {
+            'sqlite': sqlite_statements,
+            'postgresql': postgres_statements,
+        }.get(schema_editor.connection.vendor, [])
+        for statement in statements:
+            schema_editor.execute(statement, params=None)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_updated_at'),
+        # after the last auth_user rebuild, which would drop them on SQLite
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_for_vendor(create_statements(''), create_statements(' text_pattern_ops')),
+            run_for_vendor(DROP, DROP),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:05
+
+import django.core.serializers.json
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('args', models.JSONField(blank=True, default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=10)),
+                ('attempts', models.IntegerField(default=0)),
+                ('maxAttempts', models.IntegerField(default=1)),
+                ('runAt', models.DateTimeField(default=django.utils.timezone.now)),
+                ('lockedBy', models.CharField(blank=True, max_length=100, null=True)),
+                ('lockedAt', models.DateTimeField(blank=True, null=True)),
+                ('result', models.JSONField(blank=True, encoder=django.core.serializers.json.DjangoJSONEncoder, null=True)),
+                ('error', models.TextField(blank=True, default='')),
+                ('createdAt', models.DateTimeField(auto_now_add=True)),
+                ('finishedAt', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('status', 'queued')), fields=['runAt', 'id'], name='job_queued_idx'), models.Index(condition=models.Q(('status', 'running')), fields=['lockedAt'], name='job_running_idx'), models.Index(fields=['status', 'id'], name='job_status_idx'), models.Index(condition=models.Q(('status', 'done')), fields=['finishedAt'], name='job_done_idx')],
+            },
+        ),
+    ]
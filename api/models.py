@@ -1,26 +1,79 @@
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 # Create your models here.
 
+class Category(models.Model):
+    name = models.CharField(max_length=75, unique=True)
+    slug = models.SlugField(max_length=75, unique=True, allow_unicode=True)
+    # number of products in the category, kept up to date by api.categories
+    productCount = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = 'categories'
+
+    def __str__(self):
+        return self.name
+
+
+class ProductManager(models.Manager):
+    def get_queryset(self):
+        # ProductSerializer always shows the category name
+        return super().get_queryset().select_related('category')
+
+
 class Product(models.Model):
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
     name = models.CharField(max_length=150, null=True, blank=True)
     image = models.ImageField(upload_to='hardwareImages/', default='hardwareImages/default.png',
                                  null=True, blank=True)
-    category = models.CharField(max_length=75, null=True, blank=True)
+    # resized WebP copies of `image`, rendered by api.images
+    imageVariants = models.JSONField(default=dict, blank=True)
+    category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True)
     description = models.TextField(null=True, blank=True)
     rating = models.DecimalField(max_digits=7, decimal_places=2,
                                     null=True, blank=True)
     numOfReviews = models.IntegerField(null=True, blank=True, default=0)
+    # running total of review ratings, so `rating` can be kept up to date in O(1)
+    ratingSum = models.IntegerField(default=0)
     price = models.DecimalField(max_digits=7, decimal_places=2,
                                     null=True, blank=True)
     countInStock = models.IntegerField(null=True, blank=True, default=0)
     createdAt = models.DateTimeField(auto_now_add=True)
+    # ETag and Last-Modified of the product; set it by hand in .update() calls
+    updatedAt = models.DateTimeField(auto_now=True)
+
+    objects = ProductManager()
+
+    class Meta:
+        indexes = [
+            # keyset pagination of the product listing
+            models.Index(fields=['createdAt', 'id'], name='product_created_id_idx'),
+            # category listing, newest first
+            models.Index(fields=['category', 'createdAt', 'id'], name='product_category_created_idx'),
+            # leaderboard ranking (api.leaderboard.RANKING), catalog-wide and per category
+            models.Index(fields=['rating', 'numOfReviews', 'createdAt', 'id'], name='product_ranking_idx'),
+            models.Index(fields=['category', 'rating', 'numOfReviews', 'createdAt', 'id'],
+                         name='product_category_ranking_idx'),
+            # validators of the listings (api.conditional)
+            models.Index(fields=['updatedAt'], name='product_updated_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+class Leaderboard(models.Model):
+    # "all" or "category:<slug>", holds the ranked ids of the top products
+    scope = models.CharField(max_length=100, unique=True)
+    products = models.JSONField(default=list)
+    updatedAt = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.scope
+
+
 class Review(models.Model):
     product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True)
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
@@ -29,10 +82,26 @@ class Review(models.Model):
     comment = models.TextField(null=True, blank=True)
     createdAt = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # "already reviewed" check
+            models.Index(fields=['product', 'user'], name='review_product_user_idx'),
+        ]
+
     def __str__(self):
         return str(self.rating)
 
 
+class OrderQuerySet(models.QuerySet):
+    def with_details(self):
+        # Everything OrderSerializer touches, in a constant number of queries
+        return self.select_related('user', 'shippingaddress').prefetch_related('orderitem_set')
+
+    def touch(self):
+        # For changes the order rows do not see, like its user's new name
+        return self.update(updatedAt=timezone.now())
+
+
 class Order(models.Model):
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
     paymentMethod = models.CharField(max_length=200, null=True, blank=True)
@@ -48,6 +117,23 @@ class Order(models.Model):
     deliveredAt = models.DateTimeField(
         auto_now_add=False, null=True, blank=True)
     createdAt = models.DateTimeField(auto_now_add=True)
+    # ETag and Last-Modified of the order, see OrderQuerySet.touch()
+    updatedAt = models.DateTimeField(auto_now=True)
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # a user's order history
+            models.Index(fields=['user', 'createdAt'], name='order_user_created_idx'),
+            # date ranges of the admin export
+            models.Index(fields=['createdAt'], name='order_created_idx'),
+            # the open orders are a small slice of the table, only index those
+            models.Index(fields=['id'], condition=models.Q(isPaid=False), name='order_unpaid_idx'),
+            models.Index(fields=['id'], condition=models.Q(isDelivered=False), name='order_undelivered_idx'),
+            # validators of the admin order list (api.conditional)
+            models.Index(fields=['updatedAt'], name='order_updated_idx'),
+        ]
 
     def __str__(self):
         return str(self.createdAt)
@@ -77,4 +163,76 @@ class ShippingAddress(models.Model):
         max_digits=7, decimal_places=2, null=True, blank=True)
 
     def __str__(self):
-        return str(self.address)
\ No newline at end of file
+        return str(self.address)
+
+class DailySales(models.Model):
+    # orders placed on `day` and how far they got, maintained by api.sales
+    day = models.DateField(unique=True)
+    orders = models.IntegerField(default=0)
+    paidOrders = models.IntegerField(default=0)
+    deliveredOrders = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    paidRevenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    units = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = 'daily sales'
+
+    def __str__(self):
+        return str(self.day)
+
+
+class ProductSales(models.Model):
+    # units and revenue of a product's order items on `day`, maintained by api.sales
+    day = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True)
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name_plural = 'product sales'
+        constraints = [
+            # the rollup key, and the index of the date range reads
+            models.UniqueConstraint(fields=['day', 'product'], name='product_sales_day_product_uniq'),
+        ]
+
+    def __str__(self):
+        return '%s %s' % (self.day, self.product_id)
+
+
+class Job(models.Model):
+    # a queued call of one of api.jobs.TASKS, run by `manage.py runworker`
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    name = models.CharField(max_length=100)
+    args = models.JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder)
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED)
+    attempts = models.IntegerField(default=0)
+    maxAttempts = models.IntegerField(default=1)
+    # not before, the next retry of a failed attempt
+    runAt = models.DateTimeField(default=timezone.now)
+    lockedBy = models.CharField(max_length=100, null=True, blank=True)
+    lockedAt = models.DateTimeField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    # traceback of the last failed attempt
+    error = models.TextField(blank=True, default='')
+    createdAt = models.DateTimeField(auto_now_add=True)
+    finishedAt = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # the next due job; the queue is a small slice of the table
+            models.Index(fields=['runAt', 'id'], condition=models.Q(status='queued'), name='job_queued_idx'),
+            # running jobs whose worker was lost
+            models.Index(fields=['lockedAt'], condition=models.Q(status='running'), name='job_running_idx'),
+            # status listing and counts, purge of old jobs
+            models.Index(fields=['status', 'id'], name='job_status_idx'),
+            models.Index(fields=['finishedAt'], condition=models.Q(status='done'), name='job_done_idx'),
+        ]
+
+    def __str__(self):
+        return '%s #%s' % (self.name, self.id)
@@ -0,0 +1,117 @@
+"""
+Keyset (cursor) pagination over `(<timestamp>, id)`, newest first: products
+by `createdAt`, users by `date_joined`.
+
+A cursor is an opaque, url-safe token holding the sort key of the row to
+continue from and the direction to walk in, so every page is a single index
+range scan no matter how deep the client has paged.
+"""
+import base64
+import hashlib
+import json
+from operator import attrgetter
+
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+DEFAULT_PAGE_SIZE = 4
+MAX_PAGE_SIZE = 100
+COUNT_CACHE_TIMEOUT = 60
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(created, pk, reverse=False):
+    data = [created.isoformat(), pk, int(reverse)]
+    token = base64.urlsafe_b64encode(json.dumps(data, separators=(',', ':')).encode())
+    return token.decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        created, pk, reverse = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        created = parse_datetime(created)
+        if created is None:
+            raise ValueError
+        return created, int(pk), bool(reverse)
+    except (ValueError, TypeError):
+        raise InvalidCursor('Invalid cursor')
+
+
+def get_page_size(value, default=DEFAULT_PAGE_SIZE):
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def paginate(queryset, cursor=None, page_size=DEFAULT_PAGE_SIZE, field='createdAt', key=None):
+    """
+    Return `(rows, next_cursor, prev_cursor)` for the page after (or, for a
+    reversed cursor, before) `cursor`, walking `(field, id)`. Missing
+    neighbours are `None`. `key(row)` gives a row's `(field, id)`; rows are
+    model instances unless it is passed.
+    """
+    page, reverse = _page_queryset(queryset, cursor, page_size, field)
+    return _page_result(list(page), cursor, reverse, page_size, key or attrgetter(field, 'id'))
+
+
+async def apaginate(queryset, cursor=None, page_size=DEFAULT_PAGE_SIZE, field='createdAt', key=None):
+    page, reverse = _page_queryset(queryset, cursor, page_size, field)
+    return _page_result([row async for row in page], cursor, reverse, page_size, key or attrgetter(field, 'id'))
+
+
+def _page_queryset(queryset, cursor, page_size, field):
+    reverse = False
+    if cursor:
+        created, pk, reverse = decode_cursor(cursor)
+        if reverse:
+            queryset = queryset.filter(Q(**{field + '__gt': created}) | Q(**{field: created, 'id__gt': pk}))
+        else:
+            queryset = queryset.filter(Q(**{field + '__lt': created}) | Q(**{field: created, 'id__lt': pk}))
+
+    if reverse:
+        queryset = queryset.order_by(field, 'id')
+    else:
+        queryset = queryset.order_by('-' + field, '-id')
+
+    # One extra row tells whether there is anything beyond this page.
+    return queryset[:page_size + 1], reverse
+
+
+def _page_result(rows, cursor, reverse, page_size, key):
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if reverse:
+        rows.reverse()
+
+    if not rows:
+        return rows, None, None
+
+    next_cursor = encode_cursor(*key(rows[-1])) if has_more or reverse else None
+    prev_cursor = encode_cursor(*key(rows[0]), reverse=True) if cursor and (has_more or not reverse) else None
+    return rows, next_cursor, prev_cursor
+
+
+def cached_count(queryset, key):
+    """Row count of `queryset`, recomputed at most every COUNT_CACHE_TIMEOUT seconds."""
+    return cache.get_or_set(_count_key(key), queryset.count, COUNT_CACHE_TIMEOUT)
+
+
+async def acached_count(queryset, key):
+    key = _count_key(key)
+    count = await cache.aget(key)
+    if count is None:
+        count = await queryset.acount()
+        await cache.aset(key, count, COUNT_CACHE_TIMEOUT)
+    return count
+
+
+def _count_key(key):
+    return 'count:' + hashlib.md5(key.encode()).hexdigest()
@@ -0,0 +1,75 @@
+"""
+Product rating aggregates.
+
+Each product keeps the running sum and count of its review ratings, so a
+new review is a single UPDATE whatever the number of existing reviews.
+The arithmetic happens in the database, which makes concurrent reviews
+safe without locking the row from Python.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, FloatField, Sum, Value
+from django.db.models.functions import Cast, Coalesce
+from django.utils import timezone
+
+from .models import Product, Review
+
+
+def add_rating(product_id, rating):
+    """Fold one new review `rating` into the product's aggregates."""
+    count = Coalesce(F('numOfReviews'), Value(0)) + 1
+    total = F('ratingSum') + rating
+    # Every right-hand side sees the row as it was before this UPDATE
+    return Product.objects.filter(id=product_id).update(
+        numOfReviews=count,
+        ratingSum=total,
+        rating=ExpressionWrapper(
+            Cast(total, FloatField()) / count,
+            output_field=DecimalField(max_digits=7, decimal_places=2)),
+        updatedAt=timezone.now(),
+    )
+
+
+def recompute_all(batch_size=1000):
+    """
+    Rebuild the aggregates of every product from its reviews with one
+    grouped query, writing back only the rows that drifted. Returns the
+    number of products repaired.
+    """
+    totals = {
+        row['product']: (row['total'] or 0, row['count'])
+        for row in Review.objects.filter(product__isnull=False)
+                                 .values('product')
+                                 .annotate(total=Sum('rating'), count=Count('id'))
+                                 .order_by()
+    }
+
+    repaired = 0
+    now = timezone.now()
+    products = Product.objects.select_related(None).only('id', 'rating', 'numOfReviews', 'ratingSum').order_by('id')
+    batch = []
+    for product in products.iterator(chunk_size=batch_size):
+        total, count = totals.get(product.id, (0, 0))
+        rating = (Decimal(total) / count).quantize(Decimal('0.01')) if count else Decimal('0')
+        # an unreviewed product may keep NULL for its rating and count
+        current = (product.ratingSum, product.numOfReviews or 0, product.rating or Decimal('0'))
+        if current == (total, count, rating):
+            continue
+
+        product.ratingSum, product.numOfReviews, product.rating = total, count, rating
+        product.updatedAt = now
+        batch.append(product)
+        if len(batch) >= batch_size:
+            repaired += _save(batch)
+            batch = []
+
+    if batch:
+        repaired += _save(batch)
+    return repaired
+
+
+def _save(products):
+    with transaction.atomic():
+        Product.objects.bulk_update(products, ['ratingSum', 'numOfReviews', 'rating', 'updatedAt'])
+    return len(products)
@@ -0,0 +1,79 @@
+"""
+Routing between the primary database and its read replicas.
+
+Writes, and every read outside a request, go to the primary.
+ReplicaMiddleware (api/middleware.py) sends the reads of a GET or HEAD
+request to one replica, picked at random once per request so its reads
+agree with each other, unless the client wrote something in the last
+REPLICA_PIN_SECONDS: then it keeps reading from the primary, so it sees
+its own writes however far the replicas lag. Clients are told apart by
+their Authorization header, or their session cookie, and the pins live
+in the default cache; use a shared cache backend with several workers.
+"""
+import hashlib
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+PRIMARY = 'default'
+
+# the replica this context reads from, None for the primary
+_replica = ContextVar('replica', default=None)
+
+
+def read_from_replicas():
+    """Send this context's reads to one replica; pass the returned token to `reset`."""
+    replicas = settings.DATABASE_REPLICAS
+    return _replica.set(random.choice(replicas) if replicas else None)
+
+
+def reset(token):
+    _replica.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return _replica.get() or PRIMARY
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == PRIMARY
+
+
+def _pin_key(request):
+    client = request.headers.get('Authorization') or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if not client:
+        return None
+    return 'db:pin:%s' % hashlib.md5(client.encode()).hexdigest()
+
+
+def pin(request):
+    """Keep the client of `request` on the primary for REPLICA_PIN_SECONDS."""
+    key = _pin_key(request)
+    if key is not None:
+        cache.set(key, True, settings.REPLICA_PIN_SECONDS)
+
+
+async def apin(request):
+    key = _pin_key(request)
+    if key is not None:
+        await cache.aset(key, True, settings.REPLICA_PIN_SECONDS)
+
+
+def is_pinned(request):
+    key = _pin_key(request)
+    return key is not None and cache.get(key, False)
+
+
+async def ais_pinned(request):
+    key = _pin_key(request)
+    return key is not None and await cache.aget(key, False)
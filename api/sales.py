@@ -0,0 +1,108 @@
+"""
+Daily sales rollups behind the analytics endpoints.
+
+`DailySales` keeps one row per day and `ProductSales` one per day and
+product, both keyed by the day the order was placed. Checkout adds the
+order and its lines, paying and delivering it move it down the funnel of
+that day; each is one or two upserts, so the dashboards read a few hundred
+rollup rows instead of every order and order item.
+
+Orders changed or deleted outside the views are not followed; `rebuild()`
+(manage.py rebuild_sales) recomputes the rollups from the orders.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Count, DecimalField, F, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .models import DailySales, Order, OrderItem, ProductSales
+
+
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+
+
+def _money(value):
+    return Decimal(str(value)) if value not in (None, '') else Decimal(0)
+
+
+def _add(model, key, rows):
+    """
+    Add the counters of `rows` (dicts of field values) to the rollup rows
+    of their `key` fields, creating those on first use, in one INSERT ...
+    ON CONFLICT DO UPDATE: concurrent checkouts of the same day neither
+    race to create a row nor cost a query each.
+    """
+    ops = connection.ops
+    table = ops.quote_name(model._meta.db_table)
+    fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+    counters = [ops.quote_name(field.column) for field in fields if field.name not in key]
+    sql = 'INSERT INTO %s (%s) VALUES %s ON CONFLICT (%s) DO UPDATE SET %s' % (
+        table,
+        ', '.join(ops.quote_name(field.column) for field in fields),
+        ', '.join(['(%s)' % ', '.join(['%s'] * len(fields))] * len(rows)),
+        ', '.join(ops.quote_name(model._meta.get_field(name).column) for name in key),
+        ', '.join('%s = %s.%s + excluded.%s' % (column, table, column, column) for column in counters),
+    )
+    params = [field.get_db_prep_save(row.get(field.name, 0), connection) for row in rows for field in fields]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def order_placed(order, items):
+    """Count the new `order` and its OrderItems `items`."""
+    day = timezone.localdate(order.createdAt)
+    lines = defaultdict(lambda: [0, Decimal(0)])
+    for item in items:
+        qty = int(item.qty or 0)
+        lines[item.product_id][0] += qty
+        lines[item.product_id][1] += qty * _money(item.price)
+
+    _add(DailySales, ['day'], [{'day': day, 'orders': 1, 'revenue': _money(order.totalPrice),
+                                'units': sum(units for units, _ in lines.values())}])
+    # ascending ids so concurrent checkouts lock rows in the same order
+    _add(ProductSales, ['day', 'product'], [
+        {'day': day, 'product': product_id, 'units': units, 'revenue': revenue}
+        for product_id, (units, revenue) in sorted(lines.items(), key=lambda line: line[0] or 0)
+    ])
+
+
+def order_paid(order):
+    _add(DailySales, ['day'], [{'day': timezone.localdate(order.createdAt), 'paidOrders': 1,
+                                'paidRevenue': _money(order.totalPrice)}])
+
+
+def order_delivered(order):
+    _add(DailySales, ['day'], [{'day': timezone.localdate(order.createdAt), 'deliveredOrders': 1}])
+
+
+def rebuild():
+    """Recompute both rollups from the orders, return the number of days."""
+    orders = (Order.objects.annotate(day=TruncDate('createdAt')).order_by().values('day')
+                           .annotate(orders=Count('id'),
+                                     paidOrders=Count('id', filter=Q(isPaid=True)),
+                                     deliveredOrders=Count('id', filter=Q(isDelivered=True)),
+                                     revenue=Coalesce(Sum('totalPrice'), Value(0), output_field=MONEY),
+                                     paidRevenue=Coalesce(Sum('totalPrice', filter=Q(isPaid=True)), Value(0),
+                                                          output_field=MONEY)))
+    items = (OrderItem.objects.filter(order__isnull=False)
+                              .annotate(day=TruncDate('order__createdAt')).order_by().values('day', 'product')
+                              .annotate(units=Coalesce(Sum('qty'), 0),
+                                        revenue=Coalesce(Sum(F('qty') * F('price'), output_field=MONEY),
+                                                         Value(0), output_field=MONEY)))
+
+    days = {row['day']: DailySales(**row) for row in orders}
+    products = []
+    for row in items:
+        days[row['day']].units += row['units']
+        products.append(ProductSales(day=row['day'], product_id=row['product'],
+                                     units=row['units'], revenue=row['revenue']))
+
+    with transaction.atomic():
+        DailySales.objects.all().delete()
+        ProductSales.objects.all().delete()
+        DailySales.objects.bulk_create(days.values(), batch_size=1000)
+        ProductSales.objects.bulk_create(products, batch_size=1000)
+    return len(days)
@@ -0,0 +1,162 @@
+"""
+Full-text product search.
+
+SQLite keeps an FTS5 table (`api_product_fts`) and PostgreSQL a weighted
+tsvector column (`api_product.search_vector`) in sync with `api_product`
+through database triggers, so every write path - views, admin, bulk
+operations - updates the index. They are created by migrations 0003 and
+0007; the category column holds the name of the product's Category.
+"""
+import re
+
+from django.db import connection, connections
+from django.db.models import Q
+
+
+FTS_TABLE = 'api_product_fts'
+
+# Relative weight of the indexed columns when ranking matches.
+NAME_WEIGHT = 10.0
+CATEGORY_WEIGHT = 5.0
+DESCRIPTION_WEIGHT = 1.0
+
+_TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+SQLITE_TRIGGERS = {
+    'api_product_fts_insert':
+        "CREATE TRIGGER api_product_fts_insert AFTER INSERT ON api_product BEGIN "
+        "INSERT INTO api_product_fts (rowid, name, category, description) VALUES (new.id, new.name, "
+        "(SELECT name FROM api_category WHERE id = new.category_id), new.description); END",
+    'api_product_fts_delete':
+        "CREATE TRIGGER api_product_fts_delete AFTER DELETE ON api_product BEGIN "
+        "DELETE FROM api_product_fts WHERE rowid = old.id; END",
+    'api_product_fts_update':
+        "CREATE TRIGGER api_product_fts_update "
+        "AFTER UPDATE OF name, category_id, description ON api_product BEGIN "
+        "UPDATE api_product_fts SET name = new.name, "
+        "category = (SELECT name FROM api_category WHERE id = new.category_id), "
+        "description = new.description WHERE rowid = new.id; END",
+    'api_category_fts_update':
+        "CREATE TRIGGER api_category_fts_update AFTER UPDATE OF name ON api_category BEGIN "
+        "UPDATE api_product_fts SET category = new.name "
+        "WHERE rowid IN (SELECT id FROM api_product WHERE category_id = new.id); END",
+}
+
+def get_terms(query):
+    return _TERM_RE.findall((query or '').lower())
+
+
+def search_products(queryset, query, ranked=True):
+    """
+    Restrict `queryset` to products matching every term of `query`.
+
+    The last term is matched as a prefix so results keep up with a search
+    box. With `ranked` the best matches come first; otherwise the caller's
+    ordering is kept. A query without terms leaves `queryset` untouched.
+    """
+    terms = get_terms(query)
+    if not terms:
+        return queryset
+
+    if connection.vendor == 'sqlite':
+        return _sqlite_search(queryset, terms, ranked)
+    if connection.vendor == 'postgresql':
+        return _postgres_search(queryset, terms, ranked)
+
+    # Any other backend: unindexed substring matching on the same columns.
+    for term in terms:
+        queryset = queryset.filter(
+            Q(name__icontains=term) | Q(category__name__icontains=term) | Q(description__icontains=term))
+    return queryset
+
+
+def _sqlite_search(queryset, terms, ranked):
+    match = ' '.join('"%s"' % term for term in terms[:-1])
+    match = ('%s "%s"*' % (match, terms[-1])).strip()
+
+    queryset = queryset.extra(
+        tables=[FTS_TABLE],
+        where=['%s.rowid = api_product.id' % FTS_TABLE, '%s MATCH %%s' % FTS_TABLE],
+        params=[match],
+    )
+    if ranked:
+        # `rank` is bm25() with the column weights stored in the index config.
+        queryset = queryset.extra(
+            select={'search_rank': '%s.rank' % FTS_TABLE},
+            order_by=['search_rank', '-id'],
+        )
+    return queryset
+
+
+def _postgres_search(queryset, terms, ranked):
+    tsquery = ' & '.join(terms[:-1] + [terms[-1] + ':*'])
+    # Substring matches on the name (e.g. "force" in "GeForce") are served by
+    # the trigram index and rank below the full-text hits.
+    pattern = '%%%s%%' % ' '.join(terms)
+
+    queryset = queryset.extra(
+        where=["(api_product.search_vector @@ to_tsquery('simple', %s) OR api_product.name ILIKE %s)"],
+        params=[tsquery, pattern],
+    )
+    if ranked:
+        queryset = queryset.extra(
+            select={'search_rank': "ts_rank(api_product.search_vector, to_tsquery('simple', %s))"},
+            select_params=[tsquery],
+            order_by=['-search_rank', '-id'],
+        )
+    return queryset
+
+
+def rebuild_index(using='default'):
+    """Repopulate the search index from `api_product`. Returns the row count."""
+    conn = connections[using]
+    with conn.cursor() as cursor:
+        if conn.vendor == 'sqlite':
+            cursor.execute('DELETE FROM %s' % FTS_TABLE)
+            cursor.execute(
+                'INSERT INTO %s (rowid, name, category, description) '
+                'SELECT p.id, p.name, c.name, p.description FROM api_product p '
+                'LEFT JOIN api_category c ON c.id = p.category_id' % FTS_TABLE)
+            cursor.execute("INSERT INTO %s (%s) VALUES ('optimize')" % (FTS_TABLE, FTS_TABLE))
+        elif conn.vendor == 'postgresql':
+            # Touching a column fires the trigger that recomputes the vector.
+            cursor.execute('UPDATE api_product SET name = name')
+            cursor.execute('REINDEX INDEX api_product_search_vector_idx')
+        else:
+            return 0
+        cursor.execute('SELECT COUNT(*) FROM api_product')
+        return cursor.fetchone()[0]
+
+
+def install_triggers(using='default'):
+    """
+    Make sure the SQLite index triggers exist, rebuilding the index if any
+    were missing. SQLite drops a table's triggers whenever a migration has to
+    rebuild the table, so this runs after every `migrate`.
+    """
+    conn = connections[using]
+    if conn.vendor != 'sqlite' or FTS_TABLE not in conn.introspection.table_names():
+        return
+
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")
+        existing = {row[0] for row in cursor.fetchall()}
+        missing = set(SQLITE_TRIGGERS) - existing
+        for name in missing:
+            cursor.execute(SQLITE_TRIGGERS[name])
+
+    if missing:
+        rebuild_index(using)
+
+
+def drop_triggers(using='default'):
+    """
+    Drop the SQLite index triggers ahead of a bulk load; `install_triggers`
+    puts them back and reindexes in one pass afterwards.
+    """
+    conn = connections[using]
+    if conn.vendor != 'sqlite':
+        return
+    with conn.cursor() as cursor:
+        for name in SQLITE_TRIGGERS:
+            cursor.execute('DROP TRIGGER IF EXISTS %s' % name)
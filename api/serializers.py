@@ -1,12 +1,51 @@
+from functools import lru_cache
+
 from rest_framework import serializers
 
 from django.contrib.auth.models import User
 from rest_framework_simplejwt.tokens import RefreshToken
 
 from .models import *
+from .images import get_images
+from .metrics import TimedSerializerMixin
+
+
+class InvalidFields(ValueError):
+    pass
+
+
+class DynamicFieldsMixin:
+    """Takes a `fields` argument naming the only fields to serialize."""
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
 
 
-class UserSerializer(serializers.ModelSerializer):
+@lru_cache
+def field_names(serializer_class):
+    return list(serializer_class().fields)
+
+
+def parse_fields(value, serializer_class, default):
+    """
+    The fields named by a comma-separated ?fields= value, in the serializer's
+    order, or `default` when there is none.
+    """
+    if not value:
+        return default
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    available = field_names(serializer_class)
+    unknown = sorted(set(names) - set(available))
+    if unknown:
+        raise InvalidFields('Unknown fields: %s' % ', '.join(unknown))
+    return [name for name in available if name in names]
+
+
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     name = serializers.SerializerMethodField(read_only=True)
     isAdmin = serializers.SerializerMethodField(read_only=True)
 
@@ -28,6 +67,17 @@ class UserSerializer(serializers.ModelSerializer):
     def get_isAdmin(self, obj):
         return obj.is_staff
 
+    # Columns `from_values` reads, in order
+    VALUES = ['id', 'username', 'email', 'first_name', 'last_name', 'is_staff']
+
+    @staticmethod
+    def from_values(rows):
+        """The payload of `values_list(*VALUES, ...)` rows, without building User objects."""
+        return [
+            {'id': pk, 'username': username, 'email': email, 'name': (first + ' ' + last).title(), 'isAdmin': staff}
+            for pk, username, email, first, last, staff, *_ in rows
+        ]
+
 class UserSerializerWithToken(UserSerializer):
     token = serializers.SerializerMethodField(read_only=True)
 
@@ -36,28 +86,61 @@ class UserSerializerWithToken(UserSerializer):
         fields = ['id', 'username', 'email', 'name', 'isAdmin', 'token']
 
     def get_token(self, obj):
+        # Login already minted one
+        if 'access' in self.context:
+            return self.context['access']
         token = RefreshToken.for_user(obj)
         return str(token.access_token)
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(DynamicFieldsMixin, TimedSerializerMixin, serializers.ModelSerializer):
+    # None for products without a category, the key is always there
+    category = serializers.CharField(source='category.name', read_only=True, default=None)
+    images = serializers.SerializerMethodField(read_only=True)
+
+    # What the listing endpoints show of a product unless ?fields= says otherwise
+    LIST_FIELDS = ['id', 'name', 'image', 'images', 'category', 'price', 'rating', 'numOfReviews', 'countInStock']
+    # Columns behind the fields that are not named after one
+    COLUMNS = {'category': ['category', 'category__name'], 'images': ['image', 'imageVariants']}
+
     class Meta:
         model = Product
-        fields = '__all__'
+        exclude = ['ratingSum', 'imageVariants']
+
+    def get_images(self, obj):
+        return get_images(obj)
+
+    @classmethod
+    def load_only(cls, queryset, fields):
+        """`queryset` loading only the columns `fields` need, plus the sort key pagination reads."""
+        columns = {'id', 'createdAt'}
+        for name in fields:
+            columns.update(cls.COLUMNS.get(name, [name]))
+        if 'category' not in fields:
+            queryset = queryset.select_related(None)
+        return queryset.only(*columns)
+
+
+class CategorySerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    count = serializers.IntegerField(source='productCount', read_only=True)
+
+    class Meta:
+        model = Category
+        fields = ['id', 'name', 'slug', 'count']
 
 
-class ShippingAddressSerializer(serializers.ModelSerializer):
+class ShippingAddressSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = ShippingAddress
         fields = '__all__'
 
 
-class OrderItemSerializer(serializers.ModelSerializer):
+class OrderItemSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = OrderItem
         fields = '__all__'
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     orderItems = serializers.SerializerMethodField(read_only=True)
     shippingAddress = serializers.SerializerMethodField(read_only=True)
     user = serializers.SerializerMethodField(read_only=True)
@@ -1,3 +1,1740 @@
-from django.test import TestCase
+import csv
+import json
+import re
+import shutil
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.urls import reverse
+from django.utils.http import http_date
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from django.db import connection, router
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+from django.test.utils import CaptureQueriesContext
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, make_password
+
+from rest_framework.test import APITestCase
+from rest_framework.renderers import JSONRenderer
+from rest_framework_simplejwt.tokens import RefreshToken
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from PIL import Image
+
+from api.models import *
+from api.search import search_products
+from api.serializers import ProductSerializer, OrderSerializer, UserSerializer
+from api.renderers import FastJSONRenderer
+from api.cache import get_or_build
+from api.categories import get_or_create_category as category, recount
+from api.images import generate_variants
+from api import imports, jobs, metrics, routers
+from api.jobs import Worker
+from api.middleware import ReplicaMiddleware
+from api.authentication import users as cached_users
 
 # Create your tests here.
+
+
+class ProductSearchTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.gpu = Product.objects.create(
+            name='GeForce RTX 4090', category=category('GPU'), description='Flagship graphics card')
+        self.monitor = Product.objects.create(
+            name='UltraSharp 27', category=category('Monitor'), description='4K IPS panel, great for graphics work')
+        self.arm = Product.objects.create(
+            name='Dual Arm', category=category('Monitor Arms'), description='Gas spring desk mount')
+
+    def search(self, query):
+        return list(search_products(Product.objects.order_by('-createdAt'), query))
+
+    def test_matches_name_category_and_description(self):
+        self.assertEqual(self.search('rtx'), [self.gpu])
+        self.assertEqual(self.search('arms'), [self.arm])
+        self.assertEqual(self.search('desk'), [self.arm])
+
+    def test_last_term_is_a_prefix(self):
+        self.assertEqual(self.search('ultrash'), [self.monitor])
+
+    def test_ranks_name_matches_first(self):
+        self.gpu.name = 'Graphics Card RTX'
+        self.gpu.save()
+        self.assertEqual(self.search('graphics'), [self.gpu, self.monitor])
+
+    def test_index_follows_updates_and_deletes(self):
+        self.arm.name = 'Single Arm'
+        self.arm.save()
+        self.assertEqual(self.search('dual'), [])
+        self.assertEqual(self.search('single'), [self.arm])
+
+        self.arm.delete()
+        self.assertEqual(self.search('single'), [])
+
+    def test_rebuild_command(self):
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertCountEqual(self.search('monitor'), [self.arm, self.monitor])
+
+    def test_get_products_endpoint(self):
+        response = self.client.get(reverse('products'), {'q': 'gefor'})
+        self.assertEqual([p['id'] for p in response.data['products']], [self.gpu.id])
+
+
+class ProductCursorPaginationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.products = [Product.objects.create(name='Product %d' % i) for i in range(10)]
+        self.products.reverse()
+
+    def get(self, **params):
+        return self.client.get(reverse('products'), params)
+
+    def ids(self, response):
+        return [p['id'] for p in response.data['products']]
+
+    def test_walks_forward_and_back(self):
+        first = self.get(cursor='', page_size=4)
+        self.assertEqual(self.ids(first), [p.id for p in self.products[:4]])
+        self.assertIsNone(first.data['prev'])
+
+        second = self.get(cursor=first.data['next'], page_size=4)
+        self.assertEqual(self.ids(second), [p.id for p in self.products[4:8]])
+
+        third = self.get(cursor=second.data['next'], page_size=4)
+        self.assertEqual(self.ids(third), [p.id for p in self.products[8:]])
+        self.assertIsNone(third.data['next'])
+
+        back = self.get(cursor=third.data['prev'], page_size=4)
+        self.assertEqual(self.ids(back), self.ids(second))
+        back = self.get(cursor=back.data['prev'], page_size=4)
+        self.assertEqual(self.ids(back), self.ids(first))
+        self.assertIsNone(back.data['prev'])
+
+    def test_ties_on_created_at_are_broken_by_id(self):
+        Product.objects.update(createdAt=self.products[0].createdAt)
+        seen = []
+        cursor = ''
+        while cursor is not None:
+            response = self.get(cursor=cursor, page_size=3)
+            seen += self.ids(response)
+            cursor = response.data['next']
+        self.assertEqual(seen, sorted((p.id for p in self.products), reverse=True))
+
+    def test_does_not_count_unless_asked(self):
+        # the page, and the ETag aggregate
+        with self.assertNumQueries(2):
+            response = self.get(cursor='')
+        self.assertNotIn('count', response.data)
+
+        response = self.get(cursor='', count='true')
+        self.assertEqual(response.data['count'], 10)
+
+    def test_invalid_cursor(self):
+        response = self.get(cursor='not-a-cursor')
+        self.assertEqual(response.status_code, 400)
+
+
+class OrderQueryCountTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create(username='admin', is_staff=True)
+        self.customer = User.objects.create(username='customer', first_name='jane', last_name='doe')
+        self.product = Product.objects.create(name='SSD', price=50, countInStock=10)
+
+    def create_orders(self, count, user=None):
+        for i in range(count):
+            order = Order.objects.create(user=user or self.customer, totalPrice=100)
+            ShippingAddress.objects.create(order=order, address='Street %d' % i, city='Cairo')
+            for qty in (1, 2):
+                OrderItem.objects.create(order=order, product=self.product, name='SSD', qty=qty, price=50)
+
+    # Every count includes the aggregate behind the ETag
+    def assertConstantQueries(self, num, url, user, grow):
+        self.client.force_authenticate(user)
+        with self.assertNumQueries(num):
+            self.client.get(url)
+        grow()
+        with self.assertNumQueries(num):
+            response = self.client.get(url)
+        return response
+
+    def test_get_orders(self):
+        self.create_orders(3)
+        response = self.assertConstantQueries(
+            3, reverse('orders'), self.admin, lambda: self.create_orders(5))
+        self.assertEqual(len(response.data), 8)
+
+    def test_get_my_orders(self):
+        self.create_orders(3)
+        response = self.assertConstantQueries(
+            3, reverse('myorders'), self.customer, lambda: self.create_orders(5))
+        self.assertEqual(len(response.data), 8)
+
+    def test_get_order_by_id(self):
+        self.create_orders(1)
+        order = Order.objects.get()
+        self.client.force_authenticate(self.customer)
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('user-order', args=[order.id]))
+
+        self.assertEqual(response.data['user']['name'], 'Jane Doe')
+        self.assertEqual(response.data['shippingAddress']['address'], 'Street 0')
+        self.assertEqual([item['qty'] for item in response.data['orderItems']], [1, 2])
+
+    def test_order_without_address(self):
+        Order.objects.create(user=self.customer)
+        self.client.force_authenticate(self.customer)
+        response = self.client.get(reverse('myorders'))
+        self.assertIs(response.data[0]['shippingAddress'], False)
+        self.assertEqual(response.data[0]['orderItems'], [])
+
+
+class OrderExportTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create(username='admin', is_staff=True)
+        self.client.force_authenticate(self.admin)
+        product = Product.objects.create(name='RAM', price=30)
+        for i in range(5):
+            order = Order.objects.create(user=self.admin, totalPrice=30, isPaid=i % 2 == 0)
+            ShippingAddress.objects.create(order=order, address='Street %d' % i)
+            OrderItem.objects.create(order=order, product=product, name='RAM', qty=i + 1, price=30)
+        Order.objects.create(user=self.admin)
+
+    def export(self, **params):
+        response = self.client.get(reverse('orders-export'), params)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_ndjson_in_chunks(self):
+        # 3 chunks of orders + items, then the empty chunk that ends the walk
+        with mock.patch('api.exports.CHUNK_SIZE', 2), self.assertNumQueries(7):
+            lines = self.export().splitlines()
+        records = [json.loads(line) for line in lines]
+        self.assertEqual([r['id'] for r in records], sorted(Order.objects.values_list('id', flat=True)))
+        self.assertEqual(records[0]['orderItems'][0]['qty'], 1)
+        self.assertEqual(records[0]['shippingAddress']['address'], 'Street 0')
+
+    def test_csv_one_row_per_item(self):
+        rows = list(csv.DictReader(StringIO(self.export(type='csv'))))
+        self.assertEqual(len(rows), 6)
+        self.assertEqual([r['qty'] for r in rows], ['1', '2', '3', '4', '5', ''])
+
+    def test_filters(self):
+        lines = self.export(isPaid='true', isDelivered='false').splitlines()
+        self.assertEqual(len(lines), 3)
+
+        lines = self.export(**{'from': '2000-01-01', 'to': '2000-12-31'}).splitlines()
+        self.assertEqual(lines, [])
+
+    def test_rejects_bad_parameters(self):
+        self.assertEqual(self.client.get(reverse('orders-export'), {'from': 'yesterday'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('orders-export'), {'type': 'xml'}).status_code, 400)
+
+
+class ProductRatingTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = Product.objects.create(name='Keyboard')
+        self.users = [User.objects.create(username='user%d' % i) for i in range(3)]
+
+    def review(self, user, rating):
+        self.client.force_authenticate(user)
+        return self.client.post(reverse('create-review', args=[self.product.id]),
+                                {'rating': rating, 'comment': 'ok'}, format='json')
+
+    def test_review_updates_aggregates_in_constant_queries(self):
+        self.review(self.users[0], 5)
+        with CaptureQueriesContext(connection) as second:
+            self.review(self.users[1], 4)
+        with CaptureQueriesContext(connection) as third:
+            self.review(self.users[2], 4)
+        self.assertEqual(len(second), len(third))
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.numOfReviews, 3)
+        self.assertEqual(self.product.ratingSum, 13)
+        self.assertEqual(str(self.product.rating), '4.33')
+
+    def test_repair_command(self):
+        for user, rating in zip(self.users, (1, 2, 2)):
+            Review.objects.create(product=self.product, user=user, rating=rating)
+        other = Product.objects.create(name='Mouse', rating=5, numOfReviews=7, ratingSum=35)
+        unrated = Product.objects.create(name='Pad', rating=None, numOfReviews=None)
+
+        out = StringIO()
+        call_command('repair_ratings', stdout=out)
+        self.assertIn('Repaired 2 products', out.getvalue())
+        unrated.refresh_from_db()
+        self.assertEqual((unrated.rating, unrated.numOfReviews), (None, None))
+
+        self.product.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((self.product.ratingSum, self.product.numOfReviews, str(self.product.rating)),
+                         (5, 3, '1.67'))
+        self.assertEqual((other.ratingSum, other.numOfReviews, other.rating), (0, 0, 0))
+
+
+class CheckoutTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='buyer')
+        self.client.force_authenticate(self.user)
+        self.cpu = Product.objects.create(name='CPU', price=300, countInStock=5)
+        self.fan = Product.objects.create(name='Fan', price=20, countInStock=1)
+
+    def checkout(self, *lines):
+        return self.client.post(reverse('orders-add'), {
+            'paymentMethod': 'PayPal', 'taxPrice': 10, 'shippingPrice': 5, 'totalPrice': 335,
+            'shippingAddress': {'address': 'Street 1', 'city': 'Cairo', 'postalCode': '11511', 'country': 'EG'},
+            'orderItems': [{'product': p.id, 'qty': qty, 'price': p.price} for p, qty in lines],
+        }, format='json')
+
+    def stock(self):
+        return list(Product.objects.order_by('id').values_list('countInStock', flat=True))
+
+    def test_checkout_reserves_stock(self):
+        response = self.checkout((self.cpu, 2), (self.fan, 1), (self.cpu, 1))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([i['qty'] for i in response.data['orderItems']], [2, 1, 1])
+        self.assertEqual(response.data['shippingAddress']['city'], 'Cairo')
+        self.assertEqual(self.stock(), [2, 0])
+
+    def test_short_line_rolls_back_the_whole_order(self):
+        response = self.checkout((self.cpu, 2), (self.fan, 2))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['detail'], 'Fan is out of stock')
+        self.assertEqual(self.stock(), [5, 1])
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+
+    def test_rejects_unknown_products_and_bad_quantities(self):
+        Product.objects.filter(id=self.fan.id).delete()
+        self.assertEqual(self.checkout((self.cpu, 1), (self.fan, 1)).status_code, 400)
+        self.assertEqual(self.checkout((self.cpu, 0)).status_code, 400)
+        self.assertEqual(self.stock(), [5])
+
+    def test_query_count(self):
+        # product SELECT, a conditional UPDATE per product, three INSERTs and
+        # two rollup upserts in a savepoint, then the items read back for the response
+        with self.assertNumQueries(11):
+            self.checkout((self.cpu, 1), (self.fan, 1), (self.cpu, 1))
+
+
+class CatalogCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create(username='admin', is_staff=True)
+        self.product = Product.objects.create(name='PSU', category=category('Power'), price=80, rating=5)
+
+    def test_reads_are_served_from_cache(self):
+        urls = [reverse('products'), reverse('top-products'), reverse('product', args=[self.product.id]),
+                reverse('product-category', args=['power'])]
+        for url in urls:
+            first = self.client.get(url)
+            with self.assertNumQueries(0):
+                second = self.client.get(url)
+            self.assertEqual(first.data, second.data)
+
+    def test_catalog_writes_invalidate(self):
+        url = reverse('product', args=[self.product.id])
+        self.client.get(url)
+
+        self.client.force_authenticate(self.admin)
+        self.client.put(reverse('product-update', args=[self.product.id]), {
+            'name': 'PSU 850W', 'description': '', 'price': 90, 'category': 'Power', 'count-in-stock': 3})
+        self.assertEqual(self.client.get(url).data['name'], 'PSU 850W')
+
+        self.client.post(reverse('create-review', args=[self.product.id]),
+                         {'rating': 3, 'comment': 'meh'}, format='json')
+        self.assertEqual(self.client.get(url).data['numOfReviews'], 1)
+
+        self.client.delete(reverse('product-delete', args=[self.product.id]))
+        self.assertEqual(self.client.get(url).data, 'Unexpected error')
+
+    def test_query_parameters_are_part_of_the_key(self):
+        Product.objects.create(name='Case', category=category('Cases'))
+        self.assertEqual(len(self.client.get(reverse('products')).data['products']), 2)
+        self.assertEqual(len(self.client.get(reverse('products'), {'q': 'psu'}).data['products']), 1)
+
+    def test_only_one_worker_rebuilds_a_cold_key(self):
+        builds = []
+        results = []
+
+        def build():
+            builds.append(1)
+            time.sleep(0.2)
+            return ['payload']
+
+        threads = [threading.Thread(target=lambda: results.append(get_or_build('slow', build)))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(builds), 1)
+        self.assertEqual(results, [['payload']] * 4)
+
+    def test_stats_endpoint(self):
+        self.client.get(reverse('top-products'))
+        self.client.get(reverse('top-products'))
+        self.client.force_authenticate(self.admin)
+        stats = self.client.get(reverse('product-cache-stats')).data
+        self.assertGreaterEqual(stats['hits'], 1)
+        self.assertGreaterEqual(stats['misses'], 1)
+
+
+@override_settings(TOP_PRODUCTS_CAPACITY=3)
+class LeaderboardTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create(username='admin', is_staff=True)
+        self.gpus = [Product.objects.create(name='GPU %d' % i, category=category('GPU'), rating=r, numOfReviews=n)
+                     for i, (r, n) in enumerate([(5, 1), (4.5, 3), (4.5, 9), (4, 2)])]
+        self.cpu = Product.objects.create(name='CPU', category=category('CPU'), rating=4.8, numOfReviews=1)
+        Product.objects.create(name='Bad', category=category('GPU'), rating=2)
+
+    def top(self, **params):
+        return [p['name'] for p in self.client.get(reverse('top-products'), params).data]
+
+    def review(self, product, rating, username):
+        self.client.force_authenticate(User.objects.create(username=username))
+        self.client.post(reverse('create-review', args=[product.id]),
+                         {'rating': rating, 'comment': ''}, format='json')
+        # the boards are re-ranked by a worker
+        Worker(threads=1, burst=True).run()
+
+    def test_ranking_and_tie_break(self):
+        self.assertEqual(self.top(n=3), ['GPU 0', 'CPU', 'GPU 2'])
+        self.assertEqual(self.top(n=3, category='gpu'), ['GPU 0', 'GPU 2', 'GPU 1'])
+        self.assertEqual(self.top(n=1, category='CPU'), ['CPU'])
+
+    def test_read_is_a_keyed_lookup(self):
+        self.top(n=3)
+        cache.clear()
+        # the board, the ETag aggregate and the products
+        with self.assertNumQueries(3):
+            self.top(n=3)
+
+    def test_review_updates_the_board(self):
+        self.top(n=3)
+        self.top(n=3, category='GPU')
+
+        # GPU 3 climbs from outside the boards to the top
+        Product.objects.filter(id=self.gpus[3].id).update(rating=None, numOfReviews=0, ratingSum=0)
+        self.review(self.gpus[3], 5, 'a')
+        self.review(self.gpus[3], 5, 'b')
+        self.assertEqual(self.top(n=3), ['GPU 3', 'GPU 0', 'CPU'])
+        self.assertEqual(self.top(n=3, category='GPU'), ['GPU 3', 'GPU 0', 'GPU 2'])
+
+        # ...and a bad review pushes GPU 0 below products the board no longer held
+        self.review(self.gpus[0], 1, 'c')
+        self.assertEqual(self.top(n=3), ['GPU 3', 'CPU', 'GPU 2'])
+        self.assertEqual(self.top(n=3, category='GPU'), ['GPU 3', 'GPU 2', 'GPU 1'])
+
+    def test_worker_retires_the_cached_board(self):
+        self.assertEqual(self.top(n=1), ['GPU 0'])
+        Product.objects.filter(id=self.gpus[3].id).update(rating=None, numOfReviews=0, ratingSum=0)
+        self.client.force_authenticate(User.objects.create(username='a'))
+        self.client.post(reverse('create-review', args=[self.gpus[3].id]), {'rating': 5, 'comment': ''}, format='json')
+        self.client.force_authenticate(User.objects.create(username='b'))
+        self.client.post(reverse('create-review', args=[self.gpus[3].id]), {'rating': 5, 'comment': ''}, format='json')
+        # not re-ranked yet
+        self.assertEqual(self.top(n=1), ['GPU 0'])
+
+        Worker(threads=1, burst=True).run()
+        self.assertEqual(self.top(n=1), ['GPU 3'])
+
+    def test_delete_and_category_change(self):
+        self.top(n=3)
+        self.top(n=3, category='GPU')
+        self.top(n=3, category='CPU')
+        self.client.force_authenticate(self.admin)
+
+        self.client.delete(reverse('product-delete', args=[self.gpus[0].id]))
+        self.assertEqual(self.top(n=3), ['CPU', 'GPU 2', 'GPU 1'])
+        self.assertEqual(self.top(n=3, category='GPU'), ['GPU 2', 'GPU 1', 'GPU 3'])
+
+        self.client.put(reverse('product-update', args=[self.cpu.id]), {
+            'name': 'CPU', 'description': '', 'price': 1, 'category': 'GPU', 'count-in-stock': 1})
+        self.assertEqual(self.top(n=3, category='CPU'), [])
+        self.assertEqual(self.top(n=3, category='GPU'), ['CPU', 'GPU 2', 'GPU 1'])
+
+
+class CategoryTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create(username='admin', is_staff=True)
+        self.client.force_authenticate(self.admin)
+
+    def create(self, name, category):
+        return self.client.post(reverse('product-create'), {
+            'name': name, 'price': 10, 'description': '', 'category': category, 'count-in-stock': 1}).data
+
+    def facets(self):
+        return {c['name']: c['count'] for c in self.client.get(reverse('product-categories')).data}
+
+    def test_spellings_share_a_category(self):
+        self.create('Dell 27', 'Monitor')
+        self.create('LG 32', ' monitor ')
+        self.assertEqual(Category.objects.count(), 1)
+        self.assertEqual(self.facets(), {'Monitor': 2})
+
+    def test_exact_category_match(self):
+        self.create('Dell 27', 'Monitor')
+        self.create('Dual Arm', 'Monitor Arms')
+        names = [p['name'] for p in self.client.get(reverse('product-category', args=['Monitor'])).data]
+        self.assertEqual(names, ['Dell 27'])
+        names = [p['name'] for p in self.client.get(reverse('product-category', args=['monitor-arms'])).data]
+        self.assertEqual(names, ['Dual Arm'])
+
+    def test_non_ascii_names(self):
+        self.create('Dell 27', 'شاشات')
+        self.create('LG 32', ' شاشات ')
+        self.assertEqual(Category.objects.get().slug, 'شاشات')
+        self.assertEqual(self.facets(), {'شاشات': 2})
+        names = [p['name'] for p in self.client.get(reverse('product-category', args=['شاشات'])).data]
+        self.assertEqual(sorted(names), ['Dell 27', 'LG 32'])
+
+    def test_counts_follow_writes_without_grouping(self):
+        product = self.create('Dell 27', 'Monitor')
+        self.create('RTX', 'GPU')
+        self.client.put(reverse('product-update', args=[product['id']]), {
+            'name': 'Dell 27', 'price': 10, 'description': '', 'category': 'GPU', 'count-in-stock': 1})
+        self.assertEqual(self.facets(), {'GPU': 2, 'Monitor': 0})
+
+        self.client.delete(reverse('product-delete', args=[product['id']]))
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.facets(), {'GPU': 1, 'Monitor': 0})
+        self.assertNotIn('GROUP BY', queries[0]['sql'])
+
+    def test_payload_keeps_the_category_name(self):
+        product = self.create('RTX', 'GPU')
+        self.assertEqual(product['category'], 'GPU')
+        # the ETag lookup, then the product with its category
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get(reverse('product', args=[product['id']])).data['category'], 'GPU')
+
+    def test_payload_without_a_category(self):
+        product = Product.objects.create(name='Cable', price=1)
+        self.assertIsNone(self.client.get(reverse('product', args=[product.id])).data['category'])
+        self.assertIsNone(self.client.get(reverse('products')).data['products'][0]['category'])
+
+    def test_recount(self):
+        gpu = category('GPU')
+        Product.objects.bulk_create([Product(name='GPU %d' % i, category=gpu) for i in range(3)])
+        recount()
+        gpu.refresh_from_db()
+        self.assertEqual(gpu.productCount, 3)
+
+
+class QueryPlanTests(APITestCase):
+    # Tables that grow with traffic; the views may only reach them through an index
+    TABLES = {'api_product', 'api_order', 'api_orderitem', 'api_review', 'api_shippingaddress', 'api_job'}
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='admin', is_staff=True)
+        self.client.force_authenticate(self.user)
+        self.product = Product.objects.create(name='RTX', category=category('GPU'), rating=5, price=10, countInStock=100)
+        self.order = Order.objects.create(user=self.user, totalPrice=10)
+        ShippingAddress.objects.create(order=self.order, address='Street', city='Cairo', postalCode='1', country='EG')
+        OrderItem.objects.create(order=self.order, product=self.product, name='RTX', qty=1, price=10)
+
+    def plan(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # the tables are tiny here, make the planner show whether an index could be used
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute('SET LOCAL enable_sort = off')
+                cursor.execute('EXPLAIN ' + sql)
+                return [row[0] for row in cursor.fetchall()]
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def full_scans(self, plan):
+        pattern = r'Seq Scan on (\w+)' if connection.vendor == 'postgresql' else r'^SCAN (?:TABLE )?(\w+)$'
+        return {m.group(1) for m in (re.search(pattern, line.strip()) for line in plan) if m} & self.TABLES
+
+    def sorts(self, plan):
+        pattern = r'^(?:->\s+)?(?:Incremental )?Sort\b' if connection.vendor == 'postgresql' else r'TEMP B-TREE FOR ORDER BY'
+        return [line for line in plan if re.search(pattern, line.strip())]
+
+    def assertIndexed(self, method, url, data=None, ordered=False):
+        """Every statement the request runs avoids full scans and, if `ordered`, sorting."""
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, data, format='json')
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertLess(response.status_code, 400)
+
+        statements = [q['sql'] for q in queries if q['sql'].startswith(('SELECT', 'UPDATE', 'DELETE'))]
+        self.assertTrue(statements)
+        for sql in statements:
+            plan = self.plan(sql)
+            report = '%s\n%s' % (sql, '\n'.join(plan))
+            self.assertFalse(self.full_scans(plan), report)
+            if ordered:
+                self.assertFalse(self.sorts(plan), report)
+
+    def test_catalog_reads(self):
+        self.assertIndexed('get', reverse('products'))
+        self.assertIndexed('get', reverse('products'), {'cursor': ''})
+        self.assertIndexed('get', reverse('products'), {'q': 'rtx'})
+        self.assertIndexed('get', reverse('product', args=[self.product.id]), ordered=True)
+        self.assertIndexed('get', reverse('product-category', args=['gpu']), ordered=True)
+        self.assertIndexed('get', reverse('product-categories'), ordered=True)
+
+    def test_leaderboard_rebuild(self):
+        self.assertIndexed('get', reverse('top-products'), ordered=True)
+        self.assertIndexed('get', reverse('top-products'), {'category': 'gpu'}, ordered=True)
+
+    def test_order_reads(self):
+        self.assertIndexed('get', reverse('myorders'), ordered=True)
+        self.assertIndexed('get', reverse('user-order', args=[self.order.id]), ordered=True)
+        self.assertIndexed('get', reverse('orders-export'), {'isPaid': 'false'}, ordered=True)
+        self.assertIndexed('get', reverse('orders-export'), {'isDelivered': 'false'}, ordered=True)
+        self.assertIndexed('get', reverse('orders-export'), {'from': '2020-01-01', 'to': '2020-02-01'})
+
+    def test_writes(self):
+        self.assertIndexed('post', reverse('create-review', args=[self.product.id]), {'rating': 4, 'comment': 'Fast'})
+        self.assertIndexed('post', reverse('orders-add'), {
+            'paymentMethod': 'PayPal', 'taxPrice': 0, 'shippingPrice': 0, 'totalPrice': 10,
+            'shippingAddress': {'address': 'Street', 'city': 'Cairo', 'postalCode': '1', 'country': 'EG'},
+            'orderItems': [{'product': self.product.id, 'qty': 1, 'price': 10}],
+        })
+
+    def test_job_worker(self):
+        Job.objects.bulk_create(Job(name='leaderboard', status=status, args={'product_id': self.product.id},
+                                    finishedAt=timezone.now()) for status in (Job.DONE, Job.FAILED))
+        jobs.enqueue('leaderboard', product_id=self.product.id)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(Worker(threads=1, burst=True).run(), 1)
+
+        statements = [q['sql'] for q in queries if q['sql'].startswith(('SELECT', 'UPDATE', 'DELETE'))
+                      and 'api_job' in q['sql']]
+        # housekeeping, claim, load, result, and the claim that finds the queue empty
+        self.assertEqual(len(statements), 8)
+        for sql in statements:
+            plan = self.plan(sql)
+            self.assertFalse(self.full_scans(plan), '%s\n%s' % (sql, '\n'.join(plan)))
+
+
+@override_settings(JOBS_EAGER=True)
+class ProductImageTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        self.enterContext(override_settings(MEDIA_ROOT=media))
+        self.admin = User.objects.create(username='admin', is_staff=True)
+        self.client.force_authenticate(self.admin)
+
+    def upload(self, width=1200, height=800, name='card.jpg'):
+        buffer = BytesIO()
+        Image.new('RGB', (width, height), 'navy').save(buffer, 'JPEG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+    def create(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('product-create'), {
+                'name': 'RTX', 'price': 10, 'description': '', 'category': 'GPU',
+                'count-in-stock': 5, 'image': self.upload()}, format='multipart')
+        return Product.objects.get(id=response.data['id'])
+
+    def test_upload_renders_webp_variants(self):
+        product = self.create()
+        self.assertEqual(product.imageVariants['thumbnail']['width'], 200)
+        self.assertEqual(product.imageVariants['thumbnail']['height'], 133)
+        self.assertEqual(product.imageVariants['medium']['width'], 600)
+        with default_storage.open(product.imageVariants['thumbnail']['name']) as f:
+            self.assertEqual(Image.open(f).format, 'WEBP')
+
+    def test_payload_exposes_variants_and_srcset(self):
+        product = self.create()
+        images = self.client.get(reverse('products')).data['products'][0]['images']
+        self.assertTrue(images['thumbnail'].endswith('_thumbnail.webp'))
+        self.assertEqual(images['original'], product.image.url)
+        self.assertEqual(images['srcset'], '%s 200w, %s 600w, %s 1200w' % (
+            images['thumbnail'], images['medium'], images['original']))
+        self.assertNotIn('imageVariants', self.client.get(reverse('product', args=[product.id])).data)
+
+    def test_falls_back_to_the_original_until_rendered(self):
+        product = Product.objects.create(name='RTX', image=default_storage.save('hardwareImages/a.jpg', self.upload()))
+        images = self.client.get(reverse('product', args=[product.id])).data['images']
+        self.assertEqual(images['thumbnail'], product.image.url)
+        self.assertEqual(images['srcset'], '')
+
+    def test_replacing_the_image_drops_old_variants(self):
+        product = self.create()
+        old = product.imageVariants['thumbnail']['name']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put(reverse('product-update', args=[product.id]), {
+                'name': 'RTX', 'price': 10, 'description': '', 'category': 'GPU',
+                'count-in-stock': 5, 'image': self.upload(400, 400, 'square.jpg')}, format='multipart')
+        product.refresh_from_db()
+        self.assertEqual(product.imageVariants['thumbnail']['height'], 200)
+        self.assertFalse(default_storage.exists(old))
+
+    def test_order_items_keep_the_thumbnail(self):
+        product = self.create()
+        self.client.post(reverse('orders-add'), {
+            'paymentMethod': 'PayPal', 'taxPrice': 0, 'shippingPrice': 0, 'totalPrice': 10,
+            'shippingAddress': {'address': 'Street', 'city': 'Cairo', 'postalCode': '1', 'country': 'EG'},
+            'orderItems': [{'product': product.id, 'qty': 1, 'price': 10}],
+        }, format='json')
+        self.assertTrue(OrderItem.objects.get().image.endswith('_thumbnail.webp'))
+
+    @override_settings(JOBS_EAGER=False)
+    def test_upload_returns_before_rendering(self):
+        product = self.create()
+        self.assertEqual(product.imageVariants, {})
+        job = Job.objects.get(name='image_variants')
+        self.assertEqual((job.status, job.args), (Job.QUEUED, {'product_id': product.id}))
+
+        self.assertEqual(Worker(threads=1, burst=True).run(), 1)
+        product.refresh_from_db()
+        self.assertEqual(product.imageVariants['medium']['width'], 600)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result), (Job.DONE, product.imageVariants))
+
+    def test_backfill_command(self):
+        rendered = Product.objects.create(name='A', image=default_storage.save('hardwareImages/a.jpg', self.upload()))
+        generate_variants(rendered.id)
+        missing = Product.objects.create(name='B', image=default_storage.save('hardwareImages/b.jpg', self.upload()))
+        out = StringIO()
+        call_command('generate_image_variants', workers=1, stdout=out)
+        self.assertIn('1 of 1', out.getvalue())
+        missing.refresh_from_db()
+        self.assertEqual(missing.imageVariants['medium']['width'], 600)
+
+
+class AsyncViewTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='buyer')
+        self.other = User.objects.create(username='other')
+        for i in range(6):
+            Product.objects.create(name='RTX %d' % i, category=category('GPU'), rating=4 + i % 2, price=10)
+        self.order = Order.objects.create(user=self.user, totalPrice=10)
+        ShippingAddress.objects.create(order=self.order, address='Street', city='Cairo', postalCode='1', country='EG')
+        OrderItem.objects.create(order=self.order, product=Product.objects.first(), name='RTX', qty=1, price=10)
+
+    def auth(self, user):
+        return {'Authorization': 'Bearer %s' % RefreshToken.for_user(user).access_token}
+
+    async def assertSamePayload(self, name, args=(), data=None, user=None):
+        headers = self.auth(user) if user else {}
+        cache.clear()
+        expected = await sync_to_async(self.client.get)(reverse(name, args=args), data, headers=headers)
+        cache.clear()
+        response = await self.async_client.get(reverse('async-' + name, args=args), data, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), json.loads(expected.content))
+
+    async def test_catalog_payloads_match_the_sync_views(self):
+        product = await Product.objects.afirst()
+        await self.assertSamePayload('products')
+        await self.assertSamePayload('products', data={'page': 2})
+        await self.assertSamePayload('products', data={'q': 'rtx', 'page': 9})
+        await self.assertSamePayload('products', data={'cursor': '', 'page_size': 2, 'count': 'true'})
+        await self.assertSamePayload('top-products', data={'n': 3})
+        await self.assertSamePayload('top-products', data={'category': 'GPU'})
+        await self.assertSamePayload('product', args=[product.id])
+        await self.assertSamePayload('product-category', args=['gpu'])
+        await self.assertSamePayload('products', data={'fields': 'name,description', 'cursor': ''})
+        await self.assertSamePayload('top-products', data={'fields': 'id,rating'})
+        await self.assertSamePayload('product-category', args=['gpu'], data={'fields': 'images'})
+
+    async def test_order_payloads_match_the_sync_views(self):
+        await self.assertSamePayload('myorders', user=self.user)
+        await self.assertSamePayload('user-order', args=[self.order.id], user=self.user)
+
+    async def test_orders_need_a_valid_token(self):
+        response = await self.async_client.get(reverse('async-myorders'))
+        self.assertEqual(response.status_code, 401)
+        response = await self.async_client.get(reverse('async-myorders'), headers={'Authorization': 'Bearer nope'})
+        self.assertEqual(response.status_code, 401)
+        response = await self.async_client.get(
+            reverse('async-user-order', args=[self.order.id]), headers=self.auth(self.other))
+        self.assertEqual(response.status_code, 400)
+
+    def test_shares_the_catalog_cache(self):
+        self.client.get(reverse('products'))
+        with CaptureQueriesContext(connection) as queries:
+            response = async_to_sync(self.async_client.get)(reverse('async-products'))
+        self.assertEqual(len(response.json()['products']), 4)
+        self.assertEqual(len(queries), 0)
+
+
+class ProductFieldsTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        for i in range(6):
+            Product.objects.create(name='RTX %d' % i, category=category('GPU'), price=10, rating=4.5,
+                                   description='A long description ' * 50)
+
+    def product_selects(self, queries):
+        return [q['sql'] for q in queries if q['sql'].startswith('SELECT') and 'FROM "api_product"' in q['sql']]
+
+    def test_listings_default_to_compact_cards(self):
+        list_fields = set(ProductSerializer.LIST_FIELDS)
+        with CaptureQueriesContext(connection) as queries:
+            products = self.client.get(reverse('products')).json()['products']
+        self.assertEqual(set(products[0]), list_fields)
+        self.assertTrue(all('"description"' not in sql for sql in self.product_selects(queries)))
+
+        self.assertEqual(set(self.client.get(reverse('products'), {'cursor': ''}).json()['products'][0]), list_fields)
+        self.assertEqual(set(self.client.get(reverse('top-products')).json()[0]), list_fields)
+        self.assertEqual(set(self.client.get(reverse('product-category', args=['gpu'])).json()[0]), list_fields)
+
+        # the detail endpoint keeps the full product
+        product = self.client.get(reverse('product', args=[Product.objects.first().id])).json()
+        self.assertIn('description', product)
+        self.assertIn('user', product)
+
+    def test_fields_parameter(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('products'), {'fields': 'price,name', 'q': 'rtx'})
+        self.assertEqual([list(p) for p in response.json()['products']], [['name', 'price']] * 4)
+        selects = self.product_selects(queries)
+        self.assertTrue(all('"description"' not in sql and 'api_category' not in sql for sql in selects))
+
+        first = self.client.get(reverse('products'), {'cursor': '', 'fields': 'id'}).json()
+        following = self.client.get(reverse('products'), {'cursor': first['next'], 'fields': 'id'}).json()
+        self.assertEqual(len({p['id'] for p in first['products'] + following['products']}), 6)
+
+        response = self.client.get(reverse('product-category', args=['gpu']), {'fields': 'description'})
+        self.assertEqual(set(response.json()[0]), {'description'})
+        response = self.client.get(reverse('top-products'), {'fields': 'category,images'})
+        self.assertEqual(response.json()[0]['category'], 'GPU')
+        self.assertEqual(set(response.json()[0]), {'category', 'images'})
+
+    def test_unknown_fields(self):
+        for name, args in (('products', []), ('top-products', []), ('product-category', ['gpu'])):
+            response = self.client.get(reverse(name, args=args), {'fields': 'name,ratingSum'})
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json(), {'detail': 'Unknown fields: ratingSum'})
+
+
+class FastJSONTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='buyer', first_name='Zoë')
+        product = Product.objects.create(name='RTX \u2028 4090', price='1599.99', description='Ünïcode ✓')
+        for i in range(3):
+            order = Order.objects.create(user=self.user, totalPrice='10.10', taxPrice='0.14', isPaid=True,
+                                         paidAt=timezone.now())
+            ShippingAddress.objects.create(order=order, address='Street', city='Cairo', postalCode='1', country='EG')
+            OrderItem.objects.create(order=order, product=product, name='RTX', qty=2, price='1599.99')
+
+    def test_same_documents_as_the_stock_renderer(self):
+        orders = OrderSerializer(Order.objects.with_details(), many=True).data
+        products = ProductSerializer(Product.objects.all(), many=True).data
+        for data in (orders, products,
+                     {'when': timezone.now(), 'day': timezone.now().date(), 1: None, 'lazy': _('Order')}):
+            fast = FastJSONRenderer().render(data)
+            self.assertEqual(json.loads(fast), json.loads(JSONRenderer().render(data)))
+        self.assertIn(b'\\u2028', FastJSONRenderer().render(products))
+
+        with mock.patch('api.renderers.orjson', None):
+            self.assertEqual(FastJSONRenderer().render(orders), JSONRenderer().render(orders))
+
+    def test_decimals_are_exact(self):
+        value = Decimal('12345678901234567890.123456789')
+        self.assertEqual(json.loads(FastJSONRenderer().render({'total': value})), {'total': str(value)})
+
+    def test_responses_and_requests(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get(reverse('myorders'))
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response.json()[0]['orderItems'][0]['price'], '1599.99')
+
+        response = self.client.post(reverse('token_obtain_pair'), '{"username": "buyer"',
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(response.json()['detail'].startswith('JSON parse error'))
+        response = self.client.post(reverse('register'), {
+            'username': 'zoe', 'first-name': 'Zoë', 'last-name': 'Ünal', 'email': 'z@example.com',
+            'password': 'secret123'}, format='json')
+        self.assertEqual(response.json()['name'], 'Zoë Ünal')
+
+
+class PerformanceMetricsTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        self.admin = User.objects.create(username='admin', is_staff=True)
+        for i in range(6):
+            Product.objects.create(name='RTX %d' % i, category=category('GPU'), price=10)
+
+    def server_timing(self, response):
+        return {name: dict(part.split('=', 1) for part in params)
+                for name, *params in (entry.split(';') for entry in response['Server-Timing'].split(', '))}
+
+    def test_server_timing_header(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('products'))
+        timing = self.server_timing(response)
+        self.assertEqual(set(timing), {'db', 'serialize', 'render', 'total'})
+        self.assertEqual(timing['db']['desc'], '"%d queries"' % len(queries))
+        self.assertGreater(float(timing['serialize']['dur']), 0)
+        self.assertGreater(float(timing['render']['dur']), 0)
+        self.assertGreaterEqual(float(timing['total']['dur']), float(timing['db']['dur']))
+
+        # served from the cache
+        response = self.client.get(reverse('products'))
+        self.assertEqual(self.server_timing(response)['serialize']['dur'], '0.00')
+
+    async def test_async_views(self):
+        response = await self.async_client.get(reverse('async-products'))
+        timing = self.server_timing(response)
+        self.assertNotEqual(timing['db']['desc'], '"0 queries"')
+        self.assertGreater(float(timing['serialize']['dur']), 0)
+
+    def test_prometheus_export(self):
+        self.client.get(reverse('products'))
+        self.client.get(reverse('products'), {'page': 2})
+        self.client.get(reverse('product', args=[Product.objects.first().id]))
+        self.client.get('/api/nowhere/')
+
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 401)
+        self.client.force_authenticate(self.admin)
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        lines = response.content.decode().splitlines()
+        self.assertIn('# TYPE hardware_market_request_duration_seconds histogram', lines)
+        self.assertIn('hardware_market_request_duration_seconds_count{route="products",method="GET"} 2', lines)
+        self.assertIn('hardware_market_request_duration_seconds_bucket{route="products",method="GET",le="+Inf"} 2',
+                      lines)
+        self.assertIn('hardware_market_db_queries_count{route="product",method="GET"} 1', lines)
+        self.assertIn('hardware_market_responses_total{route="unmatched",method="GET",status="404"} 1', lines)
+        self.assertIn('hardware_market_responses_total{route="metrics",method="GET",status="401"} 1', lines)
+
+    @override_settings(PERFORMANCE_METRICS=False)
+    def test_disabled(self):
+        response = self.client.get(reverse('products'))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(metrics.render_prometheus().count('_count{'), 0)
+
+
+class ConditionalGetTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create(username='admin', is_staff=True)
+        self.user = User.objects.create(username='buyer')
+        self.other = User.objects.create(username='other')
+        self.product = Product.objects.create(name='RTX', category=category('GPU'), price=10, countInStock=5,
+                                              rating=5, numOfReviews=1, ratingSum=5)
+        self.order = Order.objects.create(user=self.user, totalPrice=10)
+        OrderItem.objects.create(order=self.order, product=self.product, name='RTX', qty=1, price=10)
+
+    def etag(self, name, args=(), data=None, user=None):
+        if user is not None:
+            self.client.force_authenticate(user)
+        response = self.client.get(reverse(name, args=args), data)
+        self.assertEqual(response.status_code, 200)
+        # only single objects have a timestamp that every change moves
+        self.assertEqual('Last-Modified' in response, name in ('product', 'user-order'))
+        self.assertIn('no-cache', response['Cache-Control'])
+        return response['ETag']
+
+    def revalidate(self, name, etag, args=(), data=None, user=None):
+        if user is not None:
+            self.client.force_authenticate(user)
+        return self.client.get(reverse(name, args=args), data, HTTP_IF_NONE_MATCH=etag)
+
+    def test_not_modified_skips_serialization(self):
+        for name, args, data, user in (
+                ('products', (), None, None),
+                ('products', (), {'cursor': '', 'q': 'rtx'}, None),
+                ('product', [self.product.id], None, None),
+                ('product-category', ['gpu'], None, None),
+                ('top-products', (), {'n': 3}, None),
+                ('myorders', (), None, self.user),
+                ('user-order', [self.order.id], None, self.user),
+                ('orders', (), None, self.admin)):
+            etag = self.etag(name, args, data, user)
+            with mock.patch('api.metrics.TimedSerializerMixin.to_representation') as serialize:
+                response = self.revalidate(name, etag, args, data, user)
+            self.assertEqual(response.status_code, 304, name)
+            self.assertEqual(response['ETag'], etag)
+            serialize.assert_not_called()
+
+    def test_lists_ignore_if_modified_since(self):
+        Product.objects.create(name='Ryzen', category=category('CPU'), price=20, countInStock=5)
+        self.client.force_authenticate(self.admin)
+        self.client.delete(reverse('product-delete', args=[self.product.id]))
+        # no row of the list is newer than the client's copy, yet one is gone
+        response = self.client.get(reverse('products'), HTTP_IF_MODIFIED_SINCE=http_date(time.time()))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([product['name'] for product in response.data['products']], ['Ryzen'])
+
+    def test_catalog_revalidation_is_cached(self):
+        etag = self.etag('products')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.revalidate('products', etag).status_code, 304)
+        self.assertNotEqual(self.etag('products', data={'page': 2}), etag)
+
+    def test_order_revalidation_is_one_query(self):
+        etag = self.etag('user-order', [self.order.id], user=self.user)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.revalidate('user-order', etag, [self.order.id], user=self.user).status_code, 304)
+        self.assertIn('private', self.revalidate('user-order', etag, [self.order.id], user=self.user)['Cache-Control'])
+
+    def test_product_writes_change_the_etag(self):
+        seen = {self.etag('product', [self.product.id])}
+        self.client.force_authenticate(self.user)
+        self.client.post(reverse('create-review', args=[self.product.id]), {'rating': 5, 'comment': ''}, format='json')
+        seen.add(self.etag('product', [self.product.id]))
+
+        self.client.force_authenticate(self.admin)
+        self.client.put(reverse('product-update', args=[self.product.id]), {
+            'name': 'RTX 4090', 'description': '', 'price': 10, 'category': 'GPU', 'count-in-stock': 5})
+        seen.add(self.etag('product', [self.product.id]))
+
+        # checkout does not invalidate the catalog cache
+        self.client.force_authenticate(self.user)
+        self.client.post(reverse('orders-add'), {
+            'paymentMethod': 'PayPal', 'taxPrice': 0, 'shippingPrice': 0, 'totalPrice': 10,
+            'shippingAddress': {'address': 'Street', 'city': 'Cairo', 'postalCode': '1', 'country': 'EG'},
+            'orderItems': [{'product': self.product.id, 'qty': 1, 'price': 10}],
+        }, format='json')
+        cache.clear()
+        seen.add(self.etag('product', [self.product.id]))
+        self.assertEqual(len(seen), 4)
+
+    def test_order_writes_change_the_etag(self):
+        seen = {self.etag('user-order', [self.order.id], user=self.user)}
+        mine = self.etag('myorders', user=self.user)
+
+        self.client.force_authenticate(self.user)
+        self.client.put(reverse('pay', args=[self.order.id]))
+        seen.add(self.etag('user-order', [self.order.id], user=self.user))
+
+        self.client.force_authenticate(self.admin)
+        self.client.put(reverse('order-delivered', args=[self.order.id]))
+        seen.add(self.etag('user-order', [self.order.id], user=self.user))
+
+        # the payload embeds the customer
+        self.client.force_authenticate(self.user)
+        self.client.put(reverse('user-profile-update'), {
+            'first-name': 'Jane', 'last-name': 'Doe', 'email': 'jane@example.com', 'password': 'secret123'})
+        seen.add(self.etag('user-order', [self.order.id], user=self.user))
+        self.assertEqual(len(seen), 4)
+
+        self.assertNotEqual(self.etag('myorders', user=self.user), mine)
+
+    def test_other_users_cannot_revalidate(self):
+        etag = self.etag('user-order', [self.order.id], user=self.user)
+        self.assertEqual(self.revalidate('user-order', etag, [self.order.id], user=self.other).status_code, 400)
+        self.assertEqual(self.revalidate('user-order', etag, [self.order.id], user=self.admin).status_code, 304)
+
+    def test_async_views(self):
+        headers = {'Authorization': 'Bearer %s' % RefreshToken.for_user(self.user).access_token}
+        for name, args in (('products', ()), ('product', [self.product.id]), ('product-category', ['gpu']),
+                           ('top-products', ()), ('myorders', ()), ('user-order', [self.order.id])):
+            url = reverse('async-' + name, args=args)
+            response = async_to_sync(self.async_client.get)(url, headers=headers)
+            self.assertEqual(response.status_code, 200)
+            # same version, same validator as the sync twin
+            self.assertEqual(response['ETag'], self.etag(name, args, user=self.user))
+            response = async_to_sync(self.async_client.get)(url, headers={**headers, 'If-None-Match': response['ETag']})
+            self.assertEqual(response.status_code, 304, name)
+
+
+class CachedAuthenticationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        cached_users.clear()
+        self.admin = User.objects.create(username='admin', is_staff=True)
+        self.user = User.objects.create(username='buyer', first_name='jane', last_name='doe')
+
+    def get(self, name, user, **kwargs):
+        token = RefreshToken.for_user(user).access_token
+        return self.client.get(reverse(name, **kwargs), HTTP_AUTHORIZATION='Bearer %s' % token)
+
+    def test_user_is_loaded_once(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get('user-profile', self.user).data['name'], 'Jane Doe')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get('user-profile', self.user).data['name'], 'Jane Doe')
+
+    def test_account_changes_apply_at_once(self):
+        self.assertEqual(self.get('users', self.user).status_code, 403)
+        self.client.force_authenticate(self.admin)
+        self.client.put(reverse('user-update', args=[self.user.id]), {'is-admin': True}, format='json')
+        self.client.force_authenticate(None)
+        self.assertEqual(self.get('users', self.user).status_code, 200)
+
+        token = RefreshToken.for_user(self.user).access_token
+        self.client.force_authenticate(self.admin)
+        self.client.delete(reverse('user-delete', args=[self.user.id]))
+        self.client.force_authenticate(None)
+        response = self.client.get(reverse('user-profile'), HTTP_AUTHORIZATION='Bearer %s' % token)
+        self.assertEqual(response.status_code, 401)
+
+    def test_profile_update_is_seen(self):
+        self.get('user-profile', self.user)
+        self.client.force_authenticate(self.user)
+        self.client.put(reverse('user-profile-update'), {
+            'first-name': 'Joan', 'last-name': 'Doe', 'email': 'joan@example.com', 'password': 'secret123'})
+        self.client.force_authenticate(None)
+        self.assertEqual(self.get('user-profile', self.user).data['name'], 'Joan Doe')
+
+    def test_requests_get_their_own_user(self):
+        first = self.get('user-profile', self.user).wsgi_request.user
+        second = self.get('user-profile', self.user).wsgi_request.user
+        self.assertEqual(first, second)
+        self.assertIsNot(first, second)
+
+    def test_timeout_and_size(self):
+        self.get('user-profile', self.user)
+        with mock.patch('api.authentication.time.monotonic', return_value=time.monotonic() + 61):
+            with self.assertNumQueries(1):
+                self.get('user-profile', self.user)
+
+        with self.settings(AUTH_USER_CACHE_SIZE=1):
+            self.get('user-profile', self.admin)
+            self.assertEqual(len(cached_users), 1)
+            with self.assertNumQueries(1):
+                self.get('user-profile', self.user)
+
+        cached_users.clear()
+        with self.settings(AUTH_USER_CACHE_TIMEOUT=0):
+            self.get('user-profile', self.user)
+            self.assertEqual(len(cached_users), 0)
+
+
+class PasswordHashingTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='buyer', password='secret123', first_name='jane')
+
+    def login(self, password='secret123'):
+        return self.client.post(reverse('token_obtain_pair'), {'username': 'buyer', 'password': password},
+                                format='json')
+
+    def test_login_mints_one_token_pair(self):
+        with mock.patch.object(RefreshToken, 'for_user', wraps=RefreshToken.for_user) as for_user:
+            response = self.login()
+        self.assertEqual(response.status_code, 200)
+        for_user.assert_called_once()
+        self.assertEqual(response.data['token'], response.data['access'])
+        self.assertEqual(response.data['username'], 'buyer')
+        self.assertEqual(self.login('wrong').status_code, 401)
+
+    def test_profile_update_keeps_the_password(self):
+        self.client.force_authenticate(self.user)
+        encoded = self.user.password
+        with mock.patch('django.contrib.auth.hashers.PBKDF2PasswordHasher.encode') as encode:
+            response = self.client.put(reverse('user-profile-update'), {'first-name': 'joan', 'last-name': 'doe'})
+        self.assertEqual(response.data['name'], 'Joan Doe')
+        encode.assert_not_called()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.password, encoded)
+
+        response = self.client.put(reverse('user-profile-update'), {
+            'first-name': 'joan', 'last-name': 'doe', 'password': 'short'})
+        self.assertEqual(response.status_code, 400)
+        self.client.put(reverse('user-profile-update'), {
+            'first-name': 'joan', 'last-name': 'doe', 'password': 'newsecret1'})
+        self.assertEqual(self.login('newsecret1').status_code, 200)
+
+    def test_hashing_runs_on_the_pool(self):
+        threads = []
+        encode = PBKDF2PasswordHasher.encode
+
+        def record(*args, **kwargs):
+            threads.append(threading.current_thread().name)
+            return encode(*args, **kwargs)
+
+        with mock.patch('django.contrib.auth.hashers.PBKDF2PasswordHasher.encode', record):
+            self.assertEqual(self.login().status_code, 200)
+        self.assertTrue(threads)
+        self.assertTrue(all(name.startswith('passwords') for name in threads), threads)
+
+    @override_settings(PASSWORD_HASH_ITERATIONS=1000)
+    def test_tunable_iterations(self):
+        self.assertTrue(make_password('secret123').startswith('pbkdf2_sha256$1000$'))
+        # older hashes still verify and move to the new work factor
+        self.assertFalse(self.user.password.startswith('pbkdf2_sha256$1000$'))
+        self.assertEqual(self.login().status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$1000$'))
+
+
+@override_settings(DATABASE_REPLICAS=['replica1', 'replica2'])
+class ReplicaRoutingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.middleware = ReplicaMiddleware(self.view)
+
+    def view(self, request):
+        return HttpResponse(router.db_for_read(Product))
+
+    def request(self, method, token=None):
+        headers = {'Authorization': 'Bearer %s' % token} if token else {}
+        return self.middleware(getattr(self.factory, method)('/api/products/', headers=headers)).content.decode()
+
+    def test_router(self):
+        self.assertEqual(router.db_for_read(Product), 'default')
+        token = routers.read_from_replicas()
+        try:
+            self.assertIn(router.db_for_read(Product), ['replica1', 'replica2'])
+            self.assertEqual(router.db_for_write(Product), 'default')
+        finally:
+            routers.reset(token)
+        self.assertEqual(router.db_for_read(Product), 'default')
+        self.assertFalse(router.allow_migrate('replica1', 'api'))
+
+    def test_one_replica_per_request(self):
+        def view(request):
+            return HttpResponse(','.join({router.db_for_read(Product) for _ in range(50)}))
+
+        middleware = ReplicaMiddleware(view)
+        seen = {middleware(self.factory.get('/api/products/')).content.decode() for _ in range(50)}
+        # every read of a request on the same replica, both replicas used across requests
+        self.assertEqual(seen, {'replica1', 'replica2'})
+
+    def test_reads_go_to_replicas_and_writes_to_the_primary(self):
+        self.assertIn(self.request('get'), ['replica1', 'replica2'])
+        self.assertEqual(self.request('post'), 'default')
+        self.assertEqual(self.request('delete'), 'default')
+
+    def test_clients_read_their_own_writes(self):
+        self.assertIn(self.request('get', 'a'), ['replica1', 'replica2'])
+        self.request('put', 'a')
+        self.assertEqual(self.request('get', 'a'), 'default')
+        self.assertIn(self.request('get', 'b'), ['replica1', 'replica2'])
+        # the pin expires
+        cache.clear()
+        self.assertIn(self.request('get', 'a'), ['replica1', 'replica2'])
+
+    def test_async(self):
+        async def view(request):
+            return self.view(request)
+
+        middleware = ReplicaMiddleware(view)
+        request = self.factory.get('/api/async/products/')
+        self.assertIn(async_to_sync(middleware)(request).content.decode(), ['replica1', 'replica2'])
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_unused_without_replicas(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            ReplicaMiddleware(self.view)
+
+    def test_sqlite_pragmas(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite only')
+        with connection.cursor() as cursor:
+            self.assertEqual(cursor.execute('PRAGMA synchronous').fetchone()[0], 1)
+            self.assertEqual(cursor.execute('PRAGMA temp_store').fetchone()[0], 2)
+
+
+class UserListingTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create(username='admin', email='root@example.com', is_staff=True)
+        for i in range(7):
+            User.objects.create(username='Customer%d' % i, email='c%d@shop.example' % i,
+                                first_name='jane', last_name='doe %d' % i)
+        self.client.force_authenticate(self.admin)
+
+    def get(self, **params):
+        return self.client.get(reverse('users'), params)
+
+    def usernames(self, response):
+        return [user['username'] for user in response.data['users']]
+
+    def test_full_listing_matches_the_serializer(self):
+        with self.assertNumQueries(1):
+            response = self.get()
+        self.assertEqual(response.data, UserSerializer(User.objects.all(), many=True).data)
+        self.assertEqual(response.data[1]['name'], 'Jane Doe 0')
+
+    def test_full_listing_is_capped(self):
+        with mock.patch('api.views.user_views.MAX_USERS', 5):
+            response = self.get()
+            self.assertEqual([user['username'] for user in response.data],
+                             ['admin'] + ['Customer%d' % i for i in range(4)])
+            self.assertEqual(response['X-Truncated'], 'true')
+            self.assertNotIn('X-Truncated', self.get(q='customer5'))
+
+    def test_keyset_pages(self):
+        response = self.get(cursor='', page_size=3)
+        self.assertEqual(self.usernames(response), ['Customer6', 'Customer5', 'Customer4'])
+        self.assertIsNone(response.data['prev'])
+        self.assertNotIn('count', response.data)
+
+        seen, cursor = [], ''
+        while cursor is not None:
+            response = self.get(cursor=cursor, page_size=3)
+            seen += self.usernames(response)
+            cursor = response.data['next']
+        self.assertEqual(seen, ['Customer%d' % i for i in range(6, -1, -1)] + ['admin'])
+
+        back = self.get(cursor=self.get(cursor='', page_size=3).data['next'], page_size=3).data['prev']
+        self.assertEqual(self.usernames(self.get(cursor=back, page_size=3)), ['Customer6', 'Customer5', 'Customer4'])
+        self.assertEqual(self.get(cursor='nope').status_code, 400)
+
+    def test_prefix_search(self):
+        self.assertEqual(len(self.get(q='customer').data), 7)
+        self.assertEqual([user['username'] for user in self.get(q='CUSTOMER3').data], ['Customer3'])
+        self.assertEqual([user['username'] for user in self.get(q='root@').data], ['admin'])
+        self.assertEqual(self.get(q='ustomer').data, [])
+
+        response = self.get(q='c1', cursor='', count='true')
+        self.assertEqual((self.usernames(response), response.data['count']), (['Customer1'], 1))
+
+    def test_prefix_search_of_non_ascii_names(self):
+        User.objects.create(username='Émile', email='emile@shop.example')
+        self.assertEqual([user['username'] for user in self.get(q='Ém').data], ['Émile'])
+        self.assertEqual([user['username'] for user in self.get(q='ÉMI').data], ['Émile'])
+        self.assertEqual(self.usernames(self.get(q='Émile', cursor='')), ['Émile'])
+
+    def test_search_uses_the_indexes(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite query plan')
+        with CaptureQueriesContext(connection) as queries:
+            self.get(q='customer', cursor='')
+        with connection.cursor() as cursor:
+            plan = str(cursor.execute('EXPLAIN QUERY PLAN ' + queries[0]['sql']).fetchall())
+        self.assertIn('api_user_username_lower_idx', plan)
+        self.assertIn('api_user_email_lower_idx', plan)
+
+
+class ProductImportTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create(username='admin', is_staff=True)
+        self.client.force_authenticate(self.admin)
+        self.gpu = Product.objects.create(name='RTX', category=category('GPU'), price=10, countInStock=1,
+                                          image='hardwareImages/rtx.png', rating=5, numOfReviews=1, ratingSum=5)
+        self.cpu = Product.objects.create(name='Ryzen', category=category('CPU'), price=20, countInStock=2)
+        recount()
+
+    def upload(self, body, content_type='text/csv', **params):
+        url = reverse('products-import')
+        if params:
+            url += '?' + '&'.join('%s=%s' % item for item in params.items())
+        return self.client.post(url, body, content_type=content_type)
+
+    def test_csv_price_and_stock_feed(self):
+        updated = self.gpu.updatedAt
+        response = self.upload('id,price,countInStock\n%d,12.50,7\n%d,abc,1\n999,1,1\n%d,21,-1\n%d,19.99,0\n' % (
+            self.gpu.id, self.cpu.id, self.cpu.id, self.cpu.id))
+        self.assertEqual((response.data['updated'], response.data['created'], response.data['failed']), (2, 0, 3))
+        self.assertEqual([(e['line'], e['error']) for e in response.data['errors']], [
+            (3, 'price must be a number'), (5, 'countInStock must not be negative'), (4, 'Product 999 does not exist')])
+
+        self.gpu.refresh_from_db()
+        self.cpu.refresh_from_db()
+        self.assertEqual((self.gpu.price, self.gpu.countInStock, self.gpu.name), (Decimal('12.50'), 7, 'RTX'))
+        self.assertEqual((self.cpu.price, self.cpu.countInStock), (Decimal('19.99'), 0))
+        self.assertEqual(self.gpu.image.name, 'hardwareImages/rtx.png')
+        self.assertGreater(self.gpu.updatedAt, updated)
+
+    def test_ndjson_creates_and_moves_products(self):
+        self.client.get(reverse('products'))
+        lines = [
+            {'name': 'Arc A770', 'price': '300', 'category': 'GPU', 'description': 'Intel', 'countInStock': 3},
+            {'name': 'No price'},
+            {'id': self.gpu.id, 'category': 'Accelerators'},
+            {'id': self.cpu.id, 'colour': 'red'},
+        ]
+        response = self.upload('\n'.join(json.dumps(line) for line in lines) + '\nnot json\n',
+                               content_type='application/x-ndjson')
+        self.assertEqual((response.data['created'], response.data['updated'], response.data['failed']), (1, 1, 3))
+
+        arc = Product.objects.get(name='Arc A770')
+        self.assertEqual((arc.category.name, arc.user, arc.price), ('GPU', self.admin, Decimal('300')))
+        self.assertEqual(list(search_products(Product.objects.all(), 'arc')), [arc])
+        self.assertEqual(dict(Category.objects.values_list('name', 'productCount')),
+                         {'GPU': 1, 'CPU': 1, 'Accelerators': 1})
+        # the catalog cache and the leaderboards follow
+        self.assertEqual(len(self.client.get(reverse('products')).data['products']), 3)
+        self.assertEqual([p['name'] for p in self.client.get(reverse('top-products'),
+                                                            {'category': 'Accelerators'}).data], ['RTX'])
+        self.assertEqual(self.client.get(reverse('top-products'), {'category': 'GPU'}).data, [])
+
+    def test_multipart_upload_and_batches(self):
+        rows = ''.join('%d,%d\n' % (self.gpu.id, i) for i in range(2500))
+        upload = SimpleUploadedFile('stock.csv', ('id,countInStock\n' + rows).encode())
+        with mock.patch('api.imports.BATCH_SIZE', 1000), CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('products-import'), {'file': upload})
+        self.assertEqual((response.data['updated'], response.data['failed']), (3, 0))
+        self.assertLess(len(queries), 25)
+        self.gpu.refresh_from_db()
+        self.assertEqual(self.gpu.countInStock, 2499)
+
+    def test_records_only_write_their_columns(self):
+        write = imports.update
+
+        def checkout_then_write(products, fields):
+            # a checkout takes the last RTX between the fetch and the write
+            Product.objects.filter(id=self.gpu.id).update(countInStock=0)
+            write(products, fields)
+
+        lines = [{'id': self.gpu.id, 'price': '11'}, {'id': self.cpu.id, 'countInStock': 5},
+                 {'id': self.cpu.id, 'category': 'GPU'}]
+        with mock.patch('api.imports.update', side_effect=checkout_then_write) as update, \
+                CaptureQueriesContext(connection) as queries:
+            response = self.upload('\n'.join(json.dumps(line) for line in lines), content_type='application/x-ndjson')
+        self.assertEqual(response.data['updated'], 2)
+        self.assertEqual(sorted(call.args[1] for call in update.call_args_list),
+                         [('category', 'countInStock', 'updatedAt'), ('price', 'updatedAt')])
+        # the new category by name, then the old ones of the moved products together
+        self.assertEqual(sum(query['sql'].startswith('SELECT "api_category"') for query in queries), 2)
+
+        self.gpu.refresh_from_db()
+        self.cpu.refresh_from_db()
+        self.assertEqual((self.gpu.price, self.gpu.countInStock), (Decimal('11'), 0))
+        self.assertEqual((self.cpu.countInStock, self.cpu.category.name), (5, 'GPU'))
+
+    def test_export_round_trip(self):
+        for output in ('csv', 'ndjson'):
+            response = self.client.get(reverse('products-export'), {'type': output})
+            body = b''.join(response.streaming_content).decode()
+            content_type = 'text/csv' if output == 'csv' else 'application/x-ndjson'
+            report = self.upload(body, content_type=content_type)
+            self.assertEqual((report.data['updated'], report.data['failed']), (2, 0), output)
+        self.assertIn('"category": "GPU"', body)
+        self.assertEqual(self.client.get(reverse('products-export'), {'type': 'xml'}).status_code, 400)
+
+    def test_admin_only(self):
+        self.client.force_authenticate(User.objects.create(username='buyer'))
+        self.assertEqual(self.upload('id,price\n1,1\n').status_code, 403)
+        self.assertEqual(self.client.get(reverse('products-export')).status_code, 403)
+
+    def test_update_keeps_the_image(self):
+        self.client.put(reverse('product-update', args=[self.gpu.id]), {
+            'name': 'RTX 4090', 'description': '', 'price': 10, 'category': 'GPU', 'count-in-stock': 1})
+        self.gpu.refresh_from_db()
+        self.assertEqual((self.gpu.name, self.gpu.image.name), ('RTX 4090', 'hardwareImages/rtx.png'))
+
+
+class SalesAnalyticsTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='buyer')
+        self.admin = User.objects.create(username='admin', is_staff=True)
+        self.gpu = Product.objects.create(name='RTX', category=category('GPU'), price=500, countInStock=10)
+        self.cpu = Product.objects.create(name='Ryzen', category=category('CPU'), price=200, countInStock=10)
+        self.fan = Product.objects.create(name='Fan', category=category('CPU'), price='9.99', countInStock=10)
+
+    def checkout(self, total, *lines):
+        self.client.force_authenticate(self.user)
+        response = self.client.post(reverse('orders-add'), {
+            'paymentMethod': 'PayPal', 'taxPrice': 0, 'shippingPrice': 0, 'totalPrice': total,
+            'shippingAddress': {'address': 'Street', 'city': 'Cairo', 'postalCode': '1', 'country': 'EG'},
+            'orderItems': [{'product': p.id, 'qty': qty, 'price': p.price} for p, qty in lines],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.data['id']
+
+    def get(self, name, **params):
+        self.client.force_authenticate(self.admin)
+        return self.client.get(reverse(name), params)
+
+    def rollups(self):
+        return (
+            list(DailySales.objects.order_by('day').values_list(
+                'day', 'orders', 'paidOrders', 'deliveredOrders', 'revenue', 'paidRevenue', 'units')),
+            list(ProductSales.objects.order_by('day', 'product').values_list('day', 'product', 'units', 'revenue')),
+        )
+
+    def test_order_writes_update_the_rollups(self):
+        first = self.checkout('1019.98', (self.gpu, 1), (self.cpu, 2), (self.fan, 1), (self.fan, 1))
+        self.checkout('200.00', (self.cpu, 1))
+
+        self.client.force_authenticate(self.user)
+        self.client.put(reverse('pay', args=[first]))
+        self.client.put(reverse('pay', args=[first]))
+        self.client.force_authenticate(self.admin)
+        self.client.put(reverse('order-delivered', args=[first]))
+
+        today = timezone.localdate()
+        self.assertEqual(self.rollups(), (
+            [(today, 2, 1, 1, Decimal('1219.98'), Decimal('1019.98'), 6)],
+            [(today, self.gpu.id, 1, Decimal('500.00')), (today, self.cpu.id, 3, Decimal('600.00')),
+             (today, self.fan.id, 2, Decimal('19.98'))],
+        ))
+
+        # a failed checkout leaves no trace
+        self.client.force_authenticate(self.user)
+        self.client.post(reverse('orders-add'), {
+            'paymentMethod': 'PayPal', 'taxPrice': 0, 'shippingPrice': 0, 'totalPrice': 1,
+            'shippingAddress': {'address': 'Street', 'city': 'Cairo', 'postalCode': '1', 'country': 'EG'},
+            'orderItems': [{'product': self.gpu.id, 'qty': 100, 'price': 1}],
+        }, format='json')
+        self.assertEqual(DailySales.objects.get().orders, 2)
+
+    def test_rebuild_matches_the_incremental_rollups(self):
+        first = self.checkout('700.00', (self.gpu, 1), (self.cpu, 1))
+        self.checkout('9.99', (self.fan, 1))
+        self.client.put(reverse('pay', args=[first]))
+        old = Order.objects.create(user=self.user, totalPrice=20, isPaid=True)
+        Order.objects.filter(id=old.id).update(createdAt=timezone.now() - timezone.timedelta(days=3))
+        OrderItem.objects.create(order=old, product=self.fan, qty=2, price='9.99')
+
+        incremental = self.rollups()
+        out = StringIO()
+        call_command('rebuild_sales', stdout=out)
+        self.assertIn('Rebuilt sales for 2 days', out.getvalue())
+        days, products = self.rollups()
+        self.assertEqual((days[1:], products[1:]), incremental)
+        self.assertEqual(days[0][1:], (1, 1, 0, Decimal('20.00'), Decimal('20.00'), 2))
+
+    def test_endpoints(self):
+        first = self.checkout('719.98', (self.gpu, 1), (self.cpu, 1), (self.fan, 2))
+        self.checkout('400.00', (self.cpu, 2))
+        self.client.put(reverse('pay', args=[first]))
+        today = timezone.localdate().isoformat()
+
+        daily = self.get('sales-daily', **{'from': today, 'to': today}).data
+        self.assertEqual([(str(d['day']), d['orders'], d['units'], str(d['revenue'])) for d in daily],
+                         [(today, 2, 6, '1119.98')])
+        self.assertEqual(self.get('sales-daily', **{'from': '2000-01-01', 'to': '2000-12-31'}).data, [])
+
+        products = self.get('sales-products', limit=2).data
+        self.assertEqual([(p['name'], p['units'], str(p['revenue'])) for p in products],
+                         [('Ryzen', 3, '600.00'), ('Fan', 2, '19.98')])
+
+        categories = self.get('sales-categories').data
+        self.assertEqual([(c['category'], c['units'], str(c['revenue'])) for c in categories],
+                         [('CPU', 5, '619.98'), ('GPU', 1, '500.00')])
+
+        funnel = self.get('sales-funnel').data
+        self.assertEqual((funnel['orders'], funnel['paidOrders'], funnel['deliveredOrders']), (2, 1, 0))
+        self.assertEqual((funnel['paidRate'], funnel['deliveredRate']), (0.5, 0))
+
+        # a handful of rollup rows, whatever the number of orders
+        with self.assertNumQueries(1):
+            self.get('sales-daily')
+
+    def test_validation_and_permissions(self):
+        self.assertEqual(self.get('sales-daily', **{'from': 'yesterday'}).status_code, 400)
+        self.assertEqual(self.get('sales-products', limit=1000).status_code, 400)
+        self.assertEqual(self.get('sales-funnel').data['orders'], 0)
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get(reverse('sales-daily')).status_code, 403)
+
+
+def echo_job(**kwargs):
+    return kwargs
+
+
+def failing_job():
+    raise ValueError('boom')
+
+
+TEST_TASKS = {'echo': 'api.tests.echo_job', 'failing': 'api.tests.failing_job'}
+
+
+@override_settings(JOBS_MAX_ATTEMPTS=3, JOBS_RETRY_DELAY=10)
+class JobQueueTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.enterContext(mock.patch.dict(jobs.TASKS, TEST_TASKS))
+        self.admin = User.objects.create(username='admin', is_staff=True)
+
+    def work(self):
+        return Worker(threads=1, burst=True).run()
+
+    def test_worker_runs_due_jobs(self):
+        due = jobs.enqueue('echo', x=1)
+        later = jobs.enqueue('echo', delay=60, x=2)
+        self.assertEqual(self.work(), 1)
+
+        due.refresh_from_db()
+        later.refresh_from_db()
+        self.assertEqual((due.status, due.result, due.attempts), (Job.DONE, {'x': 1}, 1))
+        self.assertIsNotNone(due.finishedAt)
+        self.assertEqual(later.status, Job.QUEUED)
+        with self.assertRaises(KeyError):
+            jobs.enqueue('unknown')
+
+    def test_failures_are_retried_with_backoff(self):
+        job = jobs.enqueue('failing')
+        for attempt, delay in ((1, 10), (2, 20)):
+            before = timezone.now()
+            with self.assertLogs('api.jobs', 'ERROR'):
+                self.assertEqual(self.work(), 1)
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts), (Job.QUEUED, attempt))
+            self.assertIn('ValueError: boom', job.error)
+            self.assertAlmostEqual((job.runAt - before).total_seconds(), delay, delta=1)
+            # not due yet
+            self.assertEqual(self.work(), 0)
+            Job.objects.filter(id=job.id).update(runAt=timezone.now())
+
+        with self.assertLogs('api.jobs', 'ERROR'):
+            self.work()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 3))
+        self.assertIsNotNone(job.finishedAt)
+
+    def test_lost_and_finished_jobs(self):
+        old = timezone.now() - timezone.timedelta(days=30)
+        lost = Job.objects.create(name='echo', status=Job.RUNNING, lockedAt=old, attempts=1, maxAttempts=3)
+        spent = Job.objects.create(name='echo', status=Job.RUNNING, lockedAt=old, attempts=3, maxAttempts=3)
+        busy = Job.objects.create(name='echo', status=Job.RUNNING, lockedAt=timezone.now(), attempts=1, maxAttempts=3)
+        done = Job.objects.create(name='echo', status=Job.DONE, finishedAt=old)
+
+        self.assertEqual(jobs.requeue_lost(), 2)
+        self.assertEqual(jobs.purge(), 1)
+        self.assertEqual(dict(Job.objects.values_list('id', 'status')),
+                         {lost.id: Job.QUEUED, spent.id: Job.FAILED, busy.id: Job.RUNNING})
+        self.assertFalse(Job.objects.filter(id=done.id).exists())
+
+    def test_claims_are_exclusive(self):
+        job = jobs.enqueue('echo')
+        self.assertEqual(jobs.claim('a'), job.id)
+        self.assertIsNone(jobs.claim('b'))
+        # the other worker's result is not recorded as its own
+        jobs.execute(job.id, 'b')
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.lockedBy), (Job.RUNNING, 'a'))
+
+    @override_settings(JOBS_EAGER=True)
+    def test_eager_jobs_run_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            job = jobs.enqueue('echo', x=1)
+            self.assertEqual(Job.objects.get(id=job.id).status, Job.QUEUED)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.lockedBy), (Job.DONE, 'eager'))
+
+    def test_runworker_command(self):
+        jobs.enqueue('echo')
+        jobs.enqueue('failing')
+        out = StringIO()
+        with self.assertLogs('api.jobs', 'ERROR'):
+            call_command('runworker', threads=1, burst=True, stdout=out)
+        self.assertIn('ran 2 jobs', out.getvalue())
+        self.assertEqual(sorted(Job.objects.values_list('status', flat=True)), [Job.DONE, Job.QUEUED])
+
+    def test_review_queues_the_leaderboard(self):
+        product = Product.objects.create(name='RTX', rating=None)
+        self.client.force_authenticate(self.admin)
+        self.client.post(reverse('create-review', args=[product.id]), {'rating': 5, 'comment': ''}, format='json')
+        # the rating is already up to date, the re-ranking is queued
+        product.refresh_from_db()
+        self.assertEqual(product.rating, 5)
+        job = Job.objects.get()
+        self.assertEqual((job.name, job.args, job.status), ('leaderboard', {'product_id': product.id}, Job.QUEUED))
+
+    def test_status_endpoints(self):
+        done = jobs.enqueue('echo', x=1)
+        self.work()
+        failed = Job.objects.create(name='failing', status=Job.FAILED, error='Traceback')
+        jobs.enqueue('echo', delay=60)
+
+        self.client.force_authenticate(self.admin)
+        data = self.client.get(reverse('jobs')).data
+        self.assertEqual(data['counts'], {'queued': 1, 'running': 0, 'done': 1, 'failed': 1})
+        self.assertEqual(len(data['jobs']), 3)
+        data = self.client.get(reverse('jobs'), {'status': 'failed'}).data
+        self.assertEqual([(j['id'], j['error']) for j in data['jobs']], [(failed.id, 'Traceback')])
+        self.assertEqual(len(self.client.get(reverse('jobs'), {'name': 'echo'}).data['jobs']), 2)
+        self.assertEqual(self.client.get(reverse('jobs'), {'status': 'lost'}).status_code, 400)
+
+        job = self.client.get(reverse('job', args=[done.id])).data
+        self.assertEqual((job['status'], job['result'], job['attempts']), ('done', {'x': 1}, 1))
+        self.assertEqual(self.client.get(reverse('job', args=[0])).status_code, 404)
+
+        self.client.force_authenticate(User.objects.create(username='user'))
+        self.assertEqual(self.client.get(reverse('jobs')).status_code, 403)
+
+
+class SeedCommandTests(APITestCase):
+    SIZES = {'users': 20, 'products': 60, 'reviews': 300, 'orders': 40}
+
+    def setUp(self):
+        cache.clear()
+
+    def seed(self, **options):
+        call_command('seed', **self.SIZES, **options, stdout=StringIO())
+
+    def snapshot(self):
+        return (
+            list(Product.objects.order_by('id').values_list('name', 'price', 'rating', 'numOfReviews', 'createdAt')),
+            list(Review.objects.order_by('id').values_list('product__name', 'user__username', 'rating')),
+            list(OrderItem.objects.order_by('id').values_list('order__user__username', 'product__name', 'qty')),
+        )
+
+    def test_deterministic(self):
+        self.seed(seed=7)
+        first = self.snapshot()
+        with self.assertRaises(CommandError):
+            self.seed(seed=7)
+        self.seed(seed=7, clear=True)
+        self.assertEqual(self.snapshot(), first)
+        self.seed(seed=8, clear=True)
+        self.assertNotEqual(self.snapshot(), first)
+
+    def test_consistent_data(self):
+        self.seed()
+        self.assertEqual(Product.objects.count(), 60)
+        self.assertEqual(Order.objects.count(), 40)
+        self.assertEqual(Review.objects.count(), 300)
+        # one review per user and product, aggregates already right
+        self.assertEqual(Review.objects.values('product', 'user').distinct().count(), 300)
+        out = StringIO()
+        call_command('repair_ratings', stdout=out)
+        self.assertIn('Repaired 0 products', out.getvalue())
+
+        self.assertFalse(Order.objects.filter(shippingaddress__isnull=True).exists())
+        self.assertFalse(Order.objects.filter(orderitem__isnull=True).exists())
+        self.assertFalse(Order.objects.filter(isPaid=False, isDelivered=True).exists())
+        self.assertEqual(sum(Category.objects.values_list('productCount', flat=True)), 60)
+        self.assertEqual(sum(DailySales.objects.values_list('orders', flat=True)), 40)
+        self.assertEqual(sum(ProductSales.objects.values_list('units', flat=True)),
+                         sum(OrderItem.objects.values_list('qty', flat=True)))
+
+        # the search index was rebuilt and the triggers are back
+        name = Product.objects.first().name
+        self.assertIn(name, [p.name for p in search_products(Product.objects.all(), name)])
+        product = Product.objects.create(name='Seeded Zyxwv', price=1)
+        self.assertEqual(list(search_products(Product.objects.all(), 'zyxwv')), [product])
+        self.assertEqual(Product.objects.create(name='next').id, product.id + 1)
+
+
+class AsgiDeploymentTests(TransactionTestCase):
+    # base.asgi runs each request's sync code in its own thread, which only
+    # sees committed rows
+    def setUp(self):
+        cache.clear()
+        for i in range(6):
+            Product.objects.create(name='RTX %d' % i, price=10)
+
+    async def test_asgi_application(self):
+        from base.asgi import application
+
+        communicator = ApplicationCommunicator(application, {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': reverse('async-products'), 'raw_path': b'', 'query_string': b'page=2',
+            'headers': [(b'host', b'testserver')], 'server': ('testserver', 80), 'client': ('127.0.0.1', 1),
+        })
+        await communicator.send_input({'type': 'http.request', 'body': b''})
+        start = await communicator.receive_output(5)
+        body = await communicator.receive_output(5)
+        self.assertEqual(start['status'], 200)
+        content = json.loads(body['body'])
+        self.assertEqual((content['page'], content['pages'], len(content['products'])), ('2', 2, 2))
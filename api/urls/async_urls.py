@@ -0,0 +1,12 @@
+from django.urls import path
+from api.views import async_views as views
+
+urlpatterns = [
+    path('products/', views.getProducts, name='async-products'),
+    path('products/top/', views.getTopProducts, name='async-top-products'),
+    path('products/category/<str:name>/', views.getCategoryOfProducts, name='async-product-category'),
+    path('products/<int:pk>/', views.getProduct, name='async-product'),
+
+    path('orders/myorders/', views.getMyOrders, name='async-myorders'),
+    path('orders/<int:pk>/', views.getOrderById, name='async-user-order'),
+]
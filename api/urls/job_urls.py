@@ -0,0 +1,7 @@
+from django.urls import path
+from api.views import job_views as views
+
+urlpatterns = [
+    path('', views.getJobs, name='jobs'),
+    path('<int:pk>/', views.getJob, name='job'),
+]
\ No newline at end of file
@@ -0,0 +1,6 @@
+from django.urls import path
+from api.views import metrics_views as views
+
+urlpatterns = [
+    path('', views.getMetrics, name='metrics'),
+]
@@ -5,6 +5,7 @@ urlpatterns = [
     path('', views.getOrders, name='orders'),
     path('add/', views.addOrderItems, name='orders-add'),
     path('myorders/', views.getMyOrders, name='myorders'),
+    path('export/', views.exportOrders, name='orders-export'),
 
     path('<int:pk>/deliver/', views.updateOrderToDelivered, name='order-delivered'),
 
@@ -5,13 +5,17 @@ urlpatterns = [
 
     path('', views.getProducts, name="products"),
     path('top/', views.getTopProducts, name='top-products'),
+    path('cache/', views.getCacheStats, name='product-cache-stats'),
 
+    path('categories/', views.getCategories, name="product-categories"),
     path('category/<str:name>/', views.getCategoryOfProducts, name="product-category"),
     path('<int:pk>/', views.getProduct, name="product"),
 
     path('create/', views.createProduct, name="product-create"),
     path('update/<int:pk>/', views.updateProduct, name="product-update"),
     path('delete/<int:pk>/', views.deleteProduct, name="product-delete"),
+    path('import/', views.importProducts, name="products-import"),
+    path('export/', views.exportProducts, name="products-export"),
 
     path('<int:pk>/reviews/', views.createProductReview, name="create-review"),
 ]
\ No newline at end of file
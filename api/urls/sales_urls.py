@@ -0,0 +1,9 @@
+from django.urls import path
+from api.views import sales_views as views
+
+urlpatterns = [
+    path('daily/', views.getDailySales, name='sales-daily'),
+    path('products/', views.getProductSales, name='sales-products'),
+    path('categories/', views.getCategorySales, name='sales-categories'),
+    path('funnel/', views.getSalesFunnel, name='sales-funnel'),
+]
\ No newline at end of file
@@ -0,0 +1,241 @@
+"""
+Async variants of the catalog and order read endpoints, served under
+/api/async/. They return the same payloads as their @api_view twins and
+share their cache entries, but run on the event loop when the project is
+served over ASGI (see base/asgi.py), so a slow query does not hold a
+worker thread.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
+
+from api.serializers import ProductSerializer, OrderSerializer, InvalidFields, parse_fields
+from api.models import *
+from api.search import search_products
+from api.pagination import InvalidCursor, apaginate, get_page_size, acached_count
+from api.authentication import CachedJWTAuthentication
+from api.cache import aget_or_build
+from api.conditional import add_validators, alist_validators, aobject_validators, not_modified
+from api import leaderboard
+from api.categories import category_slug
+
+
+async def authenticate(request):
+    """The user of the request's JWT, or a 401 JsonResponse."""
+    try:
+        result = await sync_to_async(CachedJWTAuthentication().authenticate)(request)
+    except AuthenticationFailed as e:
+        return None, JsonResponse({'detail': e.detail}, status=e.status_code)
+    if result is None:
+        return None, JsonResponse({'detail': 'Authentication credentials were not provided.'},
+                                  status=status.HTTP_401_UNAUTHORIZED)
+    return result[0], None
+
+
+# Get All Products
+@require_GET
+async def getProducts(request):
+    try:
+        params = request.GET
+        try:
+            fields = parse_fields(params.get('fields'), ProductSerializer, ProductSerializer.LIST_FIELDS)
+
+            etag, last_modified = await aget_or_build('products:validators', lambda: alist_validators(
+                search_products(Product.objects.all(), params.get('q'), ranked=False), sorted(params.lists()),
+            ), sorted(params.lists()))
+            response = not_modified(request, etag, last_modified)
+            if response is not None:
+                return response
+
+            content = await aget_or_build('products', lambda: listProducts(params, fields), sorted(params.lists()))
+        except (InvalidCursor, InvalidFields) as e:
+            return JsonResponse({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return add_validators(JsonResponse(content), etag, last_modified)
+
+    except Exception:
+        # Handle unexpected errors
+        return JsonResponse('Unexpected error', safe=False)
+
+
+async def listProducts(params, fields):
+    query = params.get('q')
+    if query is None:
+        query = ''
+
+    # Keyset pagination mode: ?cursor=<token> (empty for the first page)
+    if 'cursor' in params:
+        return await listProductsByCursor(params, query, fields)
+
+    # Ranked full-text search, newest first when there is no query
+    products = ProductSerializer.load_only(Product.objects.order_by('-createdAt'), fields)
+    products = search_products(products, query)
+
+    page = params.get('page')
+    paginator = Paginator(products, 4)
+    paginator.count = await products.acount()
+
+    try:
+        number = paginator.validate_number(page)
+    except PageNotAnInteger:
+        number = 1
+    except EmptyPage:
+        number = paginator.num_pages
+
+    bottom = (number - 1) * paginator.per_page
+    rows = [product async for product in products[bottom:bottom + paginator.per_page]]
+
+    serializer = ProductSerializer(rows, many=True, fields=fields)
+    return {'products': serializer.data, 'page': page, 'pages': paginator.num_pages}
+
+
+async def listProductsByCursor(params, query, fields):
+    products = search_products(Product.objects.all(), query, ranked=False)
+    page_size = get_page_size(params.get('page_size'))
+
+    rows, next_cursor, prev_cursor = await apaginate(ProductSerializer.load_only(products, fields),
+                                                     params.get('cursor'), page_size)
+
+    serializer = ProductSerializer(rows, many=True, fields=fields)
+    content = {'products': serializer.data, 'next': next_cursor, 'prev': prev_cursor}
+
+    if params.get('count') in ('1', 'true'):
+        content['count'] = await acached_count(products, 'products:%s' % query)
+
+    return content
+
+
+# Get Top Products, ?n=<count>&category=<name> for a category leaderboard
+@require_GET
+async def getTopProducts(request):
+    try:
+        n = get_page_size(request.GET.get('n'), default=5)
+        n = min(n, settings.TOP_PRODUCTS_CAPACITY)
+        category = category_slug(request.GET.get('category')) or None
+        try:
+            fields = parse_fields(request.GET.get('fields'), ProductSerializer, ProductSerializer.LIST_FIELDS)
+        except InvalidFields as e:
+            return JsonResponse({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        ids = []
+
+        async def validators():
+            ids[:] = await leaderboard.aget_top_ids(n, category)
+            return await alist_validators(Product.objects.filter(id__in=ids), ids, fields)
+
+        etag, last_modified = await aget_or_build('top-products:validators', validators, n, category, fields)
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+
+        async def build():
+            queryset = ProductSerializer.load_only(Product.objects.all(), fields)
+            products = await leaderboard.afetch(ids or await leaderboard.aget_top_ids(n, category), queryset)
+            return ProductSerializer(products, many=True, fields=fields).data
+
+        content = await aget_or_build('top-products', build, n, category, fields)
+        return add_validators(JsonResponse(content, safe=False), etag, last_modified)
+    except Exception:
+        # Handle unexpected errors
+        return JsonResponse('Unexpected error', safe=False)
+
+
+# Get a Product
+@require_GET
+async def getProduct(request, pk):
+    try:
+        etag, last_modified = await aget_or_build('product:validators',
+                                                  lambda: aobject_validators(Product.objects.filter(id=pk)), pk)
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+
+        async def build():
+            product = await Product.objects.aget(id=pk)
+            return ProductSerializer(product, many=False).data
+
+        return add_validators(JsonResponse(await aget_or_build('product', build, pk)), etag, last_modified)
+
+    except Exception:
+        # Handle unexpected errors
+        return JsonResponse('Unexpected error', safe=False)
+
+
+@require_GET
+async def getCategoryOfProducts(request, name):
+    try:
+        query = request.GET.get('q', '')
+        slug = category_slug(name)
+        try:
+            fields = parse_fields(request.GET.get('fields'), ProductSerializer, ProductSerializer.LIST_FIELDS)
+        except InvalidFields as e:
+            return JsonResponse({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        etag, last_modified = await aget_or_build('category:validators', lambda: alist_validators(
+            search_products(Product.objects.filter(category__slug=slug), query, ranked=False), slug, query, fields,
+        ), slug, query, fields)
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+
+        async def build():
+            products = Product.objects.filter(category__slug=slug).order_by('-createdAt')
+            products = search_products(ProductSerializer.load_only(products, fields), query)
+            return ProductSerializer([product async for product in products], many=True, fields=fields).data
+
+        content = await aget_or_build('category', build, slug, query, fields)
+        return add_validators(JsonResponse(content, safe=False), etag, last_modified)
+    except Exception:
+        # Handle unexpected errors
+        return JsonResponse('Unexpected error', safe=False)
+
+
+@require_GET
+async def getMyOrders(request):
+    user, error = await authenticate(request)
+    if error:
+        return error
+    try:
+        etag, last_modified = await alist_validators(Order.objects.filter(user=user), user.id)
+        response = not_modified(request, etag, last_modified, private=True)
+        if response is not None:
+            return response
+
+        orders = Order.objects.with_details().filter(user=user).order_by('createdAt')
+        serializer = OrderSerializer([order async for order in orders], many=True)
+        return add_validators(JsonResponse(serializer.data, safe=False), etag, last_modified, private=True)
+    except Exception:
+        return JsonResponse('Unexpected error', safe=False)
+
+
+@require_GET
+async def getOrderById(request, pk):
+    user, error = await authenticate(request)
+    if error:
+        return error
+    try:
+        # Only the owner, or staff, can revalidate an order
+        orders = Order.objects.filter(id=pk)
+        if not user.is_staff:
+            orders = orders.filter(user=user)
+        etag, last_modified = await aobject_validators(orders)
+        response = not_modified(request, etag, last_modified, private=True)
+        if response is not None:
+            return response
+
+        try:
+            order = await Order.objects.with_details().aget(id=pk)
+        except Order.DoesNotExist:
+            return JsonResponse({'detail': 'Order does not exist'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if user.is_staff or order.user_id == user.id:
+            serializer = OrderSerializer(order, many=False)
+            return add_validators(JsonResponse(serializer.data), etag, last_modified, private=True)
+        return JsonResponse({'detail': 'Not authorized to view this order'},
+                            status=status.HTTP_400_BAD_REQUEST)
+    except Exception:
+        return JsonResponse('Unexpected error', safe=False)
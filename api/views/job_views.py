@@ -0,0 +1,52 @@
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework import status
+
+from django.db.models import Count
+
+from api.models import Job
+
+# Background job introspection for Admin, see api/jobs.py
+#***************************************************************************#
+
+JOB_FIELDS = ['id', 'name', 'args', 'status', 'attempts', 'maxAttempts', 'runAt', 'lockedBy',
+              'createdAt', 'finishedAt', 'result', 'error']
+MAX_JOBS = 100
+
+
+# Jobs per status, and the latest ones (?status=failed&name=image_variants)
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def getJobs(request):
+    try:
+        params = request.query_params
+        jobs = Job.objects.all()
+        if params.get('status'):
+            if params['status'] not in dict(Job.STATUSES):
+                return Response({'detail': 'status must be one of %s' % ', '.join(dict(Job.STATUSES))},
+                                status=status.HTTP_400_BAD_REQUEST)
+            jobs = jobs.filter(status=params['status'])
+        if params.get('name'):
+            jobs = jobs.filter(name=params['name'])
+
+        counts = dict.fromkeys(dict(Job.STATUSES), 0)
+        counts.update(Job.objects.order_by().values_list('status').annotate(n=Count('id')))
+        return Response({
+            'counts': counts,
+            'jobs': list(jobs.order_by('-id').values(*JOB_FIELDS)[:MAX_JOBS]),
+        })
+    except:
+        return Response('Unexpected error')
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def getJob(request, pk):
+    try:
+        job = Job.objects.filter(id=pk).values(*JOB_FIELDS).first()
+        if job is None:
+            return Response({'detail': 'Job does not exist'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(job)
+    except:
+        return Response('Unexpected error')
@@ -0,0 +1,15 @@
+from django.http import HttpResponse
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+
+from api.metrics import render_prometheus
+
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+# Per-route request histograms for Admin, in the Prometheus text format
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def getMetrics(request):
+    return HttpResponse(render_prometheus(), content_type=PROMETHEUS_CONTENT_TYPE)
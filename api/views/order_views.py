@@ -11,16 +11,29 @@ from rest_framework import status
 from django.contrib.auth.models import User
 from api.serializers import *
 from api.models import *
+from api.exports import iter_chunks, ndjson_lines, csv_lines
+from api.images import variant_url
+from api.conditional import add_validators, list_validators, not_modified, object_validators
+from api import sales
 # pagination
 from django.core.paginator import Paginator, PageNotAnInteger, Page
+from django.http import StreamingHttpResponse
+from django.db import transaction
+from django.db.models import F
 
 # datetime
-from datetime import datetime
+from datetime import datetime, time, timedelta
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 #***************************************************************************#
 
+class CheckoutError(Exception):
+    pass
+
+
 @swagger_auto_schema(method='post', request_body=openapi.Schema(
     type=openapi.TYPE_OBJECT,
     required=['paymentMethod', 'taxPrice', 'shippingPrice', 'totalPrice', 'shippingAddress', 'orderItems'],
@@ -42,9 +55,9 @@ from drf_yasg import openapi
             type=openapi.TYPE_ARRAY,
             items=openapi.Schema(
                 type=openapi.TYPE_OBJECT,
-                required=['book', 'qty', 'price'],
+                required=['product', 'qty', 'price'],
                 properties={
-                    'book': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'product': openapi.Schema(type=openapi.TYPE_INTEGER),
                     'qty': openapi.Schema(type=openapi.TYPE_INTEGER),
                     'price': openapi.Schema(type=openapi.TYPE_NUMBER),
                 }
@@ -61,50 +74,78 @@ def addOrderItems(request):
 
         orderItems = data['orderItems']
 
-        if orderItems and len(orderItems) == 0:
+        if not orderItems:
             return Response({'detail': 'No Order Items'}, status=status.HTTP_400_BAD_REQUEST)
-        else:
 
-            # (1) Create order
+        # Total quantity per product, a product may appear on several lines
+        quantities = {}
+        for i in orderItems:
+            if int(i['qty']) < 1:
+                return Response({'detail': 'Quantity must be at least 1'}, status=status.HTTP_400_BAD_REQUEST)
+            quantities[int(i['product'])] = quantities.get(int(i['product']), 0) + int(i['qty'])
 
-            order = Order.objects.create(
-                user=user,
-                paymentMethod=data['paymentMethod'],
-                taxPrice=data['taxPrice'],
-                shippingPrice=data['shippingPrice'],
-                totalPrice=data['totalPrice']
-            )
+        try:
+            with transaction.atomic():
+                # (1) Fetch every product in one query
 
-            # (2) Create shipping address
+                products = Product.objects.in_bulk(list(quantities))
+                for productId in quantities:
+                    if productId not in products:
+                        raise CheckoutError('Product %s does not exist' % productId)
 
-            shipping = ShippingAddress.objects.create(
-                order=order,
-                address=data['shippingAddress']['address'],
-                city=data['shippingAddress']['city'],
-                postalCode=data['shippingAddress']['postalCode'],
-                country=data['shippingAddress']['country'],
-            )
+                # (2) Reserve stock, the whole order rolls back if any line is short
+                #     (ascending ids so concurrent checkouts lock rows in the same order)
 
-            # (3) Create order items and set order to orderItem relationship
-            for i in orderItems:
-                product = Product.objects.get(id=i['product'])
+                for productId in sorted(quantities):
+                    reserved = Product.objects.filter(
+                        id=productId, countInStock__gte=quantities[productId],
+                    ).update(countInStock=F('countInStock') - quantities[productId], updatedAt=timezone.now())
+                    if not reserved:
+                        raise CheckoutError('%s is out of stock' % products[productId].name)
 
-                item = OrderItem.objects.create(
-                    product=product,
+                # (3) Create order
+
+                order = Order.objects.create(
+                    user=user,
+                    paymentMethod=data['paymentMethod'],
+                    taxPrice=data['taxPrice'],
+                    shippingPrice=data['shippingPrice'],
+                    totalPrice=data['totalPrice']
+                )
+
+                # (4) Create shipping address
+
+                shipping = ShippingAddress.objects.create(
                     order=order,
-                    name=product.name,
-                    qty=i['qty'],
-                    price=i['price'],
-                    image=product.image.url,
+                    address=data['shippingAddress']['address'],
+                    city=data['shippingAddress']['city'],
+                    postalCode=data['shippingAddress']['postalCode'],
+                    country=data['shippingAddress']['country'],
                 )
 
-                # (4) Update stock
+                # (5) Create all order items at once
+
+                items = OrderItem.objects.bulk_create([
+                    OrderItem(
+                        product=products[int(i['product'])],
+                        order=order,
+                        name=products[int(i['product'])].name,
+                        qty=i['qty'],
+                        price=i['price'],
+                        image=variant_url(products[int(i['product'])], 'thumbnail'),
+                    )
+                    for i in orderItems
+                ])
 
-                product.countInStock -= item.qty
-                product.save()
+                # (6) Add it to the sales rollups
 
-            serializer = OrderSerializer(order, many=False)
-            return Response(serializer.data)
+                sales.order_placed(order, items)
+
+        except CheckoutError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = OrderSerializer(order, many=False)
+        return Response(serializer.data)
     except:
         return Response('Unexpected error')
 
@@ -114,9 +155,14 @@ def addOrderItems(request):
 def getMyOrders(request):
     try:
         user = request.user
-        orders = user.order_set.all()
+        etag, last_modified = list_validators(user.order_set.all(), user.id)
+        response = not_modified(request, etag, last_modified, private=True)
+        if response is not None:
+            return response
+
+        orders = user.order_set.with_details().order_by('createdAt')
         serializer = OrderSerializer(orders, many=True)
-        return Response(serializer.data)
+        return add_validators(Response(serializer.data), etag, last_modified, private=True)
     except:
         return Response('Unexpected error')
 
@@ -124,9 +170,104 @@ def getMyOrders(request):
 @permission_classes([IsAdminUser])
 def getOrders(request):
     try:
-        orders = Order.objects.all()
+        etag, last_modified = list_validators(Order.objects.all())
+        response = not_modified(request, etag, last_modified, private=True)
+        if response is not None:
+            return response
+
+        orders = Order.objects.with_details()
         serializer = OrderSerializer(orders, many=True)
-        return Response(serializer.data)
+        return add_validators(Response(serializer.data), etag, last_modified, private=True)
+
+    except:
+        return Response('Unexpected error')
+
+
+ORDER_CSV_HEADER = [
+    'orderId', 'userId', 'username', 'email', 'paymentMethod', 'taxPrice', 'shippingPrice',
+    'totalPrice', 'isPaid', 'paidAt', 'isDelivered', 'deliveredAt', 'createdAt',
+    'address', 'city', 'postalCode', 'country',
+    'productId', 'itemName', 'qty', 'price',
+]
+
+
+def orderCsvRows(chunks):
+    # One row per order item; orders without items still get a row
+    for orders in chunks:
+        for order in orders:
+            user = order.user
+            try:
+                address = order.shippingaddress
+            except ShippingAddress.DoesNotExist:
+                address = None
+
+            head = [
+                order.id, user and user.id, user and user.username, user and user.email,
+                order.paymentMethod, order.taxPrice, order.shippingPrice, order.totalPrice,
+                order.isPaid, order.paidAt, order.isDelivered, order.deliveredAt, order.createdAt,
+            ]
+            if address:
+                head += [address.address, address.city, address.postalCode, address.country]
+            else:
+                head += [None] * 4
+
+            items = order.orderitem_set.all()
+            if not items:
+                yield head + [None] * 4
+            for item in items:
+                yield head + [item.product_id, item.name, item.qty, item.price]
+
+
+def orderRecords(chunks):
+    for orders in chunks:
+        yield from OrderSerializer(orders, many=True).data
+
+
+def filterOrders(orders, params):
+    # ?from=YYYY-MM-DD&to=YYYY-MM-DD (inclusive), ?isPaid=true, ?isDelivered=false
+    for param, lookup, offset in (('from', 'createdAt__gte', 0), ('to', 'createdAt__lt', 1)):
+        if params.get(param):
+            day = parse_date(params[param])
+            if day is None:
+                raise ValueError('Invalid date for %s, expected YYYY-MM-DD' % param)
+            start = timezone.make_aware(datetime.combine(day + timedelta(days=offset), time.min))
+            orders = orders.filter(**{lookup: start})
+
+    for param in ('isPaid', 'isDelivered'):
+        value = params.get(param)
+        if value is not None:
+            if value.lower() not in ('true', 'false', '1', '0'):
+                raise ValueError('Invalid value for %s, expected true or false' % param)
+            orders = orders.filter(**{param: value.lower() in ('true', '1')})
+    return orders
+
+
+# Stream every order as NDJSON (default) or CSV for Admin
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def exportOrders(request):
+    try:
+        params = request.query_params
+        output = params.get('type', 'ndjson')
+        if output not in ('ndjson', 'csv'):
+            return Response({'detail': 'type must be ndjson or csv'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            orders = filterOrders(Order.objects.with_details(), params)
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Orders, items and addresses are loaded one chunk at a time
+        chunks = iter_chunks(orders)
+        if output == 'csv':
+            response = StreamingHttpResponse(
+                csv_lines(ORDER_CSV_HEADER, orderCsvRows(chunks)), content_type='text/csv')
+        else:
+            response = StreamingHttpResponse(
+                ndjson_lines(orderRecords(chunks)), content_type='application/x-ndjson')
+
+        response['Content-Disposition'] = 'attachment; filename="orders.%s"' % output
+        return response
 
     except:
         return Response('Unexpected error')
@@ -138,14 +279,23 @@ def getOrderById(request, pk):
     try:
         user = request.user
 
+        # Only the owner, or staff, can revalidate an order
+        orders = Order.objects.filter(id=pk)
+        if not user.is_staff:
+            orders = orders.filter(user=user)
+        etag, last_modified = object_validators(orders)
+        response = not_modified(request, etag, last_modified, private=True)
+        if response is not None:
+            return response
+
         try:
-            order = Order.objects.get(id=pk)
+            order = Order.objects.with_details().get(id=pk)
             if user.is_staff or order.user == user:
                 serializer = OrderSerializer(order, many=False)
-                return Response(serializer.data)
+                return add_validators(Response(serializer.data), etag, last_modified, private=True)
             else:
-                Response({'detail': 'Not authorized to view this order'},
-                        status=status.HTTP_400_BAD_REQUEST)
+                return Response({'detail': 'Not authorized to view this order'},
+                                status=status.HTTP_400_BAD_REQUEST)
         except:
             return Response({'detail': 'Order does not exist'}, status=status.HTTP_400_BAD_REQUEST)
     except:
@@ -157,9 +307,11 @@ def updateOrderToPaid(request, pk):
     try:
         order = Order.objects.get(id=pk)
 
-        order.isPaid = True
-        order.paidAt = datetime.now()
-        order.save()
+        # Only the first payment counts in the sales rollups
+        now = timezone.now()
+        with transaction.atomic():
+            if Order.objects.filter(id=pk, isPaid=False).update(isPaid=True, paidAt=now, updatedAt=now):
+                sales.order_paid(order)
 
         return Response('Order was paid')
     except:
@@ -171,9 +323,12 @@ def updateOrderToDelivered(request, pk):
     try:
         order = Order.objects.get(id=pk)
 
-        order.isDelivered = True
-        order.deliveredAt = datetime.now()
-        order.save()
+        # Only the first delivery counts in the sales rollups
+        now = timezone.now()
+        with transaction.atomic():
+            if Order.objects.filter(id=pk, isDelivered=False).update(isDelivered=True, deliveredAt=now,
+                                                                     updatedAt=now):
+                sales.order_delivered(order)
 
         return Response('Order was delivered')
 
@@ -9,10 +9,25 @@ from rest_framework import status
 
 # User model & serializers and models
 from django.contrib.auth.models import User
-from api.serializers import UserSerializer, UserSerializerWithToken, ProductSerializer
+from api.serializers import UserSerializer, UserSerializerWithToken, ProductSerializer, CategorySerializer, \
+    InvalidFields, parse_fields
 from api.models import *
+from api.search import search_products
+from api.pagination import InvalidCursor, paginate, get_page_size, cached_count
+from api.ratings import add_rating
+from api.cache import get_or_build, bump_catalog_version, get_stats as get_cache_stats
+from api.conditional import add_validators, list_validators, not_modified, object_validators
+from api import jobs, leaderboard
+from api.categories import category_slug, get_or_create_category, product_moved
+from api.images import clear_variants, schedule_variants
+from api.imports import READERS, PRODUCT_FIELDS, Import, decode
+from api.exports import iter_chunks, ndjson_lines, csv_lines
+from django.http import StreamingHttpResponse
+import csv
+from django.conf import settings
+from django.db import transaction
 # pagination
-from django.core.paginator import Paginator, PageNotAnInteger, Page
+from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage, Page
 
 
 from drf_yasg.utils import swagger_auto_schema
@@ -24,41 +39,107 @@ from drf_yasg import openapi
 @api_view(['GET'])
 def getProducts(request):
     try:
-        query = request.query_params.get('q')
-        if query is None:
-            query = ''
-
-        products = Product.objects.filter(
-            name__icontains=query).order_by('-createdAt')
-
-        page = request.query_params.get('page')
-        paginator = Paginator(products, 4)
-
+        params = request.query_params
         try:
-            products = paginator.page(page)
-        except PageNotAnInteger:
-            products = paginator.page(1)
-        except EmptyPage:
-            products = paginator.page(paginator.num_pages)
+            fields = parse_fields(params.get('fields'), ProductSerializer, ProductSerializer.LIST_FIELDS)
 
-        if Page == None:
-            page = 1
+            # Every product matching the query, whatever the page
+            etag, last_modified = get_or_build('products:validators', lambda: list_validators(
+                search_products(Product.objects.all(), params.get('q'), ranked=False), sorted(params.lists()),
+            ), sorted(params.lists()))
+            response = not_modified(request, etag, last_modified)
+            if response is not None:
+                return response
 
-        serializer = ProductSerializer(products, many=True)
-        return Response({'products': serializer.data, 'page': page, 'pages': paginator.num_pages})
+            content = get_or_build('products', lambda: listProducts(params, fields), sorted(params.lists()))
+        except (InvalidCursor, InvalidFields) as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return add_validators(Response(content), etag, last_modified)
 
     except:
         # Handle unexpected errors
         return Response('Unexpected error')
 
 
-# Get Top Products
+def listProducts(params, fields):
+    query = params.get('q')
+    if query is None:
+        query = ''
+
+    # Keyset pagination mode: ?cursor=<token> (empty for the first page)
+    if 'cursor' in params:
+        return listProductsByCursor(params, query, fields)
+
+    # Ranked full-text search, newest first when there is no query
+    products = ProductSerializer.load_only(Product.objects.order_by('-createdAt'), fields)
+    products = search_products(products, query)
+
+    page = params.get('page')
+    paginator = Paginator(products, 4)
+
+    try:
+        products = paginator.page(page)
+    except PageNotAnInteger:
+        products = paginator.page(1)
+    except EmptyPage:
+        products = paginator.page(paginator.num_pages)
+
+    if Page == None:
+        page = 1
+
+    serializer = ProductSerializer(products, many=True, fields=fields)
+    return {'products': serializer.data, 'page': page, 'pages': paginator.num_pages}
+
+
+def listProductsByCursor(params, query, fields):
+    products = search_products(Product.objects.all(), query, ranked=False)
+    page_size = get_page_size(params.get('page_size'))
+
+    rows, next_cursor, prev_cursor = paginate(ProductSerializer.load_only(products, fields),
+                                              params.get('cursor'), page_size)
+
+    serializer = ProductSerializer(rows, many=True, fields=fields)
+    content = {'products': serializer.data, 'next': next_cursor, 'prev': prev_cursor}
+
+    # The total is opt-in and served from a short-lived cache
+    if params.get('count') in ('1', 'true'):
+        content['count'] = cached_count(products, 'products:%s' % query)
+
+    return content
+
+
+# Get Top Products, ?n=<count>&category=<name> for a category leaderboard
 @api_view(['GET'])
 def getTopProducts(request):
     try:
-        products = Product.objects.filter(rating__gte=4).order_by('-rating')[0:5]
-        serializer = ProductSerializer(products, many=True)
-        return Response(serializer.data)
+        n = get_page_size(request.query_params.get('n'), default=5)
+        n = min(n, settings.TOP_PRODUCTS_CAPACITY)
+        category = category_slug(request.query_params.get('category')) or None
+        try:
+            fields = parse_fields(request.query_params.get('fields'), ProductSerializer,
+                                  ProductSerializer.LIST_FIELDS)
+        except InvalidFields as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        ids = []
+
+        def validators():
+            ids[:] = leaderboard.get_top_ids(n, category)
+            return list_validators(Product.objects.filter(id__in=ids), ids, fields)
+
+        etag, last_modified = get_or_build('top-products:validators', validators, n, category, fields)
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+
+        def build():
+            # The board was just read if the validators were not cached
+            products = leaderboard.fetch(ids or leaderboard.get_top_ids(n, category),
+                                         ProductSerializer.load_only(Product.objects.all(), fields))
+            return ProductSerializer(products, many=True, fields=fields).data
+
+        return add_validators(Response(get_or_build('top-products', build, n, category, fields)), etag, last_modified)
     except:
         # Handle unexpected errors
         return Response('Unexpected error')
@@ -67,9 +148,17 @@ def getTopProducts(request):
 @api_view(['GET'])
 def getProduct(request, pk):
     try:
-        product = Product.objects.get(id=pk)
-        serializer = ProductSerializer(product, many=False)
-        return Response(serializer.data)
+        etag, last_modified = get_or_build('product:validators',
+                                           lambda: object_validators(Product.objects.filter(id=pk)), pk)
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+
+        def build():
+            product = Product.objects.get(id=pk)
+            return ProductSerializer(product, many=False).data
+
+        return add_validators(Response(get_or_build('product', build, pk)), etag, last_modified)
 
     except:
         # Handle unexpected errors
@@ -80,14 +169,54 @@ def getProduct(request, pk):
 def getCategoryOfProducts(request, name):
     try:
         query = request.query_params.get('q', '')  # Use default value directly in get() method
-        products = Product.objects.filter(category__icontains=name, name__icontains=query).order_by('-createdAt')
-        serializer = ProductSerializer(products, many=True)
-        return Response(serializer.data)
+
+        # Exact match on the category slug, "Monitor" never matches "Monitor Arms"
+        slug = category_slug(name)
+        try:
+            fields = parse_fields(request.query_params.get('fields'), ProductSerializer,
+                                  ProductSerializer.LIST_FIELDS)
+        except InvalidFields as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        etag, last_modified = get_or_build('category:validators', lambda: list_validators(
+            search_products(Product.objects.filter(category__slug=slug), query, ranked=False), slug, query, fields,
+        ), slug, query, fields)
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+
+        def build():
+            products = Product.objects.filter(category__slug=slug).order_by('-createdAt')
+            products = search_products(ProductSerializer.load_only(products, fields), query)
+            return ProductSerializer(products, many=True, fields=fields).data
+
+        return add_validators(Response(get_or_build('category', build, slug, query, fields)), etag, last_modified)
     except:  # Catch specific exceptions if possible
         # Handle unexpected errors
         return Response('Unexpected error')
 
 
+# Get every category with its number of products
+@api_view(['GET'])
+def getCategories(request):
+    try:
+        def build():
+            categories = Category.objects.order_by('name')
+            return CategorySerializer(categories, many=True).data
+
+        return Response(get_or_build('categories', build))
+    except:
+        # Handle unexpected errors
+        return Response('Unexpected error')
+
+
+# Get catalog cache counters for Admin
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def getCacheStats(request):
+    return Response(get_cache_stats())
+
+
 # Create a Product
 @swagger_auto_schema(method='post', request_body=openapi.Schema(
     type=openapi.TYPE_OBJECT,
@@ -114,9 +243,13 @@ def createProduct(request):
             image = request.FILES.get('image'),
             price = data['price'],
             description = data['description'],
-            category = data['category'],
+            category = get_or_create_category(data['category']),
             countInStock = data['count-in-stock'],
         )
+        product_moved(None, product.category_id)
+        if product.image:
+            schedule_variants(product.id)
+        bump_catalog_version()
         serializer = ProductSerializer(product, many=False)
         return Response(serializer.data)
 
@@ -144,15 +277,26 @@ def updateProduct(request, pk):
     try:
         product = Product.objects.get(id=pk)
         data = request.data
+        oldCategory = product.category
 
         product.name = data['name']
-        product.image = request.FILES.get('image')
+        # Keep the current image unless a new one is uploaded
+        image = request.FILES.get('image')
+        if image:
+            product.image = image
+            clear_variants(product)
         product.description = data['description']
         product.price = data['price']
-        product.category = data['category']
+        product.category = get_or_create_category(data['category'])
         product.countInStock = data['count-in-stock']
 
         product.save()
+        if product.category != oldCategory:
+            product_moved(oldCategory and oldCategory.id, product.category_id)
+            leaderboard.product_changed(product.id, oldCategory)
+        if image:
+            schedule_variants(product.id)
+        bump_catalog_version()
         serializer = ProductSerializer(product, many=False)
         return Response(serializer.data)
 
@@ -161,13 +305,82 @@ def updateProduct(request, pk):
         return Response('Unexpected error')
 
 
+# Upsert products from a CSV or NDJSON upload (a `file` form field or the raw body) for Admin
+@api_view(['POST'])
+@permission_classes([IsAdminUser])
+def importProducts(request):
+    try:
+        if request.content_type.startswith('multipart/form-data'):
+            upload = request.FILES.get('file')
+            if upload is None:
+                return Response({'detail': 'No file uploaded'}, status=status.HTTP_400_BAD_REQUEST)
+            name, lines = upload.name, upload
+        else:
+            # Read straight from the request, never all of it at once
+            name, lines = '', request.stream or []
+
+        kind = request.query_params.get('type') or (
+            'csv' if name.endswith('.csv') or request.content_type.startswith('text/csv') else 'ndjson')
+        if kind not in READERS:
+            return Response({'detail': 'type must be ndjson or csv'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            report = Import(request.user).run(READERS[kind](decode(lines)))
+        except (UnicodeDecodeError, csv.Error) as e:
+            return Response({'detail': 'Unreadable upload: %s' % e}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(report)
+
+    except Exception as e:
+        # Handle unexpected errors
+        return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+def productRecords(chunks):
+    for products in chunks:
+        for product in products:
+            yield {
+                'id': product.id, 'name': product.name, 'description': product.description,
+                'category': product.category and product.category.name,
+                'price': product.price, 'countInStock': product.countInStock,
+            }
+
+
+# Stream every product as NDJSON (default) or CSV, in the columns importProducts reads, for Admin
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def exportProducts(request):
+    try:
+        output = request.query_params.get('type', 'ndjson')
+        if output not in ('ndjson', 'csv'):
+            return Response({'detail': 'type must be ndjson or csv'}, status=status.HTTP_400_BAD_REQUEST)
+
+        products = Product.objects.only(*PRODUCT_FIELDS, 'category__name')
+        records = productRecords(iter_chunks(products))
+        if output == 'csv':
+            rows = ([record[name] for name in PRODUCT_FIELDS] for record in records)
+            response = StreamingHttpResponse(csv_lines(PRODUCT_FIELDS, rows), content_type='text/csv')
+        else:
+            response = StreamingHttpResponse(ndjson_lines(records), content_type='application/x-ndjson')
+
+        response['Content-Disposition'] = 'attachment; filename="products.%s"' % output
+        return response
+
+    except:
+        return Response('Unexpected error')
+
+
 # Delete a Product
 @api_view(['DELETE'])
 @permission_classes([IsAdminUser])
 def deleteProduct(request, pk):
     try:
         product = Product.objects.get(id=pk)
+        # Their items lose the product
+        Order.objects.filter(orderitem__product=product).touch()
         product.delete()
+        product_moved(product.category_id, None)
+        leaderboard.product_removed(int(pk), product.category)
+        bump_catalog_version()
         return Response('Product was deleted successfully')
 
     except:
@@ -205,24 +418,21 @@ def createProductReview(request, pk):
 
         # 3 - Create review
         else:
-            review = Review.objects.create(
-                user=user,
-                product=product,
-                name=user.first_name,
-                rating=data['rating'],
-                comment=data['comment'],
-            )
-
-            reviews = product.review_set.all()
-            product.numOfReviews = len(reviews)
-
-            total = 0
-            for i in reviews:
-                total += i.rating
-
-            product.rating = total / len(reviews)
-            product.save()
-
+            with transaction.atomic():
+                review = Review.objects.create(
+                    user=user,
+                    product=product,
+                    name=user.first_name,
+                    rating=data['rating'],
+                    comment=data['comment'],
+                )
+
+                # 4 - Fold the rating into the product's running aggregates,
+                #     the leaderboards are re-ranked by a worker
+                add_rating(product.id, int(review.rating))
+                jobs.enqueue('leaderboard', product_id=product.id)
+
+            bump_catalog_version()
             return Response('Review Added')
     except:
         # Handle unexpected errors
@@ -0,0 +1,125 @@
+from decimal import Decimal
+
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework import status
+
+from django.db.models import Sum
+from django.utils.dateparse import parse_date
+
+from api.models import DailySales, ProductSales
+
+# Sales analytics for Admin, read from the rollups of api.sales
+#***************************************************************************#
+
+DAILY_FIELDS = ['day', 'orders', 'paidOrders', 'deliveredOrders', 'revenue', 'paidRevenue', 'units']
+MAX_LIMIT = 100
+CENT = Decimal('0.01')
+
+
+def cents(value):
+    # SQLite returns sums of decimals unrounded
+    return Decimal(value or 0).quantize(CENT)
+
+
+def salesRange(rollup, params):
+    # ?from=YYYY-MM-DD&to=YYYY-MM-DD (inclusive, days the orders were placed)
+    for param, lookup in (('from', 'day__gte'), ('to', 'day__lte')):
+        if params.get(param):
+            day = parse_date(params[param])
+            if day is None:
+                raise ValueError('Invalid date for %s, expected YYYY-MM-DD' % param)
+            rollup = rollup.filter(**{lookup: day})
+    return rollup
+
+
+def salesLimit(params, default=10):
+    try:
+        limit = int(params.get('limit', default))
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    if not 1 <= limit <= MAX_LIMIT:
+        raise ValueError('limit must be between 1 and %d' % MAX_LIMIT)
+    return limit
+
+
+# Orders, revenue and units per day
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def getDailySales(request):
+    try:
+        try:
+            days = salesRange(DailySales.objects.all(), request.query_params)
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(list(days.order_by('day').values(*DAILY_FIELDS)))
+    except:
+        return Response('Unexpected error')
+
+
+# Best selling products by units
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def getProductSales(request):
+    try:
+        try:
+            rows = salesRange(ProductSales.objects.all(), request.query_params)
+            limit = salesLimit(request.query_params)
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        products = (rows.values('product', 'product__name')
+                        .annotate(units=Sum('units'), revenue=Sum('revenue'))
+                        .order_by('-units', '-revenue', 'product')[:limit])
+        return Response([
+            {'product': row['product'], 'name': row['product__name'],
+             'units': row['units'], 'revenue': cents(row['revenue'])}
+            for row in products
+        ])
+    except:
+        return Response('Unexpected error')
+
+
+# Categories by revenue
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def getCategorySales(request):
+    try:
+        try:
+            rows = salesRange(ProductSales.objects.all(), request.query_params)
+            limit = salesLimit(request.query_params)
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        categories = (rows.values('product__category', 'product__category__name')
+                          .annotate(units=Sum('units'), revenue=Sum('revenue'))
+                          .order_by('-revenue', '-units', 'product__category')[:limit])
+        return Response([
+            {'category': row['product__category__name'], 'units': row['units'], 'revenue': cents(row['revenue'])}
+            for row in categories
+        ])
+    except:
+        return Response('Unexpected error')
+
+
+# Placed -> paid -> delivered, over the orders placed in the range
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def getSalesFunnel(request):
+    try:
+        try:
+            days = salesRange(DailySales.objects.all(), request.query_params)
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        totals = days.aggregate(**{name: Sum(name) for name in DAILY_FIELDS[1:]})
+        totals = {name: value or 0 for name, value in totals.items()}
+        totals['revenue'], totals['paidRevenue'] = cents(totals['revenue']), cents(totals['paidRevenue'])
+        orders = totals['orders']
+        totals['paidRate'] = round(totals['paidOrders'] / orders, 4) if orders else 0
+        totals['deliveredRate'] = round(totals['deliveredOrders'] / orders, 4) if orders else 0
+        return Response(totals)
+    except:
+        return Response('Unexpected error')
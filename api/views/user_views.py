@@ -1,5 +1,6 @@
 from django.shortcuts import render
 import re
+import string
 
 # rest-framework
 from rest_framework.decorators import api_view, permission_classes
@@ -9,8 +10,15 @@ from rest_framework import status
 
 # User model & serializers
 from django.contrib.auth.models import User
+from django.db import connections
+from django.db.models import Q
+from django.db.models.functions import Lower
 from api.serializers import UserSerializer, UserSerializerWithToken
 
+# pagination
+from operator import itemgetter
+from api.pagination import InvalidCursor, cached_count, get_page_size, paginate
+
 # rest-framework-simplejwt
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from rest_framework_simplejwt.views import TokenObtainPairView
@@ -30,7 +38,7 @@ class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
     def validate(self, attrs):
         data = super().validate(attrs)
 
-        serializer = UserSerializerWithToken(self.user).data
+        serializer = UserSerializerWithToken(self.user, context={'access': data['access']}).data
         for k, v in serializer.items():
             data[k] = v
 
@@ -97,10 +105,10 @@ def getUserProfile(request):
     except:
         return Response('Unexpected error')
 
-# Update User Profile
+# Update User Profile, leave the password out to keep it
 @swagger_auto_schema(method='put', request_body=openapi.Schema(
     type=openapi.TYPE_OBJECT,
-    required=['username', 'email', 'first-name', 'last-name', 'password'],
+    required=['first-name', 'last-name'],
     properties={
         'username': openapi.Schema(type=openapi.TYPE_STRING),
         'email': openapi.Schema(type=openapi.TYPE_STRING, format=openapi.FORMAT_EMAIL),
@@ -119,10 +127,13 @@ def updateUserProfile(request):
         data = request.data
 
         # التحقق من صحة كلمة المرور وتحديثها
-        if not re.match(r'^(?=.*[a-zA-Z])(?=.*\d).{8,}$', data['password']):
-            return Response({'error': 'Password must contain both letters and numbers and be at least 8 characters long'},
-             status=status.HTTP_400_BAD_REQUEST)
-        user.password = make_password(data['password'])
+        # Hashing is the expensive part of the request, only do it for a new password
+        password = data.get('password')
+        if password:
+            if not re.match(r'^(?=.*[a-zA-Z])(?=.*\d).{8,}$', password):
+                return Response({'error': 'Password must contain both letters and numbers and be at least 8 characters long'},
+                 status=status.HTTP_400_BAD_REQUEST)
+            user.password = make_password(password)
 
         # تحديث الاسم الأول والاسم الأخير
         user.first_name = data['first-name']
@@ -146,6 +157,8 @@ def updateUserProfile(request):
             pass  # إذا لم يتم تقديم 'email' في البيانات
 
         user.save()
+        # The orders show their user's name and email
+        user.order_set.touch()
         return Response(serializer.data)
 
     except:
@@ -154,17 +167,63 @@ def updateUserProfile(request):
 
 
 
+# The plain listing stops here; larger user tables page with ?cursor=
+MAX_USERS = 1000
+
+
+# Get All Users, ?q=<username or email prefix>; ?cursor= pages them newest first
 @api_view(['GET'])
 @permission_classes([IsAdminUser])
 def getUsers(request):
     try:
-        users = User.objects.all()
-        serializer = UserSerializer(users, many=True)
-        return Response(serializer.data)
+        params = request.query_params
+        query = (params.get('q') or '').strip()
+        users = searchUsers(User.objects.all(), query)
+
+        # Rows go straight from tuples to the payload, no User objects; one
+        # row past the cap tells whether the listing was cut
+        if 'cursor' not in params:
+            rows = list(users.order_by('id').values_list(*UserSerializer.VALUES)[:MAX_USERS + 1])
+            response = Response(UserSerializer.from_values(rows[:MAX_USERS]))
+            if len(rows) > MAX_USERS:
+                response['X-Truncated'] = 'true'
+            return response
+
+        try:
+            rows, next_cursor, prev_cursor = paginate(
+                users.values_list(*UserSerializer.VALUES, 'date_joined'), params.get('cursor'),
+                get_page_size(params.get('page_size')), field='date_joined', key=itemgetter(-1, 0),
+            )
+        except InvalidCursor as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        content = {'users': UserSerializer.from_values(rows), 'next': next_cursor, 'prev': prev_cursor}
+        if params.get('count') in ('1', 'true'):
+            content['count'] = cached_count(users, 'users:%s' % query.lower())
+        return Response(content)
 
     except:
         return Response('Unexpected error')
 
+
+ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+def searchUsers(users, query):
+    # Prefixes of lower(username) and lower(email), on the indexes of migration 0011
+    if not query:
+        return users
+    users = users.alias(username_lower=Lower('username'), email_lower=Lower('email'))
+    if connections[users.db].vendor != 'sqlite':
+        return users.filter(Q(username_lower__startswith=query.lower()) | Q(email_lower__startswith=query.lower()))
+    # SQLite's lower() folds ASCII only, so the query is folded the same way;
+    # LIKE never reaches an expression index there, but its byte order makes
+    # the equivalent range exact
+    query = query.translate(ASCII_LOWER)
+    end = query + '\U0010ffff'
+    return users.filter(Q(username_lower__gte=query, username_lower__lt=end) |
+                        Q(email_lower__gte=query, email_lower__lt=end))
+
 # Get User by id for Admin
 @api_view(['GET'])
 @permission_classes([IsAdminUser])
@@ -214,6 +273,7 @@ def updateUser(request, pk):
             user.email = data['email']
 
         user.save()
+        user.order_set.touch()
 
         serializer = UserSerializer(user, many=False)
         return Response(serializer.data)
@@ -227,6 +287,7 @@ def updateUser(request, pk):
 def deleteUser(request, pk):
     try:
         user = User.objects.get(pk=pk)
+        user.order_set.touch()
         user.delete()
         return Response('User was deleted successfully')
 
@@ -5,6 +5,23 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
+
+ASGI deployment
+---------------
+Serve with uvicorn, one event loop per worker process:
+
+    uvicorn base.asgi:application --host 0.0.0.0 --port 8000 --workers 4
+
+The async read endpoints under /api/async/ (api/views/async_views.py) then
+run on the event loop, so a worker keeps serving other requests while one
+waits on the database. The @api_view endpoints keep working; Django runs
+them in a thread pool.
+
+- Keep CONN_MAX_AGE at 0: async views open and close a connection per
+  request, use a pooler (PgBouncer) in front of Postgres instead.
+- Use a shared CACHE_BACKEND (file or redis) with several workers.
+- `python -m benchmarks.asgi` compares this profile with gunicorn sync
+  workers on the same machine.
 """
 
 import os
@@ -67,8 +67,18 @@ SWAGGER_SETTINGS = {
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
-    )
+        'api.authentication.CachedJWTAuthentication',
+    ),
+    # orjson-backed JSON, see api/renderers.py
+    'DEFAULT_RENDERER_CLASSES': (
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'api.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
 }
 
 
@@ -100,6 +110,8 @@ SIMPLE_JWT = {
 }
 
 MIDDLEWARE = [
+    'api.middleware.PerformanceMiddleware',
+    'api.middleware.ReplicaMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
 
@@ -138,13 +150,143 @@ WSGI_APPLICATION = 'base.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
-DATABASES = {
+# DATABASE_BACKEND=postgresql serves from PostgreSQL (DATABASE_NAME, _USER,
+# _PASSWORD, _HOST, _PORT), with the comma separated host[:port] list
+# DATABASE_REPLICAS as read replicas (see api/routers.py). Each process
+# pools up to DATABASE_POOL_SIZE connections per database (psycopg_pool),
+# handed back after each request, so a deployment opens at most workers x
+# DATABASE_POOL_SIZE; DATABASE_POOL_SIZE=0 keeps one persistent connection
+# per thread for DATABASE_CONN_MAX_AGE seconds instead.
+DATABASE_BACKEND = os.environ.get('DATABASE_BACKEND', 'sqlite')
+
+if DATABASE_BACKEND == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DATABASE_NAME', 'hardware_market'),
+            'USER': os.environ.get('DATABASE_USER', 'postgres'),
+            'PASSWORD': os.environ.get('DATABASE_PASSWORD', ''),
+            'HOST': os.environ.get('DATABASE_HOST', '127.0.0.1'),
+            'PORT': os.environ.get('DATABASE_PORT', '5432'),
+            'CONN_MAX_AGE': int(os.environ.get('DATABASE_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
+    }
+    DATABASE_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE', 10))
+    if DATABASE_POOL_SIZE:
+        # Django refuses persistent connections next to a pool
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': 1, 'max_size': DATABASE_POOL_SIZE,
+            # seconds a request waits for a free connection before failing
+            'timeout': int(os.environ.get('DATABASE_POOL_TIMEOUT', 10)),
+        }
+
+    for i, replica in enumerate(filter(None, os.environ.get('DATABASE_REPLICAS', '').split(',')), 1):
+        host, _, port = replica.strip().partition(':')
+        DATABASES['replica%d' % i] = dict(
+            DATABASES['default'], HOST=host, PORT=port or DATABASES['default']['PORT'],
+            OPTIONS=dict(DATABASES['default']['OPTIONS']), TEST={'MIRROR': 'default'},
+        )
+else:
+    # Readers no longer wait for writers with WAL; writers take the lock up
+    # front and queue for it instead of failing half-way. WAL is written
+    # into the database file itself, so it is opt-in (DATABASE_WAL=true)
+    # and the committed db.sqlite3 stays as it is in a checkout.
+    SQLITE_PRAGMAS = 'PRAGMA synchronous=NORMAL; PRAGMA temp_store=MEMORY; PRAGMA mmap_size=134217728; ' \
+                     'PRAGMA cache_size=-20000'
+    if os.environ.get('DATABASE_WAL', 'false').lower() == 'true':
+        SQLITE_PRAGMAS = 'PRAGMA journal_mode=WAL; ' + SQLITE_PRAGMAS
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {
+                'init_command': SQLITE_PRAGMAS,
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': 20,
+            },
+        }
+    }
+
+DATABASE_ROUTERS = ['api.routers.ReplicaRouter']
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+# Seconds a client reads from the primary after writing
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', 5))
+
+
+# Cache
+# CACHE_BACKEND selects locmem (default, per process), file or redis.
+# Use file or redis with several workers so they share one catalog version.
+
+CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+}
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'locmem')
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND],
+        'LOCATION': os.environ.get('CACHE_LOCATION', {
+            'locmem': 'hardware-market',
+            'file': os.path.join(BASE_DIR, '.cache'),
+            'redis': 'redis://127.0.0.1:6379/1',
+        }[CACHE_BACKEND]),
+        'OPTIONS': {'MAX_ENTRIES': 10000} if CACHE_BACKEND != 'redis' else {},
     }
 }
 
+# Seconds a cached catalog payload lives, and how long other workers wait
+# for the one rebuilding a cold key
+CATALOG_CACHE_TIMEOUT = int(os.environ.get('CATALOG_CACHE_TIMEOUT', 300))
+CATALOG_CACHE_LOCK_TIMEOUT = 5
+
+# How many products each top-products leaderboard keeps (the largest ?n= served)
+TOP_PRODUCTS_CAPACITY = 50
+
+# Token users are cached per process for this many seconds (0 disables),
+# at most AUTH_USER_CACHE_SIZE of them; see api/authentication.py
+AUTH_USER_CACHE_TIMEOUT = int(os.environ.get('AUTH_USER_CACHE_TIMEOUT', 60))
+AUTH_USER_CACHE_SIZE = 10000
+
+# Background jobs (api/jobs.py), like rendering image variants, are run by
+# `manage.py runworker` on JOBS_WORKERS threads per process. JOBS_EAGER=true
+# runs them in the web process as their transaction commits instead.
+JOBS_EAGER = os.environ.get('JOBS_EAGER', 'false').lower() == 'true'
+JOBS_WORKERS = int(os.environ.get('JOBS_WORKERS', 2))
+JOBS_MAX_ATTEMPTS = 5
+# seconds before the first retry, doubled for each further one
+JOBS_RETRY_DELAY = 10
+JOBS_POLL_INTERVAL = 1
+# a job running for longer is taken for lost with its worker and retried
+JOBS_TIMEOUT = 600
+JOBS_KEEP_SECONDS = 7 * 24 * 3600
+
+# Server-Timing headers and the per-route histograms behind /api/metrics/;
+# set PERFORMANCE_METRICS=false to take the instrumentation out entirely
+PERFORMANCE_METRICS = os.environ.get('PERFORMANCE_METRICS', 'true').lower() == 'true'
+
+
+# Passwords are hashed on PASSWORD_HASHING_WORKERS threads at most (see
+# api/hashers.py). The bound is per process: by default each of the
+# WEB_CONCURRENCY server processes (gunicorn's and uvicorn's worker count)
+# gets an equal share of the cores, so a deployment never hashes on more
+# threads than there are cores. PASSWORD_HASH_ITERATIONS sets the PBKDF2
+# work factor of new hashes, Django's default when unset; lower it only
+# knowingly.
+PASSWORD_HASHERS = [
+    'api.hashers.PooledPBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+PASSWORD_HASHING_WORKERS = int(os.environ.get('PASSWORD_HASHING_WORKERS') or max(
+    1, (os.cpu_count() or 1) // int(os.environ.get('WEB_CONCURRENCY') or 1)))
+PASSWORD_HASH_ITERATIONS = int(os.environ.get('PASSWORD_HASH_ITERATIONS', 0)) or None
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -42,6 +42,10 @@ urlpatterns = [
                             name='swagger-schema'),
     path('api/users/', include('api.urls.user_urls')),
     path('api/products/', include('api.urls.product_urls')),
-    path('api/orders/', include('api.urls.order_urls'))
+    path('api/orders/', include('api.urls.order_urls')),
+    path('api/async/', include('api.urls.async_urls')),
+    path('api/metrics/', include('api.urls.metrics_urls')),
+    path('api/sales/', include('api.urls.sales_urls')),
+    path('api/jobs/', include('api.urls.job_urls')),
 
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
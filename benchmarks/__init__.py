@@ -0,0 +1,7 @@
+"""
+Benchmarks for the hardware market API.
+
+Each module is runnable with ``python -m benchmarks.<name> --help`` from the
+repository root. They build a throwaway database of their own and never
+touch ``db.sqlite3``.
+"""
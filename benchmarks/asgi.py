@@ -0,0 +1,158 @@
+"""
+WSGI vs ASGI read benchmark.
+
+Serves the same scratch catalog twice on this machine, first with gunicorn
+sync workers (the @api_view endpoints under /api/), then with uvicorn (the
+async endpoints under /api/async/), and fires the same mix of catalog and
+order reads at each with many concurrent connections:
+
+    python -m benchmarks.asgi --workers 4 --concurrency 256 --requests 5000
+
+By default the catalog cache is off so every request reaches the database;
+pass --cache to measure the cached path instead.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+from benchmarks.utils import HOST, benchmark_database, serve, setup_django, summarize
+
+
+# profile -> (server, prefix of the endpoints it is measured on)
+PROFILES = {
+    'wsgi': ('gunicorn', '/api/'),
+    'asgi': ('uvicorn', '/api/async/'),
+}
+
+
+def seed(products, orders):
+    from django.contrib.auth.models import User
+    from rest_framework_simplejwt.tokens import RefreshToken
+
+    from api import leaderboard
+    from api.categories import get_or_create_category, recount
+    from api.models import Order, OrderItem, Product, ShippingAddress
+
+    user = User.objects.create(username='bench')
+    categories = [get_or_create_category(name) for name in ('GPU', 'CPU', 'Monitor', 'Laptop')]
+    rng = random.Random(1)
+    Product.objects.bulk_create([
+        Product(name='Product %d' % i, category=categories[i % len(categories)], price=100,
+                description='Benchmark product %d' % i, rating=rng.choice([3, 4, 4.5, 5]),
+                numOfReviews=rng.randint(0, 50), countInStock=10)
+        for i in range(products)
+    ])
+    ids = list(Product.objects.values_list('id', flat=True))
+    recount()
+    leaderboard.rebuild_all()
+
+    created = Order.objects.bulk_create([Order(user=user, totalPrice=100) for _ in range(orders)])
+    ShippingAddress.objects.bulk_create([
+        ShippingAddress(order=order, address='Street', city='Cairo', postalCode='1', country='EG')
+        for order in created
+    ])
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, product_id=rng.choice(ids), name='Product', qty=1, price=100)
+        for order in created
+    ])
+    return ids, [order.id for order in created], str(RefreshToken.for_user(user).access_token)
+
+
+def request_mix(product_ids, order_ids, token):
+    """(path, needs_auth) for the endpoints both profiles serve, weighted like a shop's traffic."""
+    return [
+        ('products/', False), ('products/', False), ('products/?page=2', False),
+        ('products/?cursor=', False), ('products/?q=product', False),
+        ('products/top/', False), ('products/category/gpu/', False),
+        ('products/%d/' % random.choice(product_ids), False), ('products/%d/' % random.choice(product_ids), False),
+        ('orders/myorders/', True), ('orders/%d/' % random.choice(order_ids), True),
+    ]
+
+
+async def fetch(port, path, token):
+    headers = 'GET %s HTTP/1.1\r\nHost: %s\r\nConnection: close\r\n' % (path, HOST)
+    if token:
+        headers += 'Authorization: Bearer %s\r\n' % token
+    reader, writer = await asyncio.open_connection(HOST, port)
+    try:
+        writer.write((headers + '\r\n').encode())
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+    return int(response.split(b' ', 2)[1])
+
+
+async def load(port, prefix, mix, token, total, concurrency):
+    latencies, errors = [], 0
+    remaining = iter(range(total))
+
+    async def client():
+        nonlocal errors
+        for _ in remaining:
+            path, auth = random.choice(mix)
+            started = time.perf_counter()
+            try:
+                status = await fetch(port, prefix + path, token if auth else None)
+            except OSError:
+                status = None
+            latencies.append(time.perf_counter() - started)
+            if status != 200:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - started
+
+
+def run_profile(name, args, mix, token):
+    server, prefix = PROFILES[name]
+    try:
+        with serve(server, workers=args.workers, cache=args.cache) as port:
+            # warm up the workers before measuring
+            asyncio.run(load(port, prefix, mix, token, args.workers * 20, args.workers))
+            latencies, errors, elapsed = asyncio.run(load(port, prefix, mix, token, args.requests, args.concurrency))
+    except FileNotFoundError:
+        return {'skipped': '%s is not installed' % server}
+
+    return {
+        'server': server,
+        'requests': args.requests,
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'requests_per_second': round(args.requests / elapsed, 1),
+        'latency': summarize(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--concurrency', type=int, default=256)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--products', type=int, default=2000)
+    parser.add_argument('--orders', type=int, default=200)
+    parser.add_argument('--cache', action='store_true', help='keep the catalog cache on')
+    parser.add_argument('--profiles', nargs='+', choices=sorted(PROFILES), default=['wsgi', 'asgi'])
+    args = parser.parse_args()
+
+    setup_django()
+    with benchmark_database():
+        product_ids, order_ids, token = seed(args.products, args.orders)
+        mix = request_mix(product_ids, order_ids, token)
+        results = {name: run_profile(name, args, mix, token) for name in args.profiles}
+
+    report = {'workers': args.workers, 'concurrency': args.concurrency, 'cache': args.cache, **results}
+    if all('requests_per_second' in results.get(name, {}) for name in ('wsgi', 'asgi')):
+        report['asgi_speedup'] = round(results['asgi']['requests_per_second'] / results['wsgi']['requests_per_second'], 2)
+    print(json.dumps(report, indent=2))
+    if any(result.get('errors') for result in results.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
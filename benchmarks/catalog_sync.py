@@ -0,0 +1,83 @@
+"""
+Nightly catalog sync benchmark.
+
+Seeds a scratch catalog, then pushes a price and stock change for every
+product through the bulk import endpoint, and for a sample of them through
+one updateProduct call each, the only way before:
+
+    python -m benchmarks.catalog_sync --products 50000 --sample 200
+"""
+import argparse
+import json
+import random
+import time
+from io import StringIO
+
+from benchmarks.utils import benchmark_database, setup_django
+
+
+def run(products, sample, output):
+    from django.contrib.auth.models import User
+    from django.core.management import call_command
+    from django.urls import reverse
+    from rest_framework.test import APIClient
+
+    from api.models import Product
+
+    call_command('seed', users=10, products=products, reviews=0, orders=0, stdout=StringIO())
+    admin = User.objects.create(username='erp', is_staff=True)
+    client = APIClient()
+    client.force_authenticate(admin)
+
+    rows = list(Product.objects.values_list('id', 'name', 'description', 'category__name'))
+    random.seed(1)
+    changes = [(pk, '%.2f' % random.uniform(1, 2000), random.randint(0, 100)) for pk, *_ in rows]
+    if output == 'csv':
+        body = 'id,price,countInStock\n' + ''.join('%d,%s,%d\n' % change for change in changes)
+        content_type = 'text/csv'
+    else:
+        body = ''.join(json.dumps({'id': pk, 'price': price, 'countInStock': stock}) + '\n'
+                       for pk, price, stock in changes)
+        content_type = 'application/x-ndjson'
+
+    started = time.perf_counter()
+    report = client.post(reverse('products-import'), body, content_type=content_type).data
+    bulk = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for (pk, name, description, category), (_, price, stock) in zip(rows[:sample], changes):
+        client.put(reverse('product-update', args=[pk]), {
+            'name': name, 'description': description or '', 'category': category or '',
+            'price': price, 'count-in-stock': stock})
+    single = (time.perf_counter() - started) / sample
+
+    return {
+        'products': len(rows),
+        'format': output,
+        'updated': report['updated'],
+        'failed': report['failed'],
+        'import_seconds': round(bulk, 2),
+        'import_rows_per_second': round(len(rows) / bulk),
+        'update_product_ms': round(single * 1000, 2),
+        'update_product_estimated_seconds': round(single * len(rows), 1),
+        'speedup': round(single * len(rows) / bulk, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=50000)
+    parser.add_argument('--sample', type=int, default=200, help='updateProduct calls to time')
+    parser.add_argument('--type', choices=['csv', 'ndjson'], default='csv')
+    args = parser.parse_args()
+
+    setup_django()
+    with benchmark_database():
+        result = run(args.products, args.sample, args.type)
+    print(json.dumps(result, indent=2))
+    if result['failed']:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
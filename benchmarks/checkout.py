@@ -0,0 +1,111 @@
+"""
+Concurrent checkout benchmark.
+
+Fires parallel addOrderItems requests at a single SKU with limited stock and
+checks that every unit is sold at most once:
+
+    python -m benchmarks.checkout --threads 16 --checkouts 400 --stock 250
+"""
+import argparse
+import json
+import logging
+import threading
+import time
+
+from benchmarks.utils import benchmark_database, setup_django, summarize
+
+
+def run(threads, checkouts, stock, qty):
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from django.urls import reverse
+    from rest_framework.test import APIClient
+
+    from api.models import Order, OrderItem, Product
+
+    user = User.objects.create(username='bench')
+    product = Product.objects.create(name='Hot SKU', price=100, countInStock=stock)
+    payload = {
+        'paymentMethod': 'PayPal', 'taxPrice': 0, 'shippingPrice': 0, 'totalPrice': 100 * qty,
+        'shippingAddress': {'address': 'Street', 'city': 'Cairo', 'postalCode': '1', 'country': 'EG'},
+        'orderItems': [{'product': product.id, 'qty': qty, 'price': 100}],
+    }
+    url = reverse('orders-add')
+
+    results = {'ok': 0, 'out_of_stock': 0, 'error': 0}
+    latencies = []
+    lock = threading.Lock()
+    remaining = iter(range(checkouts))
+
+    def worker():
+        client = APIClient()
+        client.force_authenticate(user)
+        try:
+            while True:
+                with lock:
+                    if next(remaining, None) is None:
+                        return
+                started = time.perf_counter()
+                response = client.post(url, payload, format='json')
+                elapsed = time.perf_counter() - started
+
+                if response.status_code == 200 and isinstance(response.data, dict):
+                    outcome = 'ok'
+                elif response.status_code == 400 and 'out of stock' in str(response.data):
+                    outcome = 'out_of_stock'
+                else:
+                    outcome = 'error'
+                with lock:
+                    results[outcome] += 1
+                    latencies.append(elapsed)
+        finally:
+            connection.close()
+
+    started = time.perf_counter()
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    product.refresh_from_db()
+    sold = sum(OrderItem.objects.filter(product=product).values_list('qty', flat=True))
+    return {
+        'vendor': connection.vendor,
+        'threads': threads,
+        'checkouts': checkouts,
+        'initial_stock': stock,
+        'final_stock': product.countInStock,
+        'units_sold': sold,
+        'orders': Order.objects.count(),
+        'oversold': product.countInStock < 0 or sold != stock - product.countInStock,
+        **results,
+        'seconds': round(elapsed, 3),
+        'orders_per_second': round(results['ok'] / elapsed, 1),
+        'requests_per_second': round(checkouts / elapsed, 1),
+        'latency': summarize(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--checkouts', type=int, default=400)
+    parser.add_argument('--stock', type=int, default=250)
+    parser.add_argument('--qty', type=int, default=1)
+    args = parser.parse_args()
+
+    setup_django()
+    # rejected checkouts are expected, keep the 400 warnings out of the report
+    logging.getLogger('django.request').setLevel(logging.ERROR)
+    with benchmark_database():
+        result = run(args.threads, args.checkouts, args.stock, args.qty)
+
+    print(json.dumps(result, indent=2))
+    if result['oversold'] or result['error']:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,608 @@
+"""
+HTTP load test of every API route.
+
+Seeds a scratch database, serves it with runserver, gunicorn or uvicorn,
+and drives it with concurrent virtual users following weighted scenario
+mixes:
+
+    browse    anonymous catalog reads (sync and async endpoints)
+    checkout  signed-in shoppers: login, register, checkout, pay, review
+    admin     staff: users, orders, exports and imports, product writes,
+              sales analytics, the job queue
+
+For every endpoint it reports p50/p95/p99 latency, throughput, errors and
+queries per request (from the X-Query-Count header benchmarks.middleware
+adds, or its query log for streamed responses). Results are JSON; pass a
+previous run as --baseline to flag regressions (exit status 1):
+
+    python -m benchmarks.loadtest --server gunicorn --workers 4 --output run.json
+    python -m benchmarks.loadtest --server gunicorn --workers 4 --baseline run.json
+
+Uses the configured DATABASES engine, so a local Postgres works as well as
+SQLite.
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from importlib import import_module
+
+from benchmarks.utils import HOST, SERVERS, benchmark_database, serve, setup_django, summarize
+
+
+PASSWORD = 'bench-pass-123'
+URL_MODULES = ['api.urls.user_urls', 'api.urls.product_urls', 'api.urls.order_urls', 'api.urls.async_urls',
+               'api.urls.metrics_urls', 'api.urls.sales_urls', 'api.urls.job_urls']
+# products an import request updates
+IMPORT_ROWS = 50
+
+
+class World:
+    """Ids and accounts of the seeded data, shared by every virtual user."""
+
+    def __init__(self, product_ids, category_slugs, shoppers, admins, spare_user_ids):
+        self.product_ids = product_ids
+        self.category_slugs = category_slugs
+        self.shoppers = shoppers
+        self.admins = admins
+        self.spare_user_ids = spare_user_ids
+        self.order_ids = []
+        self.lock = threading.Lock()
+        self.sequence = itertools.count()
+
+    def next_number(self):
+        return next(self.sequence)
+
+    def pop_spare_user(self):
+        with self.lock:
+            return self.spare_user_ids.pop() if self.spare_user_ids else None
+
+    def add_order(self, order_id):
+        with self.lock:
+            self.order_ids.append(order_id)
+
+    def any_order(self, rng):
+        with self.lock:
+            return rng.choice(self.order_ids) if self.order_ids else None
+
+
+def seed(products, shoppers, admins, spare_users):
+    from django.contrib.auth.hashers import make_password
+    from django.contrib.auth.models import User
+
+    from api import leaderboard, search
+    from api.categories import get_or_create_category, recount
+    from api.models import Product
+
+    rng = random.Random(1)
+    names = ['GPU', 'CPU', 'Monitor', 'Laptop', 'Keyboard', 'Mouse', 'Storage', 'Memory']
+    categories = [get_or_create_category(name) for name in names]
+    Product.objects.bulk_create([
+        Product(name='%s model %d' % (categories[i % len(categories)].name, i),
+                category=categories[i % len(categories)], price=rng.randint(20, 2000),
+                description='Load test product %d' % i, rating=rng.choice([0, 3, 3.5, 4, 4.5, 5]),
+                numOfReviews=rng.randint(0, 200), countInStock=10 ** 6)
+        for i in range(products)
+    ], batch_size=500)
+    recount()
+    leaderboard.rebuild_all()
+    search.rebuild_index()
+
+    # Hashing is the slow part of creating users, every account shares one
+    password = make_password(PASSWORD)
+    User.objects.bulk_create(
+        [User(username='shopper%d' % i, email='shopper%d@example.com' % i, password=password) for i in range(shoppers)]
+        + [User(username='admin%d' % i, email='admin%d@example.com' % i, password=password, is_staff=True)
+           for i in range(admins)]
+        + [User(username='spare%d' % i, email='spare%d@example.com' % i, password=password) for i in range(spare_users)],
+        batch_size=500)
+
+    return World(
+        product_ids=list(Product.objects.values_list('id', flat=True)),
+        category_slugs=[category.slug for category in categories],
+        shoppers=['shopper%d' % i for i in range(shoppers)],
+        admins=['admin%d' % i for i in range(admins)],
+        spare_user_ids=list(User.objects.filter(username__startswith='spare').values_list('id', flat=True)),
+    )
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    def record(self, name, elapsed, ok, queries, request_id):
+        self.samples[name].append((elapsed, ok, queries, request_id))
+
+    def merge(self, other):
+        for name, samples in other.samples.items():
+            self.samples[name].extend(samples)
+
+    def report(self, seconds, logged_queries):
+        """`logged_queries` maps request ids to the counts of streamed responses."""
+        endpoints = {}
+        for name, samples in sorted(self.samples.items()):
+            latencies = [s[0] for s in samples]
+            queries = [s[2] if s[2] is not None else logged_queries.get(s[3]) for s in samples]
+            queries = [count for count in queries if count is not None]
+            endpoints[name] = {
+                'requests': len(samples),
+                'errors': sum(1 for s in samples if not s[1]),
+                'requests_per_second': round(len(samples) / seconds, 2),
+                **summarize(latencies),
+                'queries_mean': round(sum(queries) / len(queries), 2) if queries else None,
+                'queries_max': max(queries) if queries else None,
+            }
+        total = sum(e['requests'] for e in endpoints.values())
+        return {
+            'requests': total,
+            'errors': sum(e['errors'] for e in endpoints.values()),
+            'seconds': round(seconds, 3),
+            'requests_per_second': round(total / seconds, 1),
+            'latency': summarize([s[0] for samples in self.samples.values() for s in samples]),
+            'endpoints': endpoints,
+        }
+
+
+class VirtualUser:
+    def __init__(self, port, world, username=None, seed=None):
+        self.world = world
+        self.username = username
+        self.connection = http.client.HTTPConnection(HOST, port, timeout=60)
+        self.recorder = Recorder()
+        self.token = None
+        self.rng = random.Random(seed)
+        self.my_orders = []
+        self.reviewed = set()
+
+    def request(self, name, method, path, body=None, content_type='application/json'):
+        """Send `body` JSON encoded, or as is if it is a str of `content_type`."""
+        request_id = uuid.uuid4().hex
+        headers = {'Content-Type': content_type, 'X-Request-Id': request_id}
+        if self.token:
+            headers['Authorization'] = 'Bearer %s' % self.token
+        payload = body
+        if body is not None and not isinstance(body, str):
+            payload = json.dumps(body)
+
+        started = time.perf_counter()
+        try:
+            self.connection.request(method, path, payload, headers)
+            response = self.connection.getresponse()
+            content = response.read()
+            status, queries = response.status, response.getheader('X-Query-Count')
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            content, status, queries = b'', None, None
+        elapsed = time.perf_counter() - started
+
+        data = None
+        if content and '/export/' not in path:
+            try:
+                data = json.loads(content)
+            except ValueError:
+                pass
+        # The views answer 200 "Unexpected error" when they fail
+        ok = status is not None and status < 400 and data != 'Unexpected error'
+        self.recorder.record(name, elapsed, ok, int(queries) if queries is not None else None, request_id)
+        return data if ok else None
+
+    def login(self):
+        data = self.request('token_obtain_pair', 'POST', '/api/users/login/',
+                            {'username': self.username, 'password': PASSWORD})
+        self.token = data and data.get('access')
+
+    def product(self):
+        return self.rng.choice(self.world.product_ids)
+
+
+def routes(*names):
+    """Declare the routes a scenario step requests, for the coverage check."""
+    def decorate(step):
+        step.routes = names
+        return step
+    return decorate
+
+
+# Browse
+
+@routes('products')
+def browse_products(user):
+    user.request('products', 'GET', '/api/products/?page=%d' % user.rng.randint(1, 5))
+
+
+@routes('products')
+def browse_search(user):
+    term = user.rng.choice(['gpu', 'monitor', 'model', 'lap', 'key', 'storage 1'])
+    user.request('products', 'GET', '/api/products/?q=%s' % term.replace(' ', '+'))
+
+
+@routes('products')
+def browse_cursor(user):
+    data = user.request('products', 'GET', '/api/products/?cursor=&page_size=12&count=true')
+    if data and data.get('next'):
+        user.request('products', 'GET', '/api/products/?cursor=%s&page_size=12' % data['next'])
+
+
+@routes('top-products')
+def browse_top(user):
+    user.request('top-products', 'GET', '/api/products/top/?n=10')
+
+
+@routes('top-products')
+def browse_top_category(user):
+    user.request('top-products', 'GET', '/api/products/top/?category=%s' % user.rng.choice(user.world.category_slugs))
+
+
+@routes('product')
+def browse_product(user):
+    user.request('product', 'GET', '/api/products/%d/' % user.product())
+
+
+@routes('product-category')
+def browse_category(user):
+    user.request('product-category', 'GET', '/api/products/category/%s/' % user.rng.choice(user.world.category_slugs))
+
+
+@routes('product-categories')
+def browse_categories(user):
+    user.request('product-categories', 'GET', '/api/products/categories/')
+
+
+@routes('async-products', 'async-top-products', 'async-product', 'async-product-category')
+def browse_async(user):
+    name, path = user.rng.choice([
+        ('async-products', '/api/async/products/?page=2'),
+        ('async-top-products', '/api/async/products/top/'),
+        ('async-product', '/api/async/products/%d/' % user.product()),
+        ('async-product-category', '/api/async/products/category/%s/' % user.rng.choice(user.world.category_slugs)),
+    ])
+    user.request(name, 'GET', path)
+
+
+# Checkout
+
+@routes('orders-add', 'pay')
+def checkout(user):
+    items = [{'product': pid, 'qty': user.rng.randint(1, 2), 'price': 100}
+             for pid in user.rng.sample(user.world.product_ids, user.rng.randint(1, 3))]
+    data = user.request('orders-add', 'POST', '/api/orders/add/', {
+        'paymentMethod': 'PayPal', 'taxPrice': 0, 'shippingPrice': 0, 'totalPrice': 100,
+        'shippingAddress': {'address': 'Street 1', 'city': 'Cairo', 'postalCode': '11511', 'country': 'EG'},
+        'orderItems': items,
+    })
+    if data and data.get('id'):
+        user.my_orders.append(data['id'])
+        user.world.add_order(data['id'])
+        user.request('pay', 'PUT', '/api/orders/%d/pay/' % data['id'])
+
+
+@routes('myorders', 'async-myorders')
+def my_orders(user):
+    user.request('myorders', 'GET', '/api/orders/myorders/')
+    user.request('async-myorders', 'GET', '/api/async/orders/myorders/')
+
+
+@routes('user-order', 'async-user-order')
+def my_order(user):
+    if user.my_orders:
+        order_id = user.rng.choice(user.my_orders)
+        user.request('user-order', 'GET', '/api/orders/%d/' % order_id)
+        user.request('async-user-order', 'GET', '/api/async/orders/%d/' % order_id)
+
+
+@routes('create-review')
+def review(user):
+    product_id = user.product()
+    if product_id not in user.reviewed:
+        user.reviewed.add(product_id)
+        user.request('create-review', 'POST', '/api/products/%d/reviews/' % product_id,
+                     {'rating': user.rng.randint(1, 5), 'comment': 'Load test review'})
+
+
+@routes('user-profile')
+def profile(user):
+    user.request('user-profile', 'GET', '/api/users/profile/')
+
+
+@routes('user-profile-update')
+def update_profile(user):
+    user.request('user-profile-update', 'PUT', '/api/users/profile/update/', {
+        'username': user.username, 'email': '%s@example.com' % user.username,
+        'first-name': 'Load', 'last-name': 'Test', 'password': PASSWORD})
+
+
+@routes('token_obtain_pair')
+def login(user):
+    user.login()
+
+
+@routes('register')
+def register(user):
+    n = user.world.next_number()
+    user.request('register', 'POST', '/api/users/register/', {
+        'username': 'new%d_%d' % (os.getpid(), n), 'email': 'new%d_%d@example.com' % (os.getpid(), n),
+        'first-name': 'New', 'last-name': 'User', 'password': PASSWORD})
+
+
+# Admin
+
+@routes('users')
+def admin_users(user):
+    user.request('users', 'GET', '/api/users/')
+
+
+@routes('user-profile', 'user')
+def admin_user(user):
+    data = user.request('user-profile', 'GET', '/api/users/profile/')
+    if data:
+        user.request('user', 'GET', '/api/users/%d/' % data['id'])
+
+
+@routes('user-update', 'user-delete')
+def admin_update_and_delete_user(user):
+    user_id = user.world.pop_spare_user()
+    if user_id is None:
+        return
+    user.request('user-update', 'PUT', '/api/users/update/%d/' % user_id,
+                 {'is-admin': False, 'email': 'updated%d@example.com' % user_id})
+    user.request('user-delete', 'DELETE', '/api/users/delete/%d/' % user_id)
+
+
+@routes('orders')
+def admin_orders(user):
+    user.request('orders', 'GET', '/api/orders/')
+
+
+@routes('orders-export')
+def admin_export(user):
+    output = user.rng.choice(['ndjson', 'csv'])
+    user.request('orders-export', 'GET', '/api/orders/export/?type=%s&isDelivered=false' % output)
+
+
+@routes('products-export')
+def admin_product_export(user):
+    output = user.rng.choice(['ndjson', 'csv'])
+    user.request('products-export', 'GET', '/api/products/export/?type=%s' % output)
+
+
+@routes('products-import')
+def admin_product_import(user):
+    # a price feed; the stock stays high enough for the checkouts
+    rows = ''.join('%d,%d,%d\n' % (pid, user.rng.randint(20, 2000), 10 ** 6)
+                   for pid in user.rng.sample(user.world.product_ids, IMPORT_ROWS))
+    user.request('products-import', 'POST', '/api/products/import/', 'id,price,countInStock\n' + rows,
+                 content_type='text/csv')
+
+
+@routes('order-delivered')
+def admin_deliver(user):
+    order_id = user.world.any_order(user.rng)
+    if order_id is not None:
+        user.request('order-delivered', 'PUT', '/api/orders/%d/deliver/' % order_id)
+
+
+@routes('product-create', 'product-update', 'product-delete')
+def admin_product_lifecycle(user):
+    fields = {'name': 'Load test product', 'price': 99, 'description': 'Created by the load test',
+              'category': user.rng.choice(['GPU', 'Monitor']), 'count-in-stock': 5}
+    data = user.request('product-create', 'POST', '/api/products/create/', fields)
+    if not data or not data.get('id'):
+        return
+    user.request('product-update', 'PUT', '/api/products/update/%d/' % data['id'], dict(fields, price=89))
+    user.request('product-delete', 'DELETE', '/api/products/delete/%d/' % data['id'])
+
+
+@routes('product-cache-stats')
+def admin_cache_stats(user):
+    user.request('product-cache-stats', 'GET', '/api/products/cache/')
+
+
+@routes('metrics')
+def admin_metrics(user):
+    user.request('metrics', 'GET', '/api/metrics/')
+
+
+@routes('sales-daily', 'sales-products', 'sales-categories', 'sales-funnel')
+def admin_sales(user):
+    name, path = user.rng.choice([
+        ('sales-daily', '/api/sales/daily/'),
+        ('sales-products', '/api/sales/products/?limit=20'),
+        ('sales-categories', '/api/sales/categories/'),
+        ('sales-funnel', '/api/sales/funnel/'),
+    ])
+    user.request(name, 'GET', path)
+
+
+@routes('jobs', 'job')
+def admin_jobs(user):
+    data = user.request('jobs', 'GET', '/api/jobs/')
+    if data and data['jobs']:
+        user.request('job', 'GET', '/api/jobs/%d/' % user.rng.choice(data['jobs'])['id'])
+
+
+BROWSE = [
+    (30, browse_products), (10, browse_search), (10, browse_cursor), (8, browse_top),
+    (4, browse_top_category), (20, browse_product), (8, browse_category), (4, browse_categories),
+    (6, browse_async),
+]
+
+SCENARIOS = {
+    'browse': {'role': None, 'steps': BROWSE},
+    'checkout': {'role': 'shopper', 'steps': [
+        (20, browse_products), (15, browse_product), (15, checkout), (8, my_orders), (8, my_order),
+        (6, review), (6, profile), (2, update_profile), (3, login), (1, register),
+    ]},
+    'admin': {'role': 'admin', 'steps': [
+        (10, admin_users), (5, admin_user), (4, admin_update_and_delete_user), (10, admin_orders),
+        (4, admin_export), (6, admin_deliver), (6, admin_product_lifecycle), (3, admin_cache_stats),
+        (2, admin_metrics), (4, admin_sales), (2, admin_jobs), (1, admin_product_export),
+        (1, admin_product_import), (10, browse_products), (4, checkout),
+    ]},
+}
+
+
+def route_names():
+    names = set()
+    for module in URL_MODULES:
+        names.update(pattern.name for pattern in import_module(module).urlpatterns if pattern.name)
+    return names
+
+
+def run_scenario(name, port, world, concurrency, requests, seed):
+    scenario = SCENARIOS[name]
+    weights, steps = zip(*scenario['steps'])
+    accounts = {'shopper': world.shoppers, 'admin': world.admins}.get(scenario['role'])
+    users = [VirtualUser(port, world, accounts[i % len(accounts)] if accounts else None, seed='%s:%s:%d' % (seed, name, i))
+             for i in range(concurrency)]
+
+    # Every user walks its own seeded sequence of steps, so two runs issue
+    # the same requests whatever the thread scheduling
+    def drive(user, count):
+        if user.username:
+            user.login()
+        for _ in range(count):
+            user.rng.choices(steps, weights)[0](user)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=drive, args=(user, requests // concurrency + (i < requests % concurrency)))
+               for i, user in enumerate(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - started
+
+    recorder = Recorder()
+    for user in users:
+        recorder.merge(user.recorder)
+        user.connection.close()
+    return recorder, seconds
+
+
+def read_query_log(path):
+    """Request id -> query count of the streamed responses, see benchmarks.middleware."""
+    with open(path) as log:
+        return {request_id: int(count) for request_id, count in (line.split() for line in log)}
+
+
+def compare(results, baseline, threshold, noise_ms):
+    """Endpoints that got slower than `threshold` (p95), lost throughput, or run more queries."""
+    regressions = []
+    for scenario, current in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(scenario)
+        if not previous:
+            continue
+        if current['requests_per_second'] < previous['requests_per_second'] * (1 - threshold):
+            regressions.append({'scenario': scenario, 'metric': 'requests_per_second',
+                                'baseline': previous['requests_per_second'], 'current': current['requests_per_second']})
+        for endpoint, stats in current['endpoints'].items():
+            before = previous['endpoints'].get(endpoint)
+            if not before:
+                continue
+            if stats['p95_ms'] > before['p95_ms'] * (1 + threshold) and stats['p95_ms'] - before['p95_ms'] > noise_ms:
+                regressions.append({'scenario': scenario, 'endpoint': endpoint, 'metric': 'p95_ms',
+                                    'baseline': before['p95_ms'], 'current': stats['p95_ms']})
+            if (stats['queries_mean'] is not None and before['queries_mean'] is not None
+                    and stats['queries_mean'] > before['queries_mean'] + 0.5):
+                regressions.append({'scenario': scenario, 'endpoint': endpoint, 'metric': 'queries_mean',
+                                    'baseline': before['queries_mean'], 'current': stats['queries_mean']})
+            if stats['errors'] > before['errors']:
+                regressions.append({'scenario': scenario, 'endpoint': endpoint, 'metric': 'errors',
+                                    'baseline': before['errors'], 'current': stats['errors']})
+    return regressions
+
+
+def print_summary(results, out):
+    for scenario, report in results['scenarios'].items():
+        out.write('\n%s: %d requests, %.1f req/s, %d errors\n' % (
+            scenario, report['requests'], report['requests_per_second'], report['errors']))
+        out.write('  %-26s %7s %6s %9s %9s %9s %8s\n' % ('endpoint', 'count', 'errors', 'p50 ms', 'p95 ms', 'p99 ms', 'queries'))
+        for name, stats in report['endpoints'].items():
+            out.write('  %-26s %7d %6d %9.1f %9.1f %9.1f %8s\n' % (
+                name, stats['requests'], stats['errors'], stats['p50_ms'], stats['p95_ms'], stats['p99_ms'],
+                stats['queries_mean'] if stats['queries_mean'] is not None else '-'))
+    if results.get('uncovered'):
+        out.write('\nroutes not exercised: %s\n' % ', '.join(results['uncovered']))
+    for regression in results.get('regressions', []):
+        out.write('REGRESSION %s\n' % json.dumps(regression))
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--server', choices=sorted(SERVERS), default='gunicorn')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS), default=['browse', 'checkout', 'admin'])
+    parser.add_argument('--concurrency', type=int, default=16, help='virtual users per scenario')
+    parser.add_argument('--requests', type=int, default=1000, help='scenario steps per scenario')
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--shoppers', type=int, default=100)
+    parser.add_argument('--cache', action=argparse.BooleanOptionalAction, default=True, help='catalog cache')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the virtual users\' request sequences')
+    parser.add_argument('--output', help='write the JSON results here instead of stdout')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2, help='tolerated p95/throughput change (0.2 = 20%%)')
+    parser.add_argument('--noise-ms', type=float, default=5.0, help='p95 changes below this are never flagged')
+    args = parser.parse_args()
+
+    setup_django()
+    from django.db import connection
+
+    uncovered = sorted(route_names() - {
+        name for scenario in SCENARIOS.values() for _, step in scenario['steps'] for name in step.routes})
+
+    with benchmark_database():
+        world = seed(args.products, args.shoppers, admins=4, spare_users=args.requests)
+        vendor = connection.vendor
+        runs = {}
+        with tempfile.NamedTemporaryFile(suffix='.log') as query_log:
+            # the server closes, and logs, every streamed response before it exits
+            with serve(args.server, workers=args.workers, cache=args.cache, query_log=query_log.name) as port:
+                for name in args.scenarios:
+                    sys.stderr.write('running %s...\n' % name)
+                    runs[name] = run_scenario(name, port, world, args.concurrency, args.requests, args.seed)
+            logged_queries = read_query_log(query_log.name)
+        scenarios = {name: recorder.report(seconds, logged_queries) for name, (recorder, seconds) in runs.items()}
+
+    results = {
+        'meta': {
+            'revision': git_revision(), 'server': args.server, 'workers': args.workers, 'vendor': vendor,
+            'concurrency': args.concurrency, 'requests': args.requests, 'products': args.products,
+            'cache': args.cache, 'seed': args.seed, 'cpus': os.cpu_count(),
+        },
+        'scenarios': scenarios,
+        'uncovered': uncovered,
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            results['regressions'] = compare(results, json.load(f), args.threshold, args.noise_ms)
+
+    print_summary(results, sys.stderr)
+    encoded = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(encoded + '\n')
+    else:
+        print(encoded)
+
+    if results.get('regressions'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
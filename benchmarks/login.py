@@ -0,0 +1,104 @@
+"""
+Login throughput benchmark.
+
+Creates users with a known password and fires token_obtain_pair requests at
+them from parallel threads, once per PBKDF2 work factor given:
+
+    python -m benchmarks.login --threads 8 --logins 200 --iterations 1000000 600000 100000
+
+Logins per core is the number of logins over the process CPU time they
+took, which does not depend on how many cores the machine has.
+"""
+import argparse
+import json
+import os
+import threading
+import time
+
+from benchmarks.utils import benchmark_database, setup_django, summarize
+
+PASSWORD = 'bench-secret-1'
+
+
+def run(threads, logins, users, iterations):
+    from django.conf import settings
+    from django.contrib.auth.hashers import make_password
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from django.urls import reverse
+    from rest_framework.test import APIClient
+
+    settings.PASSWORD_HASH_ITERATIONS = iterations
+    User.objects.all().delete()
+    # one hash for everyone, the benchmark is about verifying them
+    encoded = make_password(PASSWORD)
+    User.objects.bulk_create(User(username='bench%d' % i, password=encoded) for i in range(users))
+    url = reverse('token_obtain_pair')
+
+    failures = []
+    latencies = []
+    lock = threading.Lock()
+    remaining = iter(range(logins))
+
+    def worker():
+        client = APIClient()
+        try:
+            while True:
+                with lock:
+                    i = next(remaining, None)
+                if i is None:
+                    return
+                started = time.perf_counter()
+                response = client.post(url, {'username': 'bench%d' % (i % users), 'password': PASSWORD},
+                                       format='json')
+                elapsed = time.perf_counter() - started
+                with lock:
+                    latencies.append(elapsed)
+                    if response.status_code != 200:
+                        failures.append(response.status_code)
+        finally:
+            connection.close()
+
+    started, cpu = time.perf_counter(), time.process_time()
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed, cpu = time.perf_counter() - started, time.process_time() - cpu
+
+    return {
+        'iterations': iterations,
+        'threads': threads,
+        'hashing_workers': settings.PASSWORD_HASHING_WORKERS,
+        'logins': logins,
+        'failures': len(failures),
+        'seconds': round(elapsed, 3),
+        'logins_per_second': round(logins / elapsed, 1),
+        'logins_per_core_second': round(logins / cpu, 1),
+        'latency': summarize(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--iterations', type=int, nargs='+', default=[None],
+                        help='PBKDF2 iterations to compare, Django\'s default when left out')
+    args = parser.parse_args()
+
+    setup_django()
+    from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+    with benchmark_database():
+        report = [run(args.threads, args.logins, args.users, iterations or PBKDF2PasswordHasher.iterations)
+                  for iterations in args.iterations]
+    print(json.dumps({'cpus': os.cpu_count(), 'runs': report}, indent=2))
+    if any(run['failures'] for run in report):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
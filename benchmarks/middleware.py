@@ -0,0 +1,88 @@
+"""
+Query counting for the benchmark servers.
+
+Every database connection, whatever its alias and whichever thread opened
+it (the sync_to_async threads of the async views included), gets a counting
+execute wrapper when it connects. The wrapper counts for the request of the
+current context, so concurrent requests on one thread keep their own counts.
+
+A plain response carries its count in an X-Query-Count header. A streaming
+one runs most of its queries while its body is sent, after the headers, so
+its count is only final when the response closes: it is then appended to
+BENCHMARK_QUERY_LOG as "<X-Request-Id> <count>" lines for the load test.
+"""
+import os
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+class Queries:
+    def __init__(self):
+        self.count = 0
+        self.counting = True
+
+
+_queries = ContextVar('benchmark_queries', default=None)
+
+
+def count_query(execute, sql, params, many, context):
+    queries = _queries.get()
+    if queries is not None and queries.counting:
+        queries.count += 1
+    return execute(sql, params, many, context)
+
+
+@receiver(connection_created)
+def install_counter(sender, connection, **kwargs):
+    # the wrapper stays on the connection object when it reconnects
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+class QueryCountMiddleware:
+    """Report the number of SQL statements each request ran, see the module docstring."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.log = os.environ.get('BENCHMARK_QUERY_LOG')
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        queries = self.start()
+        return self.finish(request, self.get_response(request), queries)
+
+    async def __acall__(self, request):
+        queries = self.start()
+        return self.finish(request, await self.get_response(request), queries)
+
+    def start(self):
+        # left set after the view returns, for the body of a streaming response
+        queries = Queries()
+        _queries.set(queries)
+        return queries
+
+    def finish(self, request, response, queries):
+        if not response.streaming:
+            queries.counting = False
+            response['X-Query-Count'] = str(queries.count)
+            return response
+
+        request_id = request.headers.get('X-Request-Id')
+
+        def closed():
+            queries.counting = False
+            if self.log and request_id:
+                with open(self.log, 'a') as log:
+                    log.write('%s %d\n' % (request_id, queries.count))
+
+        response._resource_closers.append(closed)
+        return response
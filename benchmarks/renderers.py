@@ -0,0 +1,89 @@
+"""
+JSON encoding micro-benchmark.
+
+Seeds a scratch database, serializes the payloads of a few heavy endpoints
+once (all orders, all users, a category listing) and then times DRF's
+JSONRenderer/JSONParser against the orjson-backed pair in api/renderers.py
+on exactly those documents:
+
+    python -m benchmarks.renderers --orders 2000 --products 5000 --repeat 20
+"""
+import argparse
+import json
+import time
+from io import BytesIO, StringIO
+
+from benchmarks.utils import benchmark_database, setup_django
+
+
+def payloads(orders, users, products):
+    from django.contrib.auth.models import User
+    from django.core.management import call_command
+
+    from api.models import Category, Order, Product
+    from api.serializers import OrderSerializer, ProductSerializer, UserSerializer
+
+    call_command('seed', users=users, products=products, reviews=products, orders=orders, stdout=StringIO())
+    category = Category.objects.order_by('-productCount').first()
+    listing = ProductSerializer.load_only(Product.objects.filter(category=category), ProductSerializer.LIST_FIELDS)
+    return {
+        'getOrders': OrderSerializer(Order.objects.with_details(), many=True).data,
+        'getUsers': UserSerializer(User.objects.all(), many=True).data,
+        'getCategoryOfProducts': ProductSerializer(listing, many=True, fields=ProductSerializer.LIST_FIELDS).data,
+        'getCategoryOfProducts?fields=all': ProductSerializer(Product.objects.filter(category=category), many=True).data,
+    }
+
+
+def best_of(function, repeat):
+    """Fastest of `repeat` runs, the least disturbed by the rest of the machine."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def measure(data, repeat):
+    from rest_framework.parsers import JSONParser
+    from rest_framework.renderers import JSONRenderer
+
+    from api.renderers import FastJSONParser, FastJSONRenderer
+
+    body = JSONRenderer().render(data)
+    assert json.loads(FastJSONRenderer().render(data)) == json.loads(body)
+    megabytes = len(body) / 1e6
+
+    result = {'bytes': len(body)}
+    for action, stock, fast in (
+        ('render', lambda: JSONRenderer().render(data), lambda: FastJSONRenderer().render(data)),
+        ('parse', lambda: JSONParser().parse(BytesIO(body)), lambda: FastJSONParser().parse(BytesIO(body))),
+    ):
+        stock, fast = best_of(stock, repeat), best_of(fast, repeat)
+        result[action] = {
+            'stock_ms': round(stock * 1000, 3),
+            'fast_ms': round(fast * 1000, 3),
+            'stock_mb_per_second': round(megabytes / stock, 1),
+            'fast_mb_per_second': round(megabytes / fast, 1),
+            'speedup': round(stock / fast, 2),
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--orders', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    setup_django()
+    with benchmark_database():
+        documents = payloads(args.orders, args.users, args.products)
+        report = {name: measure(data, args.repeat) for name, data in documents.items()}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
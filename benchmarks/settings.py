@@ -0,0 +1,29 @@
+"""
+Settings for the servers the benchmarks start in subprocesses: the project
+settings pointed at the benchmark's scratch database.
+
+BENCHMARK_DATABASE  name of the scratch database to serve (a file for SQLite)
+BENCHMARK_CACHE     "off" swaps the catalog cache for a dummy one, so every
+                    request reaches the database
+BENCHMARK_QUERY_LOG file the query counts of streamed responses go to
+"""
+import os
+
+from base.settings import *  # noqa: F401,F403
+
+
+DEBUG = False
+ALLOWED_HOSTS = ['127.0.0.1', 'localhost']
+
+DATABASES['default']['NAME'] = os.environ['BENCHMARK_DATABASE']
+if DATABASES['default']['ENGINE'].endswith('sqlite3'):
+    DATABASES['default'].setdefault('OPTIONS', {}).update({'timeout': 30, 'transaction_mode': 'IMMEDIATE'})
+    # the scratch file is served like a deployment, readers beside writers
+    if 'journal_mode' not in DATABASES['default']['OPTIONS'].get('init_command', ''):
+        DATABASES['default']['OPTIONS']['init_command'] = 'PRAGMA journal_mode=WAL; ' + SQLITE_PRAGMAS
+
+# Every response reports the number of queries it ran
+MIDDLEWARE = ['benchmarks.middleware.QueryCountMiddleware'] + MIDDLEWARE
+
+if os.environ.get('BENCHMARK_CACHE') == 'off':
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
@@ -0,0 +1,123 @@
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+
+HOST = '127.0.0.1'
+
+# Ways to serve the project, see serve()
+SERVERS = {
+    'runserver': [sys.executable, 'manage.py', 'runserver', '%s:{port}' % HOST, '--noreload'],
+    'gunicorn': ['gunicorn', 'base.wsgi:application', '--worker-class', 'sync', '--workers', '{workers}',
+                 '--bind', '%s:{port}' % HOST, '--log-level', 'warning'],
+    'uvicorn': ['uvicorn', 'base.asgi:application', '--workers', '{workers}', '--host', HOST,
+                '--port', '{port}', '--log-level', 'warning', '--no-access-log'],
+}
+
+
+def setup_django():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'base.settings')
+    import django
+
+    django.setup()
+
+
+@contextmanager
+def benchmark_database():
+    """
+    Create a scratch copy of the schema for the duration of the block.
+
+    SQLite gets a file database (an in-memory one serialises every
+    connection) with IMMEDIATE transactions and a generous busy timeout,
+    so parallel writers queue up instead of failing.
+    """
+    from django.conf import settings
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    db = settings.DATABASES['default']
+    tmp = None
+    if connection.vendor == 'sqlite':
+        tmp = tempfile.NamedTemporaryFile(suffix='.sqlite3', delete=False)
+        tmp.close()
+        db.setdefault('TEST', {})['NAME'] = tmp.name
+        db.setdefault('OPTIONS', {}).update({'timeout': 30, 'transaction_mode': 'IMMEDIATE'})
+
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+        if tmp is not None and os.path.exists(tmp.name):
+            os.unlink(tmp.name)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(pct / 100.0 * len(values))) - 1))
+    return values[index]
+
+
+def summarize(latencies):
+    """p50/p95/p99/mean of `latencies` (seconds) in milliseconds."""
+    return {
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 2) if latencies else 0.0,
+    }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind((HOST, 0))
+        return s.getsockname()[1]
+
+
+def _wait_for(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit('server exited with %s' % process.returncode)
+        try:
+            socket.create_connection((HOST, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise SystemExit('server did not start on port %d' % port)
+
+
+@contextmanager
+def serve(server, workers=1, cache=True, query_log=None):
+    """
+    Run the project with `server` (a SERVERS key) in a subprocess, on the
+    database of the enclosing benchmark_database() block, and yield its
+    port. The query counts of streamed responses are appended to the file
+    `query_log` (see benchmarks.middleware). Raises FileNotFoundError when
+    the server is not installed.
+    """
+    from django.db import connection
+
+    port = free_port()
+    command = [part.format(workers=workers, port=port) for part in SERVERS[server]]
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE='benchmarks.settings',
+               BENCHMARK_DATABASE=str(connection.settings_dict['NAME']),
+               BENCHMARK_CACHE='on' if cache else 'off', BENCHMARK_QUERY_LOG=query_log or '')
+    # let the server see everything written so far
+    connection.close()
+    process = subprocess.Popen(command, env=env)
+    try:
+        _wait_for(port, process)
+        yield port
+    finally:
+        process.terminate()
+        process.wait(10)